@@ -3,7 +3,8 @@
 # Author: James Smith - james@smithjw.me
 # Version 3.6.0
 
-/usr/bin/defaults write /Library/Management/management_info.plist enrol_initial_policy_start "$(date +%s)"
+enrolment_start=$(date +%s)
+/usr/bin/defaults write /Library/Management/management_info.plist enrol_initial_policy_start "$enrolment_start"
 
 working_dir="/private/var/tmp"
 identifier_prefix="com.github.smithjw"
@@ -11,13 +12,19 @@ enrolment_base_string="${identifier_prefix}.mac.swiftEnrolment"
 enrolment_script="${working_dir}/${enrolment_base_string}.sh"
 enrolment_launchdaemon="/Library/LaunchDaemons/${enrolment_base_string}.plist"
 post_enrolment_launchdaemon="/Library/LaunchDaemons/${enrolment_base_string}_post.plist"
-jamf_binary="/usr/local/jamf/bin/jamf"
+jamf_binary="${SWIFTENROLMENT_JAMF_BINARY:-/usr/local/jamf/bin/jamf}"
 fde_setup_binary="/usr/bin/fdesetup"
 self_service_branding_icon_name="brandingimage.png"
 self_service_branding_icon_location="/Library/Management/images"
 self_service_branding_icon_url="https://COMPANY.jamfcloud.com/api/v1/branding-images/download/9"
-dialog_app="/usr/local/bin/dialog"
+self_service_branding_icon="${self_service_branding_icon_location}/${self_service_branding_icon_name}"
+self_service_branding_icon_max_age=1440 # minutes, matches branding_icon_max_age in _user_walkthrough.py
+download_mirrors_file="/Library/Management/download_mirrors"
+download_mirror_connect_timeout=3
+dialog_app="${SWIFTENROLMENT_DIALOG_BINARY:-/usr/local/bin/dialog}"
 dialog_command_file="${working_dir}/dialog.log"
+python_binary="/usr/local/bin/managed_python3"
+enrolment_helper="/Library/Management/Scripts/_user_walkthrough.py"
 dialog_icon="/Library/Management/images/company_logo.png"
 dialog_title="COMPANY Device Enrolment"
 dialog_title_complete="You're all done!"
@@ -29,6 +36,10 @@ dialog_status_complete="Configuration Complete!"
 
 log_folder="/private/var/log"
 log_name="management.log"
+# Spans are only written when tracing is asked for, as with _user_walkthrough.py -trace:
+# run with -T, or set SWIFTENROLMENT_TRACE_FILE to choose the file
+trace_file="${SWIFTENROLMENT_TRACE_FILE:-}"
+trace_file_default="${log_folder}/swiftEnrolment_trace.jsonl"
 
 dialog_cmd=(
     -p
@@ -183,12 +194,120 @@ echo_logger_heading() {
     echo_logger "#########################################################################"
 }
 
+trace_span() {
+    # Appends a timing span in the JSON Lines format of the Tracer in _user_walkthrough.py
+    # Usage: trace_span kind name start end [exit_code] [index]
+    [[ -n "$trace_file" ]] || return 0
+    printf '{"source": "enrolment", "kind": "%s", "name": "%s", "start": %s, "end": %s, "duration": %s%s%s}\n' \
+        "$1" "$2" "$3" "$4" "$(( $4 - $3 ))" "${5:+, \"exit_code\": $5}" "${6:+, \"index\": $6}" >> "$trace_file"
+}
+
 dialog_update() {
     echo_logger "DIALOG: $1"
+    # SIGPIPE is only ignored in the subshell, so a dead channel fails the write rather
+    # than killing this script, without changing how jamf, curl and the rest handle it
+    if [[ -n "$dialog_channel_pid" ]] && kill -0 "$dialog_channel_pid" 2> /dev/null \
+        && ( trap '' PIPE; echo "$1" >&3 ) 2> /dev/null; then
+        return
+    fi
     # shellcheck disable=2001
     echo "$1" >> "$dialog_command_file"
 }
 
+dialog_channel_start() {
+    # Hand dialog_update lines to the buffered command channel in _user_walkthrough.py,
+    # which batches them and merges superseded listitem updates. Without Python we
+    # fall back to appending to the command file directly.
+    if [[ -x "$python_binary" && -f "$enrolment_helper" && -z "$dialog_channel_pid" ]]; then
+        dialog_channel_fifo="${working_dir}/dialog_channel.$$"
+        /usr/bin/mkfifo "$dialog_channel_fifo" || return
+        "$python_binary" "$enrolment_helper" -dialog-channel "$dialog_command_file" < "$dialog_channel_fifo" &
+        dialog_channel_pid=$!
+        exec 3> "$dialog_channel_fifo"
+        /bin/rm -f "$dialog_channel_fifo"
+        echo_logger "INFO: dialog_update using command channel, PID $dialog_channel_pid"
+    fi
+}
+
+dialog_channel_stop() {
+    # Closing the pipe lets the channel write anything still queued and exit
+    if [[ -n "$dialog_channel_pid" ]]; then
+        exec 3>&-
+        wait "$dialog_channel_pid"
+        unset dialog_channel_pid
+    fi
+}
+
+download_urls() {
+    # Usage: download_urls url
+    # Prints each mirror's copy of url (http://mirror:8080/host/path) in order, then url itself.
+    # Mirrors come from SWIFTENROLMENT_MIRRORS (space separated) or one per line in
+    # $download_mirrors_file, and match download_mirrors in _user_walkthrough.py
+    local url="$1" mirror
+    local mirrors="$SWIFTENROLMENT_MIRRORS"
+
+    if [[ -z "$mirrors" && -f "$download_mirrors_file" ]]; then
+        mirrors=$(/usr/bin/grep -v '^[[:space:]]*#' "$download_mirrors_file")
+    fi
+    for mirror in $mirrors; do
+        echo "${mirror%/}/${url#*://}"
+    done
+    echo "$url"
+}
+
+mirrored_curl() {
+    # Usage: mirrored_curl [curl options...] url
+    # Runs curl against each of download_urls in turn until one succeeds. Pass -f so an
+    # HTTP error from a mirror falls through to the next one rather than being saved.
+    local url="${!#}" candidate
+    local curl_args=("${@:1:$#-1}")
+
+    while read -r candidate; do
+        if [[ "$candidate" == "$url" ]]; then
+            /usr/bin/curl "${curl_args[@]}" "$candidate"
+            return
+        fi
+        # A dead mirror should cost seconds, not the whole download timeout
+        /usr/bin/curl --connect-timeout "$download_mirror_connect_timeout" "${curl_args[@]}" "$candidate" && return 0
+    done < <(download_urls "$url")
+}
+
+get_branding_icon() {
+    # Shares its cache with _user_walkthrough.py: the ETag is saved next to the icon
+    # and the icon's mtime is the server's Last-Modified. A recently validated icon
+    # is used as is, otherwise a conditional request only downloads it if it changed.
+    local etag_file="${self_service_branding_icon}.etag"
+    local temp_icon="${self_service_branding_icon}.download"
+    local http_code
+
+    if [[ -f "$self_service_branding_icon" && -n $(/usr/bin/find "$etag_file" -mmin -"$self_service_branding_icon_max_age" 2> /dev/null) ]]; then
+        echo_logger "INFO: Branding icon already on disk"
+        return 0
+    fi
+
+    /bin/mkdir -p "${self_service_branding_icon%/*}"
+    local curl_args=(-fsSL --max-time 30 -R -o "$temp_icon" --etag-save "${etag_file}.new" -w '%{http_code}')
+    if [[ -f "$self_service_branding_icon" ]]; then
+        curl_args+=(-z "$self_service_branding_icon" --etag-compare "$etag_file")
+    fi
+
+    http_code=$(mirrored_curl "${curl_args[@]}" "$self_service_branding_icon_url")
+    # Every failed mirror adds its own code, the last one is the attempt that counts
+    http_code="${http_code: -3}"
+    case "$http_code" in
+        200)
+            /bin/mv -f "$temp_icon" "$self_service_branding_icon"
+            /bin/mv -f "${etag_file}.new" "$etag_file"
+            ;;
+        304)
+            /usr/bin/touch "$etag_file"
+            ;;
+    esac
+    /bin/rm -f "$temp_icon" "${etag_file}.new"
+
+    [[ -f "$self_service_branding_icon" ]]
+}
+
 get_json_value() {
     JSON="$1" /usr/bin/osascript -l 'JavaScript' \
         -e 'const env = $.NSProcessInfo.processInfo.environment.objectForKey("JSON").js' \
@@ -196,21 +315,32 @@ get_json_value() {
 }
 
 run_jamf_trigger() {
+    # Usage: run_jamf_trigger trigger [step_index]
     trigger="$1"
+    trigger_start=$(date +%s)
     if [ "$testing_mode" = true ]; then
         echo_logger "TESTING: $trigger"
         /bin/sleep 1
+        trigger_exit=0
     elif [ "$trigger" == "recon" ]; then
         echo_logger "RUNNING: $jamf_binary $trigger"
-        "$jamf_binary" "$trigger"
+        if [[ -x "$python_binary" && -f "$enrolment_helper" ]]; then
+            # Recorded so 001_post_enrolment.sh and the walkthrough don't submit it again
+            "$python_binary" "$enrolment_helper" -recon "enrolment" -jamf-binary "$jamf_binary"
+        else
+            "$jamf_binary" "$trigger"
+        fi
+        trigger_exit=$?
     else
         echo_logger "RUNNING: $jamf_binary policy -event $trigger"
         "$jamf_binary" policy -event "$trigger"
+        trigger_exit=$?
     fi
+    trace_span "trigger" "$trigger" "$trigger_start" "$(date +%s)" "$trigger_exit" "$2"
 }
 
-# Run script with -t to enable testing_mode
-while getopts "t" o; do
+# Run script with -t to enable testing_mode, and -T to write a trace
+while getopts "tT" o; do
     case "${o}" in
         t)
             echo_logger "TESTING: Testing mode enabled"
@@ -218,11 +348,19 @@ while getopts "t" o; do
             echo_logger "TESTING: No management files will be written"
             testing_mode=true
             ;;
+        T)
+            trace_file="${trace_file:-$trace_file_default}"
+            ;;
         *)
             ;;
     esac
 done
 
+if [[ "$testing_mode" = true && -n "$trace_file" ]]; then
+    echo_logger "TESTING: Not writing a trace to $trace_file"
+    trace_file=""
+fi
+
 #########################################################################################
 # Policy kickoff
 #########################################################################################
@@ -240,6 +378,7 @@ else
     dialog_update "progresstext: $dialog_status_initial"
 fi
 
+dialog_channel_start
 dialog_update "progress: complete"
 
 logged_in_user=$( scutil <<< "show State:/Users/ConsoleUser" | awk '/Name :/ && ! /loginwindow/ { print $3 }' )
@@ -253,29 +392,29 @@ echo_logger "INFO:   logged_in_user_uid: $logged_in_user_uid"
 self_service_custom_icon="$logged_in_user_home/Library/Application Support/com.jamfsoftware.selfservice.mac/Documents/Images/brandingimage.png"
 self_service_path=$( /usr/bin/defaults read /Library/Preferences/com.jamfsoftware.jamf.plist self_service_app_path )
 
-if /usr/bin/curl -JLo "$self_service_branding_icon_name" --create-dirs --output-dir "$self_service_branding_icon_location" "$self_service_branding_icon_url"; then
-    self_service_branding_icon="$self_service_branding_icon_location/$self_service_branding_icon_name"
-    if [[ -f "$self_service_branding_icon" ]]; then
-        dialog_overlayicon="$self_service_branding_icon"
-    fi
+branding_icon_start=$(date +%s)
+if get_branding_icon; then
+    dialog_overlayicon="$self_service_branding_icon"
 elif [[ -f "$self_service_custom_icon" ]]; then
     dialog_overlayicon="$self_service_custom_icon"
 else
     dialog_overlayicon="$self_service_path"
 fi
 
+trace_span "download" "branding_icon" "$branding_icon_start" "$(date +%s)"
+
 echo_logger "INFO: self_service_branding_icon: $self_service_branding_icon"
 
 #########################################################################################
 # Main Script Logic
 #########################################################################################
 
-# Iterate through policy_array json to construct the list for swiftDialog
-dialog_step_length=$(get_json_value "${policy_array[*]}" "steps.length")
-for (( i=0; i<dialog_step_length; i++ )); do
-    listitem=$(get_json_value "${policy_array[*]}" "steps[$i].listitem")
-    list_item_array+=("$listitem")
-done
+# The step engine in _user_walkthrough.py parses policy_array once, rather than launching
+# osascript for every field of every step. It needs Python, so that's installed first.
+if [[ ! -x "$python_binary" && "$testing_mode" != true ]]; then
+    echo_logger "INFO: Installing Python for the step engine"
+    run_jamf_trigger "install-Python"
+fi
 
 # Updating swiftDialog with the list of items
 dialog_update "overlayicon: $dialog_overlayicon"
@@ -284,45 +423,77 @@ dialog_update "icon: $dialog_icon"
 dialog_update "message: $dialog_message"
 dialog_update "progresstext: "
 
-list_item_string=${list_item_array[*]/%/,}
-dialog_update "list: ${list_item_string%?}"
-for (( i=0; i<dialog_step_length; i++ )); do
-    dialog_update "listitem: index: $i, status: pending, statustext: Pending..."
-done
-# The ${array_name[*]/%/,} expansion will combine all items within the array adding a "," character at the end
-# To add a character to the start, use "/#/" instead of the "/%/"
-
-if [ "$testing_mode" = true ]; then /bin/sleep 2; fi
-
-# This for loop will iterate over each distinct step in the policy_array array
-for (( i=0; i<dialog_step_length; i++ )); do
-    # Creating initial variables
-    listitem=$(get_json_value "${policy_array[*]}" "steps[$i].listitem")
-    icon=$(get_json_value "${policy_array[*]}" "steps[$i].icon")
-    progresstext=$(get_json_value "${policy_array[*]}" "steps[$i].progresstext")
-    trigger_list_length=$(get_json_value "${policy_array[*]}" "steps[$i].trigger_list.length")
-
-    # If there's a value in the variable, update running swiftDialog
-    # if [[ -n "$listitem" ]]; then dialog_update "listitem: $listitem: wait"; fi
-    if [[ -n "$listitem" ]]; then dialog_update "listitem: index: $i, status: wait, statustext: Downloading..."; fi
-    if [[ -n "$icon" ]]; then dialog_update "icon: $icon"; fi
-    if [[ -n "$progresstext" ]]; then dialog_update "progresstext: $progresstext"; fi
-    if [[ -n "$trigger_list_length" ]]; then
-        for (( j=0; j<trigger_list_length; j++ )); do
-            # Setting variables within the trigger_list
-            trigger=$(get_json_value "${policy_array[*]}" "steps[$i].trigger_list[$j].trigger")
-            path=$(get_json_value "${policy_array[*]}" "steps[$i].trigger_list[$j].path")
-
-            # If the path variable has a value, check if that path exists on disk
-            if [[ -f "$path" ]]; then
-                echo_logger "INFO: $path exists, moving on"
-            else
-                run_jamf_trigger "$trigger"
-            fi
-        done
+# Steps before first_step were finished by the step engine before it failed
+first_step=0
+bash_steps=true
+if [[ -x "$python_binary" && -f "$enrolment_helper" ]]; then
+    echo_logger "INFO: Running policy_array with the step engine"
+    steps_done_file="${working_dir}/swiftEnrolment_steps_done.$$"
+    # The engine writes to the command file itself, so let the channel finish first
+    dialog_channel_stop
+    if printf '%s' "${policy_array[*]}" | "$python_binary" "$enrolment_helper" -run-steps - -steps-done "$steps_done_file" ${testing_mode:+-testing} ${trace_file:+-trace "$trace_file"} -jamf-binary "$jamf_binary"; then
+        bash_steps=false
+    else
+        first_step=$(/bin/cat "$steps_done_file" 2> /dev/null)
+        first_step="${first_step:-0}"
+        echo_logger "WARNING: Step engine failed after $first_step steps, running the rest in bash"
     fi
-    if [[ -n "$listitem" ]]; then dialog_update "listitem: index: $i, status: success, statustext: Installed"; fi
-done
+    /bin/rm -f "$steps_done_file"
+    dialog_channel_start
+fi
+
+if [[ "$bash_steps" = true ]]; then
+    # Iterate through policy_array json to construct the list for swiftDialog
+    dialog_step_length=$(get_json_value "${policy_array[*]}" "steps.length")
+    for (( i=0; i<dialog_step_length; i++ )); do
+        listitem=$(get_json_value "${policy_array[*]}" "steps[$i].listitem")
+        list_item_array+=("$listitem")
+    done
+
+    list_item_string=${list_item_array[*]/%/,}
+    dialog_update "list: ${list_item_string%?}"
+    for (( i=0; i<dialog_step_length; i++ )); do
+        if (( i < first_step )); then
+            dialog_update "listitem: index: $i, status: success, statustext: Installed"
+        else
+            dialog_update "listitem: index: $i, status: pending, statustext: Pending..."
+        fi
+    done
+    # The ${array_name[*]/%/,} expansion will combine all items within the array adding a "," character at the end
+    # To add a character to the start, use "/#/" instead of the "/%/"
+
+    if [ "$testing_mode" = true ]; then /bin/sleep 2; fi
+
+    # This for loop will iterate over each distinct step in the policy_array array
+    for (( i=first_step; i<dialog_step_length; i++ )); do
+        # Creating initial variables
+        listitem=$(get_json_value "${policy_array[*]}" "steps[$i].listitem")
+        icon=$(get_json_value "${policy_array[*]}" "steps[$i].icon")
+        progresstext=$(get_json_value "${policy_array[*]}" "steps[$i].progresstext")
+        trigger_list_length=$(get_json_value "${policy_array[*]}" "steps[$i].trigger_list.length")
+
+        # If there's a value in the variable, update running swiftDialog
+        # if [[ -n "$listitem" ]]; then dialog_update "listitem: $listitem: wait"; fi
+        if [[ -n "$listitem" ]]; then dialog_update "listitem: index: $i, status: wait, statustext: Downloading..."; fi
+        if [[ -n "$icon" ]]; then dialog_update "icon: $icon"; fi
+        if [[ -n "$progresstext" ]]; then dialog_update "progresstext: $progresstext"; fi
+        if [[ -n "$trigger_list_length" ]]; then
+            for (( j=0; j<trigger_list_length; j++ )); do
+                # Setting variables within the trigger_list
+                trigger=$(get_json_value "${policy_array[*]}" "steps[$i].trigger_list[$j].trigger")
+                path=$(get_json_value "${policy_array[*]}" "steps[$i].trigger_list[$j].path")
+
+                # If the path variable has a value, check if that path exists on disk
+                if [[ -f "$path" ]]; then
+                    echo_logger "INFO: $path exists, moving on"
+                else
+                    run_jamf_trigger "$trigger" "$i"
+                fi
+            done
+        fi
+        if [[ -n "$listitem" ]]; then dialog_update "listitem: index: $i, status: success, statustext: Installed"; fi
+    done
+fi
 
 dialog_update "title: $dialog_title_complete"
 dialog_update "list: clear"
@@ -362,6 +533,7 @@ else
     if [ "$filevault_status" = "active" ]; then
         echo_logger "INFO: FileVault is deferred, logging out now"
         dialog_update "quit:"
+        dialog_channel_stop
         /bin/launchctl bootout user/"$logged_in_user_uid"
     else
         echo_logger "INFO: FileVault is already enabled, moving on"
@@ -379,4 +551,6 @@ else
     dialog_update "quit:"
 fi
 
+trace_span "phase" "enrol_initial_policy" "$enrolment_start" "$(date +%s)"
+dialog_channel_stop
 exit 0
@@ -4,8 +4,8 @@
 # Version 3.0
 
 jamf_binary="/usr/local/jamf/bin/jamf"
-jamf_process=$(pgrep -x "jamf")
-finder_process=$(pgrep -l "Finder")
+python_binary="/usr/local/bin/managed_python3"
+enrolment_helper="/Library/Management/Scripts/_user_walkthrough.py"
 log_folder="/private/var/log"
 log_name="swiftEnrolment.log"
 
@@ -18,24 +18,53 @@ echo_logger() {
     echo -e "$(date) - $1" | tee -a $log_folder/$log_name
 }
 
+wait_for_exit() {
+    # Usage: wait_for_exit process_name
+    # Waits until nothing called process_name is running. _user_walkthrough.py -wait-exit
+    # waits on kqueue NOTE_EXIT. Before managed_python3 is installed, caffeinate -w does
+    # the same for one pid at a time, and polling is the last resort.
+    local pid
+
+    if [[ -x "$python_binary" && -f "$enrolment_helper" ]]; then
+        "$python_binary" "$enrolment_helper" -log warning -wait-exit "$1" && return 0
+    fi
+
+    while pid=$(/usr/bin/pgrep -x "$1" | /usr/bin/head -1) && [[ -n "$pid" ]]; do
+        # caffeinate also holds off idle sleep until the process exits
+        /usr/bin/caffeinate -w "$pid" 2> /dev/null || /bin/sleep 1
+    done
+}
+
+wait_for_process() {
+    # Usage: wait_for_process process_name
+    # Waits until a process called process_name is running. macOS has no event for a
+    # process starting, -wait-for checks in-process every 100ms rather than forking pgrep.
+    if [[ -x "$python_binary" && -f "$enrolment_helper" ]]; then
+        "$python_binary" "$enrolment_helper" -log warning -wait-for "$1" && return 0
+    fi
+
+    until /usr/bin/pgrep -x "$1" > /dev/null; do
+        /bin/sleep 1
+    done
+}
+
 jamf_check() {
     trigger="$1"
     echo_logger "SCRIPT: Waiting until jamf is no longer running"
-    until [ ! "$jamf_process" ]; do
-        sleep 1
-        jamf_process=$(pgrep -x "jamf")
-    done
+    wait_for_exit "jamf"
 
     echo_logger "SCRIPT: Running \"jamf $trigger\""
-    $jamf_binary "$trigger"
+    if [[ "$trigger" == "recon" && -x "$python_binary" && -f "$enrolment_helper" ]]; then
+        # Skipped if 000_enrolment.sh's recon was recent, the walkthrough submits it at the end
+        "$python_binary" "$enrolment_helper" -log info -recon "post_enrolment" -jamf-binary "$jamf_binary"
+    else
+        $jamf_binary "$trigger"
+    fi
     sleep 2
 }
 
 echo_logger "SCRIPT: Waiting until Finder is running"
-until [ "$finder_process" != "" ]; do
-    sleep 1
-    finder_process=$(pgrep -l "Finder")
-done
+wait_for_process "Finder"
 
 defaults write /Library/Management/management_info.plist enrol_login_policy_start "$(date +%s)"
 
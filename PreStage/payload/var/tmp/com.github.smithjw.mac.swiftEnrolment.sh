@@ -12,6 +12,11 @@ log_name="swiftEnrolment.log"
 jamf_binary="/usr/local/bin/jamf"
 
 dialog_app="/usr/local/bin/dialog"
+# Bundled by build-pkg, only usable once enrolment has installed managed_python3
+python_binary="/usr/local/bin/managed_python3"
+enrolment_helper="/Library/Management/Scripts/_user_walkthrough.py"
+download_mirrors_file="/Library/Management/download_mirrors"
+download_mirror_connect_timeout=3
 dialog_command_file="/var/tmp/dialog.log"
 dialog_icon="/Library/Management/Images/company_logo.png"
 dialog_initial_title="Welcome to your new Mac"
@@ -90,6 +95,134 @@ get_json_value() {
         -e "JSON.parse(env).$2"
 }
 
+sha256() {
+    /usr/bin/shasum -a 256 "$1" 2> /dev/null | /usr/bin/awk '{ print $1 }'
+}
+
+download_urls() {
+    # Usage: download_urls url
+    # Prints each mirror's copy of url (http://mirror:8080/host/path) in order, then url itself.
+    # Mirrors come from SWIFTENROLMENT_MIRRORS (space separated) or one per line in
+    # $download_mirrors_file, and match download_mirrors in _user_walkthrough.py
+    local url="$1" mirror
+    local mirrors="$SWIFTENROLMENT_MIRRORS"
+
+    if [[ -z "$mirrors" && -f "$download_mirrors_file" ]]; then
+        mirrors=$(/usr/bin/grep -v '^[[:space:]]*#' "$download_mirrors_file")
+    fi
+    for mirror in $mirrors; do
+        echo "${mirror%/}/${url#*://}"
+    done
+    echo "$url"
+}
+
+mirrored_curl() {
+    # Usage: mirrored_curl [curl options...] url
+    # Runs curl against each of download_urls in turn until one succeeds. Pass -f so an
+    # HTTP error from a mirror falls through to the next one rather than being saved.
+    local url="${!#}" candidate
+    local curl_args=("${@:1:$#-1}")
+
+    while read -r candidate; do
+        if [[ "$candidate" == "$url" ]]; then
+            /usr/bin/curl "${curl_args[@]}" "$candidate"
+            return
+        fi
+        # A dead mirror should cost seconds, not the whole download timeout
+        /usr/bin/curl --connect-timeout "$download_mirror_connect_timeout" "${curl_args[@]}" "$candidate" && return 0
+    done < <(download_urls "$url")
+}
+
+wait_for_exit() {
+    # Usage: wait_for_exit process_name
+    # Waits until nothing called process_name is running. _user_walkthrough.py -wait-exit
+    # waits on kqueue NOTE_EXIT. Before managed_python3 is installed, caffeinate -w does
+    # the same for one pid at a time, and polling is the last resort.
+    local pid
+
+    if [[ -x "$python_binary" && -f "$enrolment_helper" ]]; then
+        "$python_binary" "$enrolment_helper" -log warning -wait-exit "$1" && return 0
+    fi
+
+    while pid=$(/usr/bin/pgrep -x "$1" | /usr/bin/head -1) && [[ -n "$pid" ]]; do
+        # caffeinate also holds off idle sleep until the process exits
+        /usr/bin/caffeinate -w "$pid" 2> /dev/null || /bin/sleep 1
+    done
+}
+
+wait_for_process() {
+    # Usage: wait_for_process process_name
+    # Waits until a process called process_name is running. macOS has no event for a
+    # process starting, -wait-for checks in-process every 100ms rather than forking pgrep.
+    if [[ -x "$python_binary" && -f "$enrolment_helper" ]]; then
+        "$python_binary" "$enrolment_helper" -log warning -wait-for "$1" && return 0
+    fi
+
+    until /usr/bin/pgrep -x "$1" > /dev/null; do
+        /bin/sleep 1
+    done
+}
+
+follow_jamf_log() {
+    # Watches $watch_log for enrollmentComplete without re-reading the whole log every second.
+    # The existing contents are checked once, then tail -F follows from that byte offset.
+    # tail -F waits on kqueue (macOS) or inotify (Linux) rather than polling, and re-opens
+    # the log if it's truncated or rotated. read's 1 second timeout keeps the progress bar
+    # and counter_limit ticking while jamf is quiet.
+    local log_offset line read_result tick
+    local log_fifo="/var/tmp/swiftEnrolment_jamf_log.$$"
+
+    log_offset=$(/usr/bin/wc -c < "$watch_log" | /usr/bin/tr -d ' ')
+    if /usr/bin/head -c "$log_offset" "$watch_log" | /usr/bin/grep -q enrollmentComplete; then
+        return 0
+    fi
+    dialog_update "progresstext: $(/usr/bin/tail -1 "$watch_log")"
+
+    /usr/bin/mkfifo "$log_fifo"
+    /usr/bin/tail -F -c +$(( log_offset + 1 )) "$watch_log" > "$log_fifo" 2> /dev/null &
+    tail_pid=$!
+    exec 4< "$log_fifo"
+    /bin/rm -f "$log_fifo"
+
+    tick=$SECONDS
+    while true; do
+        IFS= read -r -t 1 line <&4
+        read_result=$?
+
+        if [[ $read_result -eq 0 ]]; then
+            if [[ "$line" == *enrollmentComplete* ]]; then
+                break
+            fi
+            dialog_update "progresstext: $line"
+        elif ! kill -0 "$tail_pid" 2> /dev/null; then
+            # bash 3.2's read -t returns 1 for a timeout as well as end of file, so only the
+            # tail process itself says whether it has gone away. Don't spin while
+            # counter_limit runs out
+            sleep 1
+        fi
+
+        if [[ $SECONDS -gt $tick ]]; then
+            tick=$SECONDS
+            dialog_update "progress: increment"
+            ((counter_start++))
+            if [[ $counter_start -gt $counter_limit ]]; then
+                stop_following_jamf_log
+                jamf_fixer
+            fi
+        fi
+    done
+
+    stop_following_jamf_log
+}
+
+stop_following_jamf_log() {
+    if [[ -n "$tail_pid" ]]; then
+        kill "$tail_pid" 2> /dev/null
+        exec 4<&-
+        unset tail_pid
+    fi
+}
+
 jamf_fixer () {
 
     dialog_eacs
@@ -156,27 +289,38 @@ fi
 
 if [ ! -f "$dialog_app" ]; then
     echo_logger "swiftDialog not installed"
-    dialog_latest=$( curl -sL https://api.github.com/repos/bartreardon/swiftDialog/releases/latest )
-    dialog_url=$(get_json_value "$dialog_latest" 'assets[0].browser_download_url')
-    curl -L --output "dialog.pkg" --create-dirs --output-dir "/var/tmp" "$dialog_url"
-    installer -pkg "/var/tmp/dialog.pkg" -target /
+    dialog_pkg="/var/tmp/dialog.pkg"
+
+    # build-pkg ships the pkg with its SHA-256, only download if that copy is missing or damaged
+    if [[ -f "$dialog_pkg.sha256" && "$(sha256 "$dialog_pkg")" == "$(cat "$dialog_pkg.sha256")" ]]; then
+        echo_logger "Re-using the verified swiftDialog pkg from the PreStage package"
+    else
+        # Both go through download mirrors, the SHA-256 check below still applies to what they serve
+        dialog_latest=$( mirrored_curl -sfL https://api.github.com/repos/bartreardon/swiftDialog/releases/latest )
+        dialog_url=$(get_json_value "$dialog_latest" 'assets[0].browser_download_url')
+        dialog_digest=$(get_json_value "$dialog_latest" 'assets[0].digest')
+        mirrored_curl -fL --output "dialog.pkg" --create-dirs --output-dir "/var/tmp" "$dialog_url"
+
+        if [[ -n "$dialog_digest" && "$(sha256 "$dialog_pkg")" != "${dialog_digest#sha256:}" ]]; then
+            echo_logger "Downloaded swiftDialog pkg doesn't match its published SHA-256, not installing it"
+            rm -f "$dialog_pkg"
+        fi
+    fi
+
+    [[ -f "$dialog_pkg" ]] && installer -pkg "$dialog_pkg" -target /
 fi
 
 # Waiting for Setup Assistant to complete
-setup_assistant_process=$(pgrep -l "Setup Assistant")
-until [ "$setup_assistant_process" = "" ]; do
-  echo_logger "Setup Assistant Still Running. PID $setup_assistant_process."
-  sleep 1
-  setup_assistant_process=$(pgrep -l "Setup Assistant")
-done
+if /usr/bin/pgrep -x "Setup Assistant" > /dev/null; then
+  echo_logger "Setup Assistant Still Running. PID $(/usr/bin/pgrep -x "Setup Assistant")."
+  wait_for_exit "Setup Assistant"
+fi
 
 # Waiting for the Finder process to initialise
-finder_process=$(pgrep -l "Finder")
-until [ "$finder_process" != "" ]; do
+if ! /usr/bin/pgrep -x "Finder" > /dev/null; then
   echo_logger "Finder process not found. Assuming device is at login screen."
-  sleep 1
-  finder_process=$(pgrep -l "Finder")
-done
+  wait_for_process "Finder"
+fi
 
 # Grabbing user information and launching swiftDialog
 logged_in_user=$( scutil <<< "show State:/Users/ConsoleUser" | awk '/Name :/ && ! /loginwindow/ { print $3 }' )
@@ -201,16 +345,7 @@ done
 
 dialog_reset_progress
 
-until ( /usr/bin/grep -q enrollmentComplete "$watch_log" )
-do
-    dialog_update "progresstext: $(tail -1 $watch_log)"
-    dialog_update "progress: increment"
-    sleep 1
-    ((counter_start++))
-    if [[ $counter_start -gt $counter_limit ]]; then
-        jamf_fixer
-    fi
-done
+follow_jamf_log
 
 dialog_update "progresstext: Launching first-run scripts now"
 dialog_update "progress: indeterminate"
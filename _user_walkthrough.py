@@ -3,26 +3,150 @@
 
 import argparse
 import asyncio
-import concurrent.futures
+import copy
+import fcntl
+import hashlib
 import json
 import logging
 import os
 import platform
+import plistlib
+import random
+import re
+import select
 import shlex
-import subprocess
+import shutil
+import signal
+import socket
+import struct
+import sys
+import tempfile
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from textwrap import dedent
+from typing import Callable, List, Optional
+from urllib.parse import urlparse
 
-import requests
-from pkg_resources import parse_version
+# requests is imported where it's used, so the first dialog doesn't wait on the HTTP stack
 
 dialog_icon = "SF=sparkles.rectangle.stack.fill,colour=auto,weight=medium"
 dialog_commandfile = "/var/tmp/dialog.log"
 dialog_custom_commandfile = "/var/tmp/dialog_user_walkthrough.log"
 dialog_title_prefix = "COMPANY Setup"
 download_icon = "SF=laptopcomputer.and.arrow.down,colour=auto,weight=medium"
-jamf_binary = "/usr/local/bin/jamf"
-dialog_binary = "/usr/local/bin/dialog"
+# Both binaries can be swapped for stubs, e.g. to run the benchmarks on Linux
+jamf_binary = os.environ.get("SWIFTENROLMENT_JAMF_BINARY", "/usr/local/bin/jamf")
+dialog_binary = os.environ.get("SWIFTENROLMENT_DIALOG_BINARY", "/usr/local/bin/dialog")
+dialog_write_interval = 0.5
+dialog_listitem_fields = ("index", "title", "icon", "status", "statustext", "progress")
+dialog_channels = {}
+background_dialogs = []
+dialog_json_files = []
+dialog_exit_grace = 10
+branding_icon_url = "https://COMPANY.jamfcloud.com/api/v1/branding-images/download/9"
+branding_icon = "/Library/Management/images/brandingimage.png"
+branding_icon_max_age = 86400
+branding_icon_retry_after = 300
+branding_icon_memo = {"icon": None, "expires": 0.0}
+branding_icon_lock = threading.Lock()
+catalog_memo = {"catalog": None}
+dialog_json_max_arg = 65536
+icon_cache = "/Library/Management/Images/AppIcons"
+icon_cache_workers = 8
+icon_cache_memo = {"icons": None}
+patch_feed_url = "https://jamf-patch.jamfcloud.com/v1/software/"
+patch_feed_cache = "/Library/Management/patch_feed.json"
+patch_feed_max_age = 21600
+patch_feed_memo = {"index": None}
+patch_feed_lock = threading.Lock()
+http_timeout = 10
+# Mirror base URLs, one per line, each tried in order before the original host.
+# SWIFTENROLMENT_MIRRORS (space separated) takes precedence, as in the bash scripts.
+download_mirrors_file = "/Library/Management/download_mirrors"
+download_mirror_connect_timeout = 3
+enrolment_log = "/private/var/log/management.log"
+trace_file = "/private/var/log/swiftEnrolment_trace.jsonl"
+walkthrough_state = "/Library/Management/walkthrough_state.json"
+# When recon last ran and what's changed since, shared by every enrolment script
+inventory_state = "/Library/Management/inventory_state.json"
+# Recons requested this soon after the last one are skipped, their changes wait for flush_recon
+recon_window = 900
+# How often flush_recon checks whether a recon another script started has finished
+recon_poll_interval = 5
+# Printed by jamf policy when a policy's maintenance payload updates inventory
+jamf_recon_output = re.compile(r"^\s*Running Recon", re.I)
+install_concurrency = 3
+jamf_policy_timeout = 3600
+jamf_output_tail = 20
+# Transient failures are retried with jittered exponential backoff until the budget runs out
+jamf_retry_budget = 600
+jamf_retry_base_delay = 5
+jamf_retry_max_delay = 60
+# How long to wait for a jamf run we didn't start to release its lock
+jamf_lock_wait = 1800
+# PIDs of the jamf runs this process has started, wait_for_jamf never waits on these
+jamf_pids = set()
+# macOS has no event for a process starting, so wait_for_process_start checks this often
+process_poll_interval = 0.1
+# Proc connector message layout: nlmsghdr, then cn_msg, then proc_event's what, cpu and
+# timestamp, then event_data. Exec and comm events' event_data is process_pid (the thread)
+# followed by process_tgid (the process, as listed by process_ids).
+proc_connector_nlmsghdr_size = 16
+proc_connector_cn_msg_size = 20
+proc_connector_event_data_offset = 16
+proc_connector_tgid_offset = proc_connector_event_data_offset + 4
+proc_connector_events = (0x2, 0x200)  # PROC_EVENT_EXEC, PROC_EVENT_COMM
+# Checked in order against a run's output, the first match decides the failure kind
+jamf_failure_patterns = [
+    (
+        "locked",
+        "Waiting for jamf",
+        r"another jamf process (?:is )?(?:already )?running"
+        r"|instance of jamf (?:is )?(?:already )?running",
+    ),
+    ("permanent", "No policy found", r"no policies were found"),
+    ("permanent", "Not enrolled", r"device signature error|not enrolled|not managed"),
+    ("transient", "Download failed", r"download (?:failed|error)|checksum|hash mismatch"),
+    (
+        "transient",
+        "Network error",
+        r"could not connect|connection (?:failed|refused|reset|timed out)"
+        r"|could not resolve host|network is unreachable|http (?:error )?5\d\d",
+    ),
+]
+jamf_failure_patterns = [
+    (kind, reason, re.compile(pattern, re.I))
+    for kind, reason, pattern in jamf_failure_patterns
+]
+# Stages of a policy's output, their statustext and the part of the listitem's progress they cover
+jamf_progress_stages = [
+    (re.compile(r"^\s*Downloading\b", re.I), "Downloading", 0, 60),
+    (re.compile(r"^\s*Verifying\b", re.I), "Verifying", 60, 70),
+    (re.compile(r"^\s*(?:Installing\b|installer:)", re.I), "Installing", 70, 100),
+]
+jamf_progress_percent = re.compile(r"(\d{1,3}(?:\.\d+)?)\s*%")
+# Seconds between progress updates for one app, and for the overall progress bar
+progress_update_interval = 1.0
+# Weight of an app in the overall progress bar when it doesn't set expected_duration
+default_expected_duration = 300
+# Installs are admitted before they start: apps with a size that won't fit on disk, or won't
+# download in time over the measured link, are deferred to the next run
+capacity_disk_path = "/"
+# Free space in MB kept back for macOS updates and the user's own files
+disk_reserve_mb = 10240
+# A download needs room for the package and the expanded app at the same time
+disk_space_factor = 2
+# Sampled while the welcome dialog is up, ideally a large file on the distribution point
+bandwidth_probe_url = "https://COMPANY.jamfcloud.com/bandwidth_probe.bin"
+bandwidth_probe_bytes = 4 * 1048576
+bandwidth_probe_seconds = 5
+# Estimated downloads longer than this start last, longer than defer_download_seconds are deferred
+slow_download_seconds = 600
+defer_download_seconds = 7200
 mem_registration_policy_id = 19
 mem_registration_policy_url = (
     "jamfselfservice://content?entity=policy&id=19&action=view"
@@ -35,59 +159,82 @@ role_dict = {
 
 app_list = [
     # {"name": "","icon": "","checked": False,"trigger": "",},
+    # Optional scheduling keys:
+    #   "depends_on": ["App Name"]  - only start once these selected apps have installed
+    #   "locks": ["jamf"]           - never run alongside another app holding the same lock
+    #   "timeout": 3600             - seconds before the policy is stopped and marked as timed out
+    #   "expected_duration": 900    - typical install time in seconds, weights the overall progress bar
+    #   "size": 7500                - download size in MB, checked against free disk and bandwidth
+    #   "disabled": True            - can't be unticked in the app selection dialog
+    # Pre-flight detection, apps that are already installed are shown as Installed and skipped:
+    #   "detect": {"path": "/Applications/App.app", "min_version": "1.0"}
+    #   min_version is optional and compared against CFBundleShortVersionString
     {
         "name": "Adobe Acrobat Reader",
         "icon": "https://PATH.TO.ICON.com",
         "checked": ["Design", "Other"],
         "trigger": "install-Adobe_Acrobat_Reader",
+        "detect": {"path": "/Applications/Adobe Acrobat Reader.app"},
     },
     {
         "name": "Docker Desktop",
         "icon": "https://PATH.TO.ICON.com",
         "checked": ["Engineering"],
         "trigger": "install-Docker",
+        "detect": {"path": "/Applications/Docker.app"},
     },
     {
         "name": "Figma",
         "icon": "https://PATH.TO.ICON.com",
         "checked": ["Design"],
         "trigger": "install-Figma",
+        "detect": {"path": "/Applications/Figma.app"},
     },
     {
         "name": "GitHub Desktop",
         "icon": "https://PATH.TO.ICON.com",
         "checked": ["Engineering"],
         "trigger": "install-GitHub_Desktop",
+        "detect": {"path": "/Applications/GitHub Desktop.app"},
     },
     {
         "name": "iTerm2",
         "icon": "https://PATH.TO.ICON.com",
         "checked": ["Engineering"],
         "trigger": "install-iTerm2",
+        "detect": {"path": "/Applications/iTerm.app"},
     },
     {
         "name": "Microsoft Office",
         "icon": "https://PATH.TO.ICON.com",
         "checked": ["Design", "Engineering", "Other"],
         "trigger": "install-Microsoft_Office_Suite",
+        "disabled": True,
+        "detect": {"path": "/Applications/Microsoft Word.app"},
+        "size": 2500,
     },
     {
         "name": "Postman",
         "icon": "https://PATH.TO.ICON.com",
         "checked": ["Engineering"],
         "trigger": "install-Postman",
+        "detect": {"path": "/Applications/Postman.app"},
     },
     {
         "name": "Visual Studio Code",
         "icon": "https://PATH.TO.ICON.com",
         "checked": ["Engineering"],
         "trigger": "install-Visual_Studio_Code",
+        "detect": {"path": "/Applications/Visual Studio Code.app"},
     },
     {
         "name": "Xcode",
         "icon": "https://PATH.TO.ICON.com",
         "checked": ["Engineering"],
         "trigger": "install-Xcode-14",
+        "detect": {"path": "/Applications/Xcode.app", "min_version": "14.0"},
+        "timeout": 7200,
+        "size": 7500,
     },
 ]
 
@@ -101,6 +248,60 @@ logger = logging.getLogger("bootstrap")
 logger.setLevel(logging.WARNING)
 
 
+class Tracer:
+    """Records timing spans as JSON Lines, in the same format as trace_span in 000_enrolment.sh"""
+
+    def __init__(self, path=None, source="walkthrough"):
+        self.path = path
+        self.source = source
+        self.spans = []
+
+    @contextmanager
+    def span(self, kind, name, **fields):
+        # Callers can add to the yielded span, e.g. span["exit_code"] = 0
+        span = {"source": self.source, "kind": kind, "name": name, **fields}
+        span["start"] = time.time()
+        try:
+            yield span
+        finally:
+            span["end"] = time.time()
+            span["duration"] = round(span["end"] - span["start"], 3)
+            self.record(span)
+
+    def record(self, span):
+        self.spans.append(span)
+        if not self.path:
+            return
+        try:
+            with open(self.path, "a") as f:
+                f.write(f"{json.dumps(span)}\n")
+        except OSError as e:
+            logger.debug(f"Unable to write span to {self.path}: {e}")
+
+    def summary(self):
+        rows = [("KIND", "NAME", "INDEX", "SECONDS", "EXIT")]
+        rows += [
+            (
+                span["kind"],
+                span["name"],
+                str(span.get("index", "")),
+                f"{span['duration']:.1f}",
+                str(span.get("exit_code", "")),
+            )
+            for span in sorted(self.spans, key=lambda span: span["start"])
+        ]
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+
+        result = "\n".join(
+            "  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip()
+            for row in rows
+        )
+        return result
+
+
+tracer = Tracer()
+
+
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -138,144 +339,2091 @@ def parse_args():
         help="Won't execute jamf policies if set",
     )
 
+    parser.add_argument(
+        "-jamf-binary",
+        default=jamf_binary,
+        required=False,
+        help=f"Path to the jamf binary, default={jamf_binary}",
+    )
+
+    parser.add_argument(
+        "-dialog-binary",
+        default=dialog_binary,
+        required=False,
+        help=f"Path to the swiftDialog binary, default={dialog_binary}",
+    )
+
+    parser.add_argument(
+        "-concurrency",
+        default=install_concurrency,
+        type=int,
+        required=False,
+        help=f"Number of jamf policies to run at once, default={install_concurrency}",
+    )
+
+    parser.add_argument(
+        "-trace",
+        "--trace",
+        nargs="?",
+        const=trace_file,
+        default=None,
+        metavar="TRACE_FILE",
+        required=False,
+        help=f"Write timing spans as JSON Lines and print a summary at exit, default={trace_file}",
+    )
+
+    parser.add_argument(
+        "-catalog",
+        metavar="CATALOG_JSON",
+        required=False,
+        help='Load apps and roles from a JSON file ({"roles": {...}, "apps": [...]}) instead of app_list',
+    )
+
+    parser.add_argument(
+        "-speculative",
+        default=False,
+        action="store_true",
+        required=False,
+        help="Start the selected role's default apps while the user is still choosing",
+    )
+
+    parser.add_argument(
+        "-reset-state",
+        default=False,
+        action="store_true",
+        required=False,
+        help=f"Start from the beginning instead of resuming from {walkthrough_state}",
+    )
+
+    parser.add_argument(
+        "-prefetch-icons",
+        nargs="?",
+        const=icon_cache,
+        default=None,
+        metavar="CACHE_DIR",
+        required=False,
+        help=f"Download every app_list icon into CACHE_DIR, then exit, default={icon_cache}",
+    )
+
+    parser.add_argument(
+        "-dialog-channel",
+        metavar="COMMANDFILE",
+        required=False,
+        help="Write swiftDialog commands read from stdin to COMMANDFILE, then exit",
+    )
+
+    parser.add_argument(
+        "-run-steps",
+        metavar="POLICY_JSON",
+        required=False,
+        help="Run 000_enrolment.sh's policy_array from a file (- for stdin), then exit",
+    )
+
+    parser.add_argument(
+        "-steps-done",
+        metavar="FILE",
+        required=False,
+        help="With -run-steps, keep the number of finished steps in FILE for the bash fallback",
+    )
+
+    parser.add_argument(
+        "-testing",
+        default=False,
+        action="store_true",
+        required=False,
+        help="With -run-steps, log each trigger instead of running it",
+    )
+
+    parser.add_argument(
+        "-wait-exit",
+        metavar="NAME_OR_PID",
+        required=False,
+        help="Wait until no process with this name (or pid) is running, then exit",
+    )
+
+    parser.add_argument(
+        "-wait-for",
+        metavar="NAME",
+        required=False,
+        help="Wait until a process with this name is running, then exit",
+    )
+
+    parser.add_argument(
+        "-wait-timeout",
+        default=None,
+        type=float,
+        required=False,
+        help="Seconds -wait-exit or -wait-for waits before exiting with 1, default=no limit",
+    )
+
+    parser.add_argument(
+        "-recon",
+        metavar="REASON",
+        required=False,
+        help="Submit inventory unless it was submitted within -recon-window, then exit",
+    )
+
+    parser.add_argument(
+        "-recon-window",
+        default=recon_window,
+        type=int,
+        required=False,
+        help=f"Seconds after a recon that further recons are skipped, default={recon_window}",
+    )
+
     result = parser.parse_args()
 
     logger.debug(result)
     return result
 
 
-async def get_self_service_branding_icon():
-    # Check for the icon on disk first and download it if not found
-    self_service_branding_icon_name = "brandingimage.png"
-    self_service_branding_icon_location = "/Library/Management/images"
-    self_service_branding_icon_url = (
-        "https://COMPANY.jamfcloud.com/api/v1/branding-images/download/9"
-    )
-    self_service_branding_icon = (
-        f"{self_service_branding_icon_location}/{self_service_branding_icon_name}"
-    )
+def download_mirrors():
+    """Mirror base URLs in the order they're tried"""
+    result = os.environ.get("SWIFTENROLMENT_MIRRORS", "").split()
+    if result:
+        return result
 
-    if not os.path.exists(self_service_branding_icon):
-        # Open the url image, set stream to True, this will return the stream content.
-        request = requests.get(self_service_branding_icon_url, stream=True)
+    try:
+        with open(download_mirrors_file) as f:
+            result = [
+                line.strip()
+                for line in f
+                if line.strip() and not line.lstrip().startswith("#")
+            ]
+    except OSError:
+        pass
 
-        # Check if the image was retrieved successfully
-        if request.status_code == 200:
-            # Open a local file with wb ( write binary ) permission.
-            with open(self_service_branding_icon, "wb") as f:
-                f.write(request.content)
+    return result
 
-            logger.debug("Branding icon downloaded")
-            result = self_service_branding_icon
 
+def download_urls(url):
+    """Each mirror's copy of url, e.g. http://mirror:8080/host/path, followed by url itself"""
+    _, _, rest = url.partition("://")
+    result = [f"{mirror.rstrip('/')}/{rest}" for mirror in download_mirrors()]
+    result.append(url)
+    return result
+
+
+def mirrored_get(url, **kwargs):
+    """requests.get that tries each mirror before url, falling back on any error or 4xx/5xx"""
+    import requests
+
+    *mirror_urls, url = download_urls(url)
+    for mirror_url in mirror_urls:
+        try:
+            # A dead mirror should cost seconds, not the whole http_timeout
+            response = requests.get(
+                mirror_url,
+                **{**kwargs, "timeout": (download_mirror_connect_timeout, http_timeout)},
+            )
+        except requests.RequestException as e:
+            logger.debug(f"Mirror {mirror_url} failed: {e}")
+            continue
+        if response.status_code < 400:
+            logger.debug(f"Downloading {url} from {mirror_url}")
+            return response
+        logger.debug(f"Mirror {mirror_url} returned {response.status_code}")
+        response.close()
+
+    result = requests.get(url, **kwargs)
+    return result
+
+
+def fetch_self_service_branding_icon():
+    """Downloads the branding icon, or revalidates the copy on disk. Returns True if it's usable"""
+    import requests
+    from email.utils import formatdate, parsedate_to_datetime
+
+    result = False
+    headers = {}
+    etag_file = f"{branding_icon}.etag"
+
+    # The cache layout matches 000_enrolment.sh's curl: the ETag is kept alongside
+    # the icon and the icon's mtime is the server's Last-Modified
+    if os.path.exists(branding_icon):
+        headers["If-Modified-Since"] = formatdate(
+            os.path.getmtime(branding_icon), usegmt=True
+        )
+        if os.path.exists(etag_file):
+            with open(etag_file) as f:
+                etag = f.read().strip()
+            if etag:
+                headers["If-None-Match"] = etag
+
+    temp_icon = None
+    try:
+        with mirrored_get(
+            branding_icon_url, headers=headers, stream=True, timeout=http_timeout
+        ) as request:
+            logger.debug(f"Branding icon status_code: {request.status_code}")
+
+            if request.status_code == 304:
+                logger.debug("Branding icon on disk is current")
+                result = True
+            elif request.status_code == 200:
+                os.makedirs(os.path.dirname(branding_icon), exist_ok=True)
+                fd, temp_icon = tempfile.mkstemp(
+                    dir=os.path.dirname(branding_icon), prefix=".brandingimage."
+                )
+                with os.fdopen(fd, "wb") as f:
+                    for chunk in request.iter_content(chunk_size=65536):
+                        f.write(chunk)
+                os.chmod(temp_icon, 0o644)
+
+                last_modified = request.headers.get("Last-Modified")
+                if last_modified:
+                    last_modified = parsedate_to_datetime(last_modified).timestamp()
+                    os.utime(temp_icon, (last_modified, last_modified))
+
+                # Readers only ever see a complete icon
+                os.replace(temp_icon, branding_icon)
+                temp_icon = None
+                logger.debug("Branding icon downloaded")
+
+                with open(etag_file, "w") as f:
+                    f.write(f"{request.headers.get('ETag', '')}\n")
+                result = True
+    except (requests.RequestException, OSError, ValueError) as e:
+        logger.warning(f"Branding icon couldn't be downloaded: {e}")
+    finally:
+        if temp_icon:
+            os.remove(temp_icon)
+
+    if result and os.path.exists(etag_file):
+        # Marks when the icon was last confirmed to be current
+        os.utime(etag_file)
+
+    return result
+
+
+def resolve_self_service_branding_icon():
+    with branding_icon_lock:
+        if branding_icon_memo["expires"] > time.monotonic():
+            return branding_icon_memo["icon"]
+
+        etag_file = f"{branding_icon}.etag"
+        validated = max(
+            (os.path.getmtime(p) for p in (etag_file, branding_icon) if os.path.exists(p)),
+            default=None,
+        )
+
+        if validated and time.time() - validated < branding_icon_max_age:
+            logger.debug("Branding image already on disk")
+            result, ttl = branding_icon, branding_icon_max_age
+        elif fetch_self_service_branding_icon():
+            result, ttl = branding_icon, branding_icon_max_age
+        elif validated:
+            logger.debug("Branding icon couldn't be revalidated, using the copy on disk")
+            result, ttl = branding_icon, branding_icon_retry_after
         else:
+            # Remember the failure too, so a dead endpoint only costs one timeout
             logger.debug("Branding icon couldn't be downloaded, setting generic icon")
-            result = dialog_icon
+            result, ttl = dialog_icon, branding_icon_retry_after
 
-    else:
-        logger.debug("Branding image already on disk")
-        result = self_service_branding_icon
+        branding_icon_memo["icon"] = result
+        branding_icon_memo["expires"] = time.monotonic() + ttl
 
     logger.debug(f"Branding icon: {result}")
     return result
 
 
-def run_jamf_policy(trigger):
-    """Runs a jamf policy given the provided trigger"""
+def current_self_service_branding_icon():
+    """The branding icon if it's already known or on disk, without waiting on the network"""
+    if branding_icon_memo["icon"]:
+        return branding_icon_memo["icon"]
+    return branding_icon if os.path.exists(branding_icon) else dialog_icon
+
+
+async def get_self_service_branding_icon():
+    # Resolved once per process, downloads happen off the event loop
+    if branding_icon_memo["expires"] > time.monotonic():
+        return branding_icon_memo["icon"]
+
+    result = await asyncio.to_thread(resolve_self_service_branding_icon)
+    return result
+
+
+def load_icon_cache(cache_dir):
+    """Returns {url: file name} for icons already in cache_dir"""
+    try:
+        with open(os.path.join(cache_dir, "index.json")) as f:
+            icons = json.load(f).get("icons", {})
+    except (OSError, ValueError):
+        icons = {}
+
+    # build-pkg can bake a cache in, so only trust entries whose file is still there
+    result = {
+        url: name
+        for url, name in icons.items()
+        if os.path.exists(os.path.join(cache_dir, name))
+    }
+    return result
+
+
+def fetch_app_icon(url, cache_dir):
+    """Downloads an icon into cache_dir, named by the SHA-256 of its contents"""
+    import requests
+
     result = None
+    extension = os.path.splitext(urlparse(url).path)[1] or ".png"
+    digest = hashlib.sha256()
+
+    temp_icon = None
+    try:
+        # A read-only or full cache leaves the dialog on the remote URL
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, temp_icon = tempfile.mkstemp(dir=cache_dir, prefix=".icon.")
+        with os.fdopen(fd, "wb") as f, mirrored_get(
+            url, stream=True, timeout=http_timeout
+        ) as request:
+            request.raise_for_status()
+            for chunk in request.iter_content(chunk_size=65536):
+                digest.update(chunk)
+                f.write(chunk)
+        os.chmod(temp_icon, 0o644)
+
+        # Identical icons behind different URLs end up as one file
+        result = f"{digest.hexdigest()}{extension}"
+        os.replace(temp_icon, os.path.join(cache_dir, result))
+        temp_icon = None
+    except (requests.RequestException, OSError) as e:
+        logger.warning(f"Icon {url} couldn't be downloaded: {e}")
+    finally:
+        if temp_icon:
+            os.remove(temp_icon)
+
+    return result
+
+
+async def prefetch_app_icons(apps=None, cache_dir=None):
+    """Downloads every app_list icon that isn't cached yet, a few at a time"""
+    apps = app_catalog().apps if apps is None else apps
+    cache_dir = cache_dir or icon_cache
+
+    icons = await asyncio.to_thread(load_icon_cache, cache_dir)
+    if cache_dir == icon_cache:
+        icon_cache_memo["icons"] = icons
+
+    urls = {
+        app["icon"]
+        for app in apps
+        if app.get("icon", "").startswith(("http://", "https://"))
+        and app["icon"] not in icons
+    }
+    logger.debug(f"Icons to prefetch: {len(urls)}")
+
+    if urls:
+        try:
+            await asyncio.to_thread(os.makedirs, cache_dir, exist_ok=True)
+        except OSError as e:
+            # Icons stay on their remote URLs, as they would without a cache
+            logger.warning(f"Icon cache {cache_dir} is unavailable: {e}")
+            return icons
+
+        loop = asyncio.get_running_loop()
+
+        async def download(url):
+            name = await loop.run_in_executor(executor, fetch_app_icon, url, cache_dir)
+            # Dialogs shown meanwhile pick up each icon as soon as it lands
+            if name:
+                icons[url] = name
+
+        with ThreadPoolExecutor(max_workers=icon_cache_workers) as executor:
+            await asyncio.gather(*(download(url) for url in urls))
+
+        try:
+            await asyncio.to_thread(
+                write_json_atomic, os.path.join(cache_dir, "index.json"), {"icons": icons}
+            )
+        except OSError as e:
+            # The icons are still used this run, they're just fetched again next time
+            logger.warning(f"Unable to write the icon cache index: {e}")
+
+    return icons
+
+
+def local_icon(icon):
+    """The cached copy of an app icon, or the icon unchanged if it isn't cached (yet)"""
+    icons = icon_cache_memo["icons"] or {}
+    result = os.path.join(icon_cache, icons[icon]) if icon in icons else icon
+    return result
+
+
+@dataclass
+class PolicyResult:
+    """Outcome of a single jamf run"""
+
+    trigger: str
+    returncode: Optional[int]
+    duration: float
+    output: List[str] = field(default_factory=list)
+    timed_out: bool = False
+    # None on success, otherwise "permanent", "transient" or "locked"
+    failure: Optional[str] = None
+    reason: Optional[str] = None
+    attempts: int = 1
+
+    @property
+    def success(self):
+        return self.returncode == 0 and not self.timed_out and self.failure is None
+
+
+async def stop_process_group(process, grace=10):
+    """Stops a process started with start_new_session, along with anything it spawned"""
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            pass
+        try:
+            await asyncio.wait_for(process.wait(), grace)
+            return
+        except asyncio.TimeoutError:
+            logger.debug(f"{process.pid} didn't exit after {sig.name}")
+
+
+async def run_jamf_command(cmd_args, label, timeout=None, on_line=None):
+    """Runs the jamf binary with cmd_args, streaming its output to on_line as it arrives"""
+    cmd_split = [jamf_binary, *cmd_args]
+    logger.debug(f"cmd: {shlex.join(cmd_split)}")
+
+    output_tail = deque(maxlen=jamf_output_tail)
+    start_time = time.monotonic()
+    timed_out = False
+
+    jamf_process = await asyncio.create_subprocess_exec(
+        *cmd_split,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        # Own process group so a timeout also stops any installers jamf has spawned
+        start_new_session=True,
+    )
+    jamf_pids.add(jamf_process.pid)
+
+    async def read_stream(stream):
+        # Waits on the pipe rather than polling, so an idle policy costs no CPU
+        async for line in stream:
+            line = line.decode(errors="replace").rstrip()
+            if line:
+                logger.debug(f"{label}: {line}")
+                output_tail.append(line)
+                if on_line:
+                    on_line(line)
+
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(
+                read_stream(jamf_process.stdout),
+                read_stream(jamf_process.stderr),
+                jamf_process.wait(),
+            ),
+            timeout,
+        )
+    except asyncio.TimeoutError:
+        logger.warning(f"{label} timed out after {timeout} seconds, stopping jamf")
+        timed_out = True
+        await stop_process_group(jamf_process)
+    except asyncio.CancelledError:
+        logger.warning(f"{label} was cancelled, stopping jamf")
+        await stop_process_group(jamf_process)
+        raise
+    finally:
+        jamf_pids.discard(jamf_process.pid)
+
+    result = PolicyResult(
+        trigger=label,
+        returncode=jamf_process.returncode,
+        duration=time.monotonic() - start_time,
+        output=list(output_tail),
+        timed_out=timed_out,
+    )
+    result.failure, result.reason = classify_jamf_result(result)
+    logger.debug(f"returncode: {result.returncode}, failure: {result.failure}")
+
+    return result
+
+
+def classify_jamf_result(result):
+    """Returns (failure kind, reason) for a jamf run, (None, None) if it succeeded"""
+    if result.timed_out:
+        # Running the whole policy again would most likely time out again
+        return "permanent", "Timed out"
+
+    for line in reversed(result.output):
+        for kind, reason, pattern in jamf_failure_patterns:
+            # jamf exits 0 when a trigger has no policy in scope, a successful run can
+            # still mention checksums or connections, so only permanent kinds count then
+            if result.returncode == 0 and kind != "permanent":
+                continue
+            if pattern.search(line):
+                return kind, reason
+
+    if result.returncode == 0:
+        return None, None
+
+    # Anything unrecognised gets another go, the retry budget stops it looping for long
+    return "transient", "Failed"
+
+
+def process_ids(name):
+    """Process IDs of everything running as name, read in-process rather than forking pgrep"""
+    result = []
+
+    if sys.platform == "darwin":
+        import ctypes
+
+        libproc = ctypes.CDLL("/usr/lib/libproc.dylib")
+        count = libproc.proc_listallpids(None, 0)
+        # Room for anything started between the two calls
+        pids = (ctypes.c_int * (count + 64))()
+        count = libproc.proc_listallpids(pids, ctypes.sizeof(pids))
+        buffer = ctypes.create_string_buffer(256)
+        for pid in pids[: max(0, count)]:
+            if libproc.proc_name(pid, buffer, len(buffer)) > 0:
+                if buffer.value.decode(errors="replace") == name:
+                    result.append(pid)
+        return result
+
+    for entry in os.scandir("/proc"):
+        if entry.name.isdigit() and process_name(int(entry.name)) == name[:15]:
+            result.append(int(entry.name))
+    return result
+
+
+def process_name(pid):
+    """The kernel's name for pid on Linux, truncated to 15 characters, None once it's exited"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except OSError:
+        return None
 
-    cmd = f"{jamf_binary} policy \
-        -event {trigger}"
-    logger.debug(f"cmd: {cmd}")
+    # The name is in brackets and can contain anything, including brackets
+    name, _, state = stat[stat.find("(") + 1 :].rpartition(")")
+    # A zombie has exited and is only waiting for its parent to reap it
+    result = None if state.split()[0] == "Z" else name
+    return result
+
+
+def process_parent(pid):
+    """The parent of pid, None once it's exited"""
+    if sys.platform == "darwin":
+        import ctypes
+
+        libproc = ctypes.CDLL("/usr/lib/libproc.dylib")
+        # struct proc_bsdinfo from PROC_PIDTBSDINFO, pbi_ppid follows four uint32 fields
+        info = ctypes.create_string_buffer(136)
+        if libproc.proc_pidinfo(pid, 3, 0, info, len(info)) != len(info):
+            return None
+        return struct.unpack_from("=I", info.raw, 16)[0]
+
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except OSError:
+        return None
+
+    # After the bracketed name come the state and then the parent's pid
+    result = int(stat[stat.rfind(")") + 1 :].split()[1])
+    return result
+
+
+def process_ancestors():
+    """This process's parent, its parent and so on, up to but not including launchd or init"""
+    result = set()
+    pid = os.getppid()
+    while pid and pid > 1 and pid not in result:
+        result.add(pid)
+        pid = process_parent(pid)
+    return result
+
+
+def pid_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Owned by root while we aren't, but it exists
+        return True
+    return True
+
+
+async def wait_for_pid_exit(pid, timeout=None):
+    """Waits on pidfd (Linux) or kqueue NOTE_EXIT (macOS) for pid to exit, False on timeout"""
+    loop = asyncio.get_running_loop()
+    exited = loop.create_future()
+    watcher = None
+
+    try:
+        if hasattr(os, "pidfd_open"):
+            watcher = os.pidfd_open(pid)
+            fd = watcher
+        elif hasattr(select, "kqueue"):
+            watcher = select.kqueue()
+            watcher.control(
+                [
+                    select.kevent(
+                        pid,
+                        filter=select.KQ_FILTER_PROC,
+                        flags=select.KQ_EV_ADD | select.KQ_EV_ONESHOT,
+                        fflags=select.KQ_NOTE_EXIT,
+                    )
+                ],
+                0,
+                0,
+            )
+            fd = watcher.fileno()
+    except ProcessLookupError:
+        return True
+    except OSError as e:
+        logger.debug(f"Unable to watch {pid} for its exit, polling instead: {e}")
+        if watcher is not None and hasattr(watcher, "close"):
+            watcher.close()
+        watcher = None
+
+    if watcher is None:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while pid_running(pid):
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(process_poll_interval)
+        return True
+
+    loop.add_reader(fd, lambda: exited.done() or exited.set_result(True))
+    try:
+        await asyncio.wait_for(exited, timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        loop.remove_reader(fd)
+        if type(watcher) is int:
+            os.close(watcher)
+        else:
+            watcher.close()
 
-    cmd_split = shlex.split(cmd)
 
-    jamf_policy = subprocess.Popen(cmd_split, stdout=subprocess.PIPE, text=True)
+async def wait_for_process_exit(name, timeout=None):
+    """Waits until nothing called name (or with that pid) is running, False on timeout"""
+    deadline = None if timeout is None else time.monotonic() + timeout
 
     while True:
-        # Get the current output of the subprocess
-        cmd_output = jamf_policy.stdout
-
-        if jamf_policy.poll() is None:
-            # poll() returns None if the process is still running
-            if cmd_output:
-                # Logs the current output of the command, if any
-                logger.debug(f"{cmd_output.readline().strip()}")
+        if name.isdigit():
+            pids = [int(name)] if pid_running(int(name)) else []
         else:
-            logger.debug(f"returncode: {jamf_policy.poll()}")
-            break
+            pids = await asyncio.to_thread(process_ids, name)
+        if not pids:
+            return True
+
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            return False
+        logger.debug(f"Waiting for {name} to exit: {pids}")
+        if not all(
+            await asyncio.gather(*(wait_for_pid_exit(pid, remaining) for pid in pids))
+        ):
+            return False
+        # Checked again, jamf often starts another run straight after the last one
+
+
+def proc_connector():
+    """A netlink socket subscribed to the Linux proc connector's events, None without CAP_NET_ADMIN"""
+    if not sys.platform.startswith("linux"):
+        return None
 
-    if jamf_policy.poll() == 0:
+    sock = None
+    try:
+        # NETLINK_CONNECTOR, CN_IDX_PROC
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, 11)
+        sock.bind((0, 1))
+        # cn_msg for CN_IDX_PROC/CN_VAL_PROC carrying PROC_CN_MCAST_LISTEN
+        message = struct.pack("=IIIIHHI", 1, 1, 0, 0, 4, 0, 1)
+        # nlmsghdr, NLMSG_DONE
+        sock.send(
+            struct.pack("=IHHII", proc_connector_nlmsghdr_size + len(message), 3, 0, 0, 0)
+            + message
+        )
+        sock.setblocking(False)
+    except OSError as e:
+        logger.debug(f"Proc connector unavailable, polling instead: {e}")
+        if sock:
+            sock.close()
+        return None
+
+    return sock
+
+
+def proc_connector_pids(data):
+    """Yields the process id (tgid) of each exec or comm event in a proc connector message"""
+    offset = 0
+    while offset + proc_connector_nlmsghdr_size <= len(data):
+        length = struct.unpack_from("=I", data, offset)[0]
+        event = offset + proc_connector_nlmsghdr_size + proc_connector_cn_msg_size
+        tgid = event + proc_connector_tgid_offset
+        if length < proc_connector_nlmsghdr_size or tgid + 4 > len(data):
+            return
+        what = struct.unpack_from("=I", data, event)[0]
+        # The tgid rather than the pid, so a thread execing or renaming still matches its
+        # process by name, and the result can be compared with process_ids
+        if what in proc_connector_events:
+            yield struct.unpack_from("=I", data, tgid)[0]
+        offset += (length + 3) & ~3
+
+
+async def wait_for_process_start(name, timeout=None):
+    """Waits until a process called name is running and returns its pid, None on timeout"""
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    sock = proc_connector()
+
+    try:
+        # Only checked once subscribed, so anything starting in between is still seen
+        pids = await asyncio.to_thread(process_ids, name)
+        while not pids:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
+
+            if sock:
+                try:
+                    data = await asyncio.wait_for(loop.sock_recv(sock, 65536), remaining)
+                except asyncio.TimeoutError:
+                    return None
+                pids = [
+                    pid
+                    for pid in proc_connector_pids(data)
+                    if process_name(pid) == name[:15]
+                ]
+            else:
+                await asyncio.sleep(process_poll_interval)
+                pids = await asyncio.to_thread(process_ids, name)
+    finally:
+        if sock:
+            sock.close()
+
+    result = pids[0]
+    return result
+
+
+async def wait_for_jamf(timeout):
+    """Waits for the jamf runs going now to exit, returns False if any are still running after timeout"""
+    pids = await asyncio.to_thread(process_ids, os.path.basename(jamf_binary))
+    # The jamf policy that launched us only exits once we do, and our own runs are already
+    # awaited by their installs, so neither is worth waiting on
+    ignored = await asyncio.to_thread(process_ancestors)
+    pids = [pid for pid in pids if pid not in ignored and pid not in jamf_pids]
+    logger.debug(f"Waiting for jamf processes: {pids}")
+    result = all(
+        await asyncio.gather(*(wait_for_pid_exit(pid, timeout) for pid in pids))
+    )
+    return result
+
+
+async def run_jamf_policy(trigger, timeout=None, on_line=None):
+    """Runs a jamf policy given the provided trigger"""
+    result = await run_jamf_command(
+        ["policy", "-event", trigger], trigger, timeout, on_line
+    )
+
+    if result.success:
         logger.debug(f"Successfully ran JAMF policy via trigger: {trigger}")
-        result = True
     else:
         logger.debug(f"Unable to run JAMF policy via trigger: {trigger}")
-        result = False
 
     return result
 
 
+async def run_jamf_policy_with_retries(
+    trigger, timeout=None, on_status=None, on_line=None
+):
+    """Runs a jamf policy, waiting out other jamf runs and retrying transient failures"""
+    start_time = time.monotonic()
+    attempt = 0
+
+    while True:
+        result = await run_jamf_policy(trigger, timeout, on_line)
+        attempt += 1
+        result.attempts = attempt
+        elapsed = time.monotonic() - start_time
+
+        if result.success or result.failure == "permanent":
+            return result
+
+        if result.failure == "locked":
+            if elapsed >= jamf_lock_wait:
+                return result
+            logger.info(f"{trigger} is waiting for another jamf process to finish")
+            if on_status:
+                await on_status("Waiting for jamf")
+            if not await wait_for_jamf(jamf_lock_wait - elapsed):
+                return result
+            # Installs queued behind the same process shouldn't all retry at once
+            delay = random.uniform(0, jamf_retry_base_delay)
+        else:
+            # Full jitter, so a flaky distribution point isn't hit by the whole fleet in step
+            delay = random.uniform(
+                0, min(jamf_retry_max_delay, jamf_retry_base_delay * 2 ** (attempt - 1))
+            )
+            if elapsed + delay >= jamf_retry_budget:
+                logger.warning(f"{trigger} failed {attempt} times, giving up")
+                return result
+            logger.info(f"{trigger} failed ({result.reason}), retrying in {delay:.0f}s")
+            if on_status:
+                await on_status(f"{result.reason}, retrying ({attempt})")
+
+        await asyncio.sleep(delay)
+
+
+def parse_listitem_command(dialog_command):
+    """Splits a "listitem: index: N, ..." command into its fields, None for anything else"""
+    if not dialog_command.startswith("listitem: index: "):
+        return None
+
+    fields = {}
+    key = None
+    for part in dialog_command[len("listitem: ") :].split(", "):
+        name, sep, value = part.partition(": ")
+        if sep and name in dialog_listitem_fields:
+            key = name
+            fields[key] = value
+        elif key:
+            # A comma inside a value, e.g. statustext
+            fields[key] += f", {part}"
+
+    return fields
+
+
+def coalesce_dialog_commands(dialog_commands):
+    """Merges listitem updates for the same index that nothing else separates"""
+    batch = []
+    listitem_positions = {}
+
+    for dialog_command in dialog_commands:
+        fields = parse_listitem_command(dialog_command)
+        if fields is None:
+            # Any other command could depend on the list state, so don't merge across it
+            listitem_positions.clear()
+            batch.append(dialog_command)
+            continue
+
+        position = listitem_positions.get(fields["index"])
+        if position is not None:
+            earlier = batch[position]
+            # A new status ends the item's progress, an earlier percentage would outlive it
+            if "status" in fields and "progress" not in fields:
+                earlier = {key: value for key, value in earlier.items() if key != "progress"}
+            fields = {**earlier, **fields}
+            batch[position] = None
+
+        listitem_positions[fields["index"]] = len(batch)
+        batch.append(fields)
+
+    result = [
+        item
+        if type(item) is str
+        else "listitem: " + ", ".join(f"{key}: {value}" for key, value in item.items())
+        for item in batch
+        if item is not None
+    ]
+
+    return result
+
+
+class DialogCommandChannel:
+    """Queues commands for a swiftDialog command file and writes them in batches"""
+
+    def __init__(self, commandfile, interval=dialog_write_interval):
+        self.commandfile = commandfile
+        self.interval = interval
+        self.last_write = None
+        self.loop = None
+        self.queue = None
+        self.writer = None
+
+    def send(self, dialog_command):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Outside of an event loop there's nothing to batch with
+            self.write([dialog_command])
+            return
+
+        if self.loop is not loop:
+            self.loop = loop
+            self.queue = asyncio.Queue()
+            self.writer = None
+        if self.writer is None or self.writer.done():
+            self.writer = asyncio.create_task(self.run())
+
+        self.queue.put_nowait(dialog_command)
+
+    async def run(self):
+        while True:
+            batch = [await self.queue.get()]
+
+            # swiftDialog can miss writes that land too close together, so only wait
+            # when the last write was recent. Anything sent meanwhile joins this batch.
+            if self.last_write is not None:
+                delay = self.last_write + self.interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            try:
+                self.write(coalesce_dialog_commands(batch))
+            except OSError as e:
+                logger.warning(f"Unable to write to {self.commandfile}: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def write(self, dialog_commands):
+        logger.debug(f"dialog_log {self.commandfile}: {dialog_commands}")
+        with open(self.commandfile, "a") as f:
+            f.write("".join(f"\n{dialog_command}" for dialog_command in dialog_commands))
+        self.last_write = time.monotonic()
+
+    async def flush(self):
+        if self.queue is not None:
+            await self.queue.join()
+
+    def reset(self, rotate=False):
+        """Empties the command file between dialogs, optionally keeping the old one as .1"""
+        if rotate and os.path.exists(self.commandfile):
+            os.replace(self.commandfile, f"{self.commandfile}.1")
+        with open(self.commandfile, "w"):
+            pass
+        self.last_write = None
+
+
+def dialog_channel(commandfile=dialog_commandfile):
+    if commandfile not in dialog_channels:
+        dialog_channels[commandfile] = DialogCommandChannel(commandfile)
+    return dialog_channels[commandfile]
+
+
 def dialog_log(dialog_command: str, commandfile=dialog_commandfile):
     logger.debug(f"dialog_log commandfile: {commandfile}")
     logger.debug(f"dialog_log dialog_command: {dialog_command}")
 
-    # adding sleep so Dialog updates
-    time.sleep(0.5)
-    with open(commandfile, "a") as f:
-        f.write(f"\n{dialog_command}")
+    dialog_channel(commandfile).send(dialog_command)
 
     return
 
 
-def process_jamf_app_list(jamf_app_list, demo_mode):
-    # Adding initial sleep so that swiftDialog has time to catch up
-    logger.debug("########################################################")
-    logger.debug("process_jamf_app_list")
-    logger.debug("########################################################")
+async def run_dialog_channel(commandfile):
+    """Feeds stdin into a DialogCommandChannel, used by the bash dialog_update functions"""
+    channel = dialog_channel(commandfile)
 
-    # jamf_app_list = kwargs.get("jamf_app_list")
-    # demo_mode = kwargs.get("demo_mode")
+    while True:
+        line = await asyncio.to_thread(sys.stdin.readline)
+        if not line:
+            break
+        if line.strip():
+            channel.send(line.rstrip("\n"))
 
-    if jamf_app_list:
-        time.sleep(1)
-        for app in jamf_app_list:
-            index = app.get("index")
-            trigger = app.get("trigger")
+    await channel.flush()
+
+
+def check_app_dependencies(jamf_app_list):
+    """Drops dependencies on unselected apps and raises ValueError on cycles"""
+    selected = {app.get("name") for app in jamf_app_list}
+    depends_on = {
+        app.get("name"): [d for d in app.get("depends_on", []) if d in selected]
+        for app in jamf_app_list
+    }
+
+    # Depth-first walk, tracking the current path to spot cycles
+    visiting, visited = set(), set()
+
+    def visit(name, path):
+        if name in visited:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependency cycle in app_list: {' -> '.join(path)}")
+        visiting.add(name)
+        for dependency in depends_on[name]:
+            visit(dependency, path + [dependency])
+        visiting.discard(name)
+        visited.add(name)
+
+    for name in depends_on:
+        visit(name, [name])
+
+    return depends_on
+
+
+class AppCatalog:
+    """app_list and role_dict, validated once and indexed so dialogs cost O(1) per app"""
+
+    def __init__(self, apps, roles):
+        self.apps = apps
+        self.roles = roles
+        self.validate()
+
+        self.by_name = {app["name"]: app for app in apps}
+        self.role_defaults = {
+            role: frozenset(app["name"] for app in apps if role in app.get("checked", []))
+            for role in roles["values"]
+        }
+        self.checkbox_memo = {}
+        self.listitem_memo = {}
+
+    @classmethod
+    def from_file(cls, path):
+        """Loads {"roles": {...}, "apps": [...]} in the same format as role_dict and app_list"""
+        with open(path) as f:
+            data = json.load(f)
+
+        result = cls(data["apps"], data.get("roles", role_dict))
+        logger.info(f"Loaded {len(result.apps)} apps from {path}")
+        return result
+
+    def validate(self):
+        roles = set(self.roles.get("values", []))
+        if self.roles.get("default") not in roles:
+            raise ValueError(f"Default role {self.roles.get('default')} isn't a role")
+
+        names, triggers = set(), set()
+        for app in self.apps:
+            for key in ("name", "trigger"):
+                if not isinstance(app.get(key), str) or not app[key]:
+                    raise ValueError(f"App is missing a {key}: {app}")
+            if app["name"] in names:
+                raise ValueError(f"Duplicate app name: {app['name']}")
+            if app["trigger"] in triggers:
+                raise ValueError(f"Duplicate trigger: {app['trigger']}")
+            expected_duration = app.get("expected_duration", 1)
+            if type(expected_duration) not in (int, float) or expected_duration <= 0:
+                raise ValueError(f"{app['name']} has an invalid expected_duration")
+            size = app.get("size", 1)
+            if type(size) not in (int, float) or size <= 0:
+                raise ValueError(f"{app['name']} has an invalid size")
+            unknown_roles = set(app.get("checked", [])) - roles
+            if unknown_roles:
+                raise ValueError(f"{app['name']} is checked for unknown roles {unknown_roles}")
+            names.add(app["name"])
+            triggers.add(app["trigger"])
+
+        for app in self.apps:
+            missing = set(app.get("depends_on", [])) - names
+            if missing:
+                raise ValueError(f"{app['name']} depends on unknown apps {missing}")
+        check_app_dependencies(self.apps)
+
+    def checkboxes(self, role):
+        """The app selection checkboxes for role, before icons and installed apps are applied"""
+        if role not in self.checkbox_memo:
+            defaults = self.role_defaults.get(role, frozenset())
+            self.checkbox_memo[role] = [
+                {
+                    "label": app["name"],
+                    "checked": app["name"] in defaults,
+                    "disabled": app.get("disabled", False),
+                    **({"icon": app["icon"]} if app.get("icon") else {}),
+                }
+                for app in self.apps
+            ]
+        return self.checkbox_memo[role]
+
+    def listitem(self, name):
+        """The install list entry for an app, before its icon and status are applied"""
+        if name not in self.listitem_memo:
+            app = self.by_name[name]
+            self.listitem_memo[name] = {
+                "title": name,
+                **({"icon": app["icon"]} if app.get("icon") else {}),
+            }
+        return self.listitem_memo[name]
+
+
+def app_catalog():
+    """The catalog loaded with -catalog, or the built-in app_list and role_dict"""
+    if catalog_memo["catalog"] is None:
+        catalog_memo["catalog"] = AppCatalog(app_list, role_dict)
+    return catalog_memo["catalog"]
+
+
+class JamfProgressParser:
+    """Turns a policy's output into listitem statustext and progress, at most once per interval"""
+
+    def __init__(self, on_progress, interval=progress_update_interval):
+        self.on_progress = on_progress
+        self.interval = interval
+        self.reset()
+
+    def reset(self):
+        # A retried policy starts downloading again
+        self.stage = None
+        self.progress = 0
+        self.last_update = None
+
+    def feed(self, line):
+        stage = self.stage
+        progress = self.progress
+
+        for pattern, statustext, low, high in jamf_progress_stages:
+            if pattern.search(line):
+                stage = (statustext, low, high)
+                progress = max(progress, low)
+                break
+
+        # Percentages only mean something once a stage has said what they're counting
+        match = jamf_progress_percent.search(line)
+        if match and stage:
+            _, low, high = stage
+            percent = min(float(match.group(1)), 100.0)
+            progress = max(progress, int(low + (high - low) * percent / 100))
+
+        if stage is None or (stage == self.stage and progress == self.progress):
+            return
+
+        stage_changed = stage != self.stage
+        self.stage = stage
+        self.progress = progress
+
+        now = time.monotonic()
+        # Stage changes always go through, percentages are dropped between intervals
+        if not stage_changed and now - self.last_update < self.interval:
+            return
+        self.last_update = now
+        self.on_progress(stage[0], progress)
+
+
+class InstallProgress:
+    """The install list's overall progress bar, with each app weighted by its expected_duration"""
+
+    def __init__(self, jamf_app_list, commandfile, interval=progress_update_interval):
+        self.commandfile = commandfile
+        self.interval = interval
+        self.weights = {
+            app.get("name"): app.get("expected_duration") or default_expected_duration
+            for app in jamf_app_list
+        }
+        self.total = sum(self.weights.values())
+        self.done = dict.fromkeys(self.weights, 0.0)
+        self.finished = set()
+        self.last_update = None
+
+    def update(self, name, fraction):
+        self.done[name] = max(self.done.get(name, 0.0), fraction)
+
+        now = time.monotonic()
+        if self.last_update is not None and now - self.last_update < self.interval:
+            return
+        self.send(now)
+
+    def finish(self, name):
+        self.done[name] = 1.0
+        self.finished.add(name)
+        self.send(time.monotonic())
+        dialog_log(
+            f"progresstext: {len(self.finished)} of {len(self.weights)} apps finished",
+            commandfile=self.commandfile,
+        )
+
+    def send(self, now):
+        self.last_update = now
+        done = sum(self.weights[name] * self.done[name] for name in self.weights)
+        percent = int(100 * done / self.total) if self.total else 100
+        dialog_log(f"progress: {percent}", commandfile=self.commandfile)
+
+
+class InstallScheduler:
+    """Runs jamf triggers concurrently while honouring dependencies and shared locks"""
+
+    def __init__(self, concurrency=install_concurrency):
+        self.slots = asyncio.Semaphore(max(1, concurrency))
+        self.locks = {}
+
+    def lock(self, name):
+        if name not in self.locks:
+            self.locks[name] = asyncio.Lock()
+        return self.locks[name]
+
+    async def run(self, app, runner):
+        # Locks are always taken in sorted order so two apps sharing several locks can't deadlock
+        locks = [self.lock(name) for name in sorted(set(app.get("locks", [])))]
+        # Only the locks actually held are released, a queued install can be cancelled
+        held = []
+        try:
+            for lock in locks:
+                await lock.acquire()
+                held.append(lock)
+            async with self.slots:
+                return await runner(app)
+        finally:
+            for lock in reversed(held):
+                lock.release()
+
+
+class SpeculativeInstalls:
+    """Starts a role's default apps before the user confirms them, for schedule_jamf_app_list to adopt"""
+
+    def __init__(self, scheduler, journal=None):
+        self.scheduler = scheduler
+        self.journal = journal
+        self.tasks = {}
+        self.started = set()
+        self.adopted = {}
+        # Installs that were unticked after they started, recorded once they finish
+        self.unticked = []
+        # Output lines go nowhere until schedule_jamf_app_list adopts the app and listens
+        self.on_line = {}
+
+    def start(self, apps):
+        for app in apps:
+            logger.info(f"Speculatively installing {app['name']}")
+            self.tasks[app["name"]] = asyncio.create_task(
+                self.scheduler.run(app, self.install)
+            )
+
+    async def install(self, app):
+        self.started.add(app["name"])
+        trigger = app.get("trigger")
+
+        with tracer.span("trigger", trigger, speculative=True) as span:
+            # Not in the dialog yet, so retries can't be shown until the install is adopted
+            result = await run_jamf_policy_with_retries(
+                trigger,
+                app.get("timeout", jamf_policy_timeout),
+                on_line=lambda line: self.output(app["name"], line),
+            )
+            span["exit_code"] = result.returncode
+            span["attempts"] = result.attempts
+
+        return result
+
+    def output(self, name, line):
+        if name in self.on_line:
+            self.on_line[name](line)
+
+    def adopt(self, apps):
+        """Keeps the installs for apps the user selected, cancels the rest if they haven't started"""
+        for name, task in self.tasks.items():
+            if name in apps:
+                self.adopted[name] = task
+            elif name in self.started:
+                # Stopping jamf part way through an install could leave the app broken
+                logger.info(f"{name} was unticked after it started, letting it finish")
+                self.unticked.append(asyncio.create_task(self.record_unticked(name, task)))
+            else:
+                logger.info(f"{name} was unticked, cancelling its speculative install")
+                task.cancel()
+
+    def cancel(self, name):
+        """Cancels an adopted install that hasn't started, returns False if it already has"""
+        if name in self.started:
+            return False
+        logger.info(f"Cancelling the speculative install of {name}")
+        self.adopted.pop(name).cancel()
+        return True
+
+    async def record_unticked(self, name, task):
+        # Unticked or not, the Mac has changed, so inventory and the journal should know
+        result = await task
+        if not result.success:
+            # Left out of the journal, the next run shouldn't retry an app the user unticked
+            logger.warning(f"Unticked install of {name} failed: {result.reason}")
+            return
+        logger.info(f"Unticked install of {name} finished")
+        await asyncio.to_thread(
+            note_inventory_change, f"installed {name}", policy_recon_started(result)
+        )
+        if self.journal:
+            await self.journal.record(name, "success", "Installed")
+
+    async def wait(self):
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        await asyncio.gather(*self.unticked, return_exceptions=True)
+
+
+def role_default_apps(role, installed=frozenset()):
+    """Apps ticked by default for role that can be started before the selection is confirmed"""
+    catalog = app_catalog()
 
+    result = [
+        {
+            "name": app["name"],
+            "trigger": app["trigger"],
+            "locks": app.get("locks", []),
+            "timeout": app.get("timeout", jamf_policy_timeout),
+        }
+        for app in map(catalog.by_name.get, sorted(catalog.role_defaults.get(role, ())))
+        if app["name"] not in installed
+        # Dependencies are only known once the whole selection is
+        and not app.get("depends_on")
+    ]
+
+    return result
+
+
+def measure_bandwidth():
+    """Download speed in MB/s from a timed sample of bandwidth_probe_url, None if unknown"""
+    import requests
+
+    received = 0
+    try:
+        start_time = time.monotonic()
+        # Not mirrored, packages come from the distribution point so that's the link to measure
+        with requests.get(bandwidth_probe_url, stream=True, timeout=http_timeout) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(65536):
+                received += len(chunk)
+                if (
+                    received >= bandwidth_probe_bytes
+                    or time.monotonic() - start_time >= bandwidth_probe_seconds
+                ):
+                    break
+        elapsed = time.monotonic() - start_time
+    except requests.RequestException as e:
+        logger.warning(f"Unable to measure bandwidth from {bandwidth_probe_url}: {e}")
+        return None
+
+    # A few packets measure latency rather than bandwidth
+    if received < 65536 or elapsed <= 0:
+        logger.debug(f"Bandwidth sample too small to use: {received} bytes")
+        return None
+
+    result = received / elapsed / 1048576
+    logger.info(f"Measured {result:.1f} MB/s from {received} bytes in {elapsed:.1f}s")
+    return result
+
+
+def free_disk_mb():
+    try:
+        result = shutil.disk_usage(capacity_disk_path).free / 1048576
+    except OSError as e:
+        logger.warning(f"Unable to check free space on {capacity_disk_path}: {e}")
+        result = None
+    return result
+
+
+async def probe_install_capacity(demo_mode):
+    """Free disk in MB and download speed in MB/s, either is None if it couldn't be measured"""
+    # Demo runs don't download anything, so the link isn't worth measuring
+    free_mb, bandwidth = await asyncio.gather(
+        asyncio.to_thread(free_disk_mb),
+        asyncio.sleep(0) if demo_mode else asyncio.to_thread(measure_bandwidth),
+    )
+
+    result = {"free_mb": free_mb, "bandwidth": bandwidth}
+    logger.info(f"Install capacity: {result}")
+    return result
+
+
+def plan_installs(jamf_app_list, capacity, started=frozenset()):
+    """Returns (the apps in start order, {name: statustext} to defer, {name: download seconds})"""
+    free_mb = (capacity or {}).get("free_mb")
+    bandwidth = (capacity or {}).get("bandwidth")
+    space = None if free_mb is None else free_mb - disk_reserve_mb
+    deferred = {}
+    slow = {}
+
+    # Already downloading, so never deferred, but their space is spoken for before any other app's
+    if space is not None:
+        space -= sum(
+            (app.get("size") or 0) * disk_space_factor
+            for app in jamf_app_list
+            if app.get("name") in started
+        )
+
+    # Smallest first, so one heavy app can't crowd out several light ones
+    for app in sorted(jamf_app_list, key=lambda app: app.get("size") or 0):
+        name = app.get("name")
+        size = app.get("size")
+        if not size or name in started:
+            continue
+        needed = size * disk_space_factor
+
+        if space is not None and needed > space:
+            logger.warning(f"Deferring {name}, it needs {needed:.0f} MB and {space:.0f} MB is free")
+            deferred[name] = "Deferred, not enough disk space"
+            continue
+
+        if bandwidth:
+            seconds = size / bandwidth
+            if seconds > defer_download_seconds:
+                logger.warning(f"Deferring {name}, its download would take {seconds / 60:.0f} min")
+                deferred[name] = "Deferred, network too slow"
+                continue
+            if seconds > slow_download_seconds:
+                logger.warning(f"{name} needs about {seconds / 60:.0f} min to download, runs last")
+                slow[name] = seconds
+
+        if space is not None:
+            space -= needed
+
+    result = (
+        [app for app in jamf_app_list if app.get("name") not in slow]
+        + sorted(
+            (app for app in jamf_app_list if app.get("name") in slow),
+            key=lambda app: slow[app.get("name")],
+        ),
+        deferred,
+        slow,
+    )
+    return result
+
+
+async def schedule_jamf_app_list(
+    jamf_app_list,
+    demo_mode,
+    concurrency=install_concurrency,
+    journal=None,
+    speculative=None,
+    capacity=None,
+):
+    # Speculative installs share their scheduler so the concurrency limit and locks still hold
+    scheduler = speculative.scheduler if speculative else InstallScheduler(concurrency)
+    adopted = speculative.adopted if speculative else {}
+    depends_on = check_app_dependencies(jamf_app_list)
+    started = speculative.started & set(adopted) if speculative else set()
+    jamf_app_list, deferred, slow = plan_installs(jamf_app_list, capacity, started)
+    # Adopted installs still queued are deferred like any other, nothing has been downloaded
+    for name in set(deferred) & set(adopted):
+        if not speculative.cancel(name):
+            del deferred[name]
+    progress = InstallProgress(jamf_app_list, dialog_custom_commandfile)
+    tasks = {}
+
+    async def update(app, status, statustext):
+        dialog_log(
+            f"listitem: index: {app.get('index')}, status: {status}, statustext: {statustext}",
+            commandfile=dialog_custom_commandfile,
+        )
+        if journal:
+            await journal.record(app.get("name"), status, statustext)
+        if status != "wait":
+            progress.finish(app.get("name"))
+
+    def progress_parser(app):
+        def on_progress(statustext, percent):
+            # Live progress is left out of the journal, it's only useful while the dialog is open
             dialog_log(
+                f"listitem: index: {app.get('index')}, statustext: {statustext}, progress: {percent}",
                 commandfile=dialog_custom_commandfile,
-                dialog_command=f"listitem: index: {index}, status: wait, statustext: Installing",
             )
+            progress.update(app.get("name"), percent / 100)
 
-            if demo_mode:
-                logger.info(f"Demo mode is enabled, marking {trigger} successful")
-                time.sleep(0.5)
-                dialog_log(
-                    commandfile=dialog_custom_commandfile,
-                    dialog_command=f"listitem: index: {index}, status: success, statustext: Demo",
-                )
-            else:
-                if run_jamf_policy(trigger):
-                    logger.info(f"Policy successful: {trigger}")
-                    dialog_log(
-                        commandfile=dialog_custom_commandfile,
-                        dialog_command=f"listitem: index: {index}, status: success, statustext: Installed",
-                    )
-                else:
-                    logger.warning(f"Policy failed: {trigger}")
-                    dialog_log(
-                        commandfile=dialog_custom_commandfile,
-                        dialog_command=f"listitem: index: {index}, status: fail, statustext: Failed",
-                    )
+        return JamfProgressParser(on_progress)
+
+    async def install(app):
+        index = app.get("index")
+        trigger = app.get("trigger")
+
+        await update(app, "wait", "Installing")
+
+        if demo_mode:
+            logger.info(f"Demo mode is enabled, marking {trigger} successful")
+            await asyncio.sleep(0.5)
+            await update(app, "success", "Demo")
+            return True
+
+        parser = progress_parser(app)
+
+        async def on_status(statustext):
+            parser.reset()
+            await update(app, "wait", statustext)
+
+        with tracer.span("trigger", trigger, index=index) as span:
+            result = await run_jamf_policy_with_retries(
+                trigger, app.get("timeout", jamf_policy_timeout), on_status, parser.feed
+            )
+            span["exit_code"] = result.returncode
+            span["attempts"] = result.attempts
+
+        return await finish(app, result)
+
+    async def adopt(app):
+        # Started while the user was choosing, already holds its slot and locks
+        await update(app, "wait", "Installing")
+        speculative.on_line[app.get("name")] = progress_parser(app).feed
+        result = await adopted[app.get("name")]
+        return await finish(app, result)
+
+    async def finish(app, result):
+        trigger = app.get("trigger")
+
+        if result.success:
+            logger.info(f"Policy successful: {trigger} ({result.duration:.1f}s)")
+            # Submitted once at the end by flush_recon, unless the policy ran its own recon
+            await asyncio.to_thread(
+                note_inventory_change,
+                f"installed {app.get('name')}",
+                policy_recon_started(result),
+            )
+            await update(app, "success", "Installed")
+            return True
+        else:
+            logger.warning(
+                f"Policy failed: {trigger} ({result.returncode}, {result.failure}: {result.reason})"
+            )
+            logger.warning("\n".join(result.output))
+            statustext = result.reason or "Failed"
+            if result.failure == "transient" and result.attempts > 1:
+                statustext = f"{statustext} after {result.attempts} tries"
+            await update(app, "fail", statustext)
+            return False
+
+    async def schedule(app):
+        name = app.get("name")
+
+        if name in deferred:
+            # Left open in the journal, so the next run tries it again
+            await update(app, "error", deferred[name])
+            return False
+
+        for dependency in depends_on[name]:
+            if not await tasks[dependency]:
+                logger.warning(f"Skipping {name}, dependency {dependency} failed")
+                await update(app, "fail", "Skipped")
+                return False
+
+        if name in adopted:
+            return await adopt(app)
+        return await scheduler.run(app, install)
+
+    for app in jamf_app_list:
+        if app.get("name") in slow:
+            dialog_log(
+                f"listitem: index: {app.get('index')}, status: pending, "
+                f"statustext: Queued, about {slow[app.get('name')] / 60:.0f} min download",
+                commandfile=dialog_custom_commandfile,
+            )
+
+    # Every task is created before any of them runs, so dependencies can always be looked up
+    for app in jamf_app_list:
+        tasks[app.get("name")] = asyncio.create_task(schedule(app))
+
+    results = await asyncio.gather(*tasks.values())
+    return dict(zip(tasks.keys(), results))
+
+
+async def process_jamf_app_list(
+    jamf_app_list,
+    demo_mode,
+    concurrency=install_concurrency,
+    journal=None,
+    speculative=None,
+    capacity=None,
+):
+    # Adding initial sleep so that swiftDialog has time to catch up
+    logger.debug("########################################################")
+    logger.debug("process_jamf_app_list")
+    logger.debug("########################################################")
+
+    if jamf_app_list:
+        await asyncio.sleep(1)
+        with tracer.span("phase", "installs"):
+            results = await schedule_jamf_app_list(
+                jamf_app_list, demo_mode, concurrency, journal, speculative, capacity
+            )
+        logger.debug(f"process_jamf_app_list results: {results}")
 
         dialog_log(
             commandfile=dialog_custom_commandfile,
             dialog_command="quit:",
         )
+        await dialog_channel(dialog_custom_commandfile).flush()
 
     return
 
 
+@dataclass
+class EnrolmentTrigger:
+    trigger: str
+    path: str = ""
+
+
+@dataclass
+class EnrolmentStep:
+    listitem: str
+    icon: str = ""
+    progresstext: str = ""
+    trigger_list: List[EnrolmentTrigger] = field(default_factory=list)
+
+
+def parse_policy_array(policy_json):
+    """Parses 000_enrolment.sh's policy_array into EnrolmentSteps in one pass"""
+    data = json.loads(policy_json)
+
+    result = [
+        EnrolmentStep(
+            listitem=step.get("listitem", ""),
+            icon=step.get("icon", ""),
+            progresstext=step.get("progresstext", ""),
+            trigger_list=[
+                EnrolmentTrigger(trigger=t["trigger"], path=t.get("path", ""))
+                for t in step.get("trigger_list", [])
+            ],
+        )
+        for step in data["steps"]
+    ]
+
+    return result
+
+
+def echo_logger(message):
+    # Same format as echo_logger in the enrolment bash scripts, so their logs stay parseable
+    line = f"{time.strftime('%Y-%m-%d %H:%M:%S%z')} - {message}"
+    print(line, flush=True)
+    try:
+        with open(enrolment_log, "a") as f:
+            f.write(f"{line}\n")
+    except OSError as e:
+        logger.debug(f"Unable to write to {enrolment_log}: {e}")
+
+
+async def run_enrolment_trigger(trigger, testing_mode, index=None):
+    if testing_mode:
+        echo_logger(f"TESTING: {trigger}")
+        with tracer.span("trigger", trigger, index=index, exit_code=0):
+            await asyncio.sleep(1)
+        return True
+
+    if trigger == "recon":
+        echo_logger(f"RUNNING: {jamf_binary} {trigger}")
+        # Records the recon for 001_post_enrolment.sh and the walkthrough, and traces it
+        if not await request_recon("enrolment"):
+            echo_logger(f"WARNING: {trigger} failed")
+            return False
+        return True
+
+    with tracer.span("trigger", trigger, index=index) as span:
+        echo_logger(f"RUNNING: {jamf_binary} policy -event {trigger}")
+        # Sub-policy output belongs in the parent policy's log, as it was when bash ran jamf
+        result = await run_jamf_policy(
+            trigger, on_line=lambda line: logger.info(f"{trigger}: {line}")
+        )
+        span["exit_code"] = result.returncode
+
+    if not result.success:
+        echo_logger(f"WARNING: {trigger} exited with {result.returncode} ({result.reason})")
+
+    return result.success
+
+
+async def run_enrolment_steps(
+    steps, testing_mode, commandfile=dialog_commandfile, steps_done=None
+):
+    """Drives the swiftDialog list for 000_enrolment.sh while running each step's triggers"""
+    channel = dialog_channel(commandfile)
+
+    def update(dialog_command):
+        echo_logger(f"DIALOG: {dialog_command}")
+        channel.send(dialog_command)
+
+    update(f"list: {', '.join(step.listitem for step in steps)}")
+    for index in range(len(steps)):
+        update(f"listitem: index: {index}, status: pending, statustext: Pending...")
+
+    if testing_mode:
+        await asyncio.sleep(2)
+
+    for index, step in enumerate(steps):
+        if step.listitem:
+            update(f"listitem: index: {index}, status: wait, statustext: Downloading...")
+        if step.icon:
+            update(f"icon: {step.icon}")
+        if step.progresstext:
+            update(f"progresstext: {step.progresstext}")
+
+        with tracer.span("step", step.listitem, index=index):
+            for trigger in step.trigger_list:
+                # If the path has a value, check if that path exists on disk
+                if trigger.path and os.path.isfile(trigger.path):
+                    echo_logger(f"INFO: {trigger.path} exists, moving on")
+                else:
+                    await run_enrolment_trigger(trigger.trigger, testing_mode, index)
+
+        if step.listitem:
+            update(f"listitem: index: {index}, status: success, statustext: Installed")
+        if steps_done:
+            # 000_enrolment.sh's bash loop carries on from here if the engine dies
+            with open(steps_done, "w") as f:
+                f.write(f"{index + 1}\n")
+
+    await channel.flush()
+
+
+async def run_policy_array(policy_file, testing_mode, steps_done=None):
+    if policy_file == "-":
+        policy_json = sys.stdin.read()
+    else:
+        with open(policy_file) as f:
+            policy_json = f.read()
+
+    steps = parse_policy_array(policy_json)
+    logger.debug(f"steps: {steps}")
+
+    await run_enrolment_steps(steps, testing_mode, steps_done=steps_done)
+
+
+def write_json_atomic(path, data):
+    """Writes JSON via a temp file and rename so readers never see a partial file"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+class WalkthroughJournal:
+    """Keeps the selected role, apps and their install statuses on disk so a restart can resume"""
+
+    def __init__(self, path=walkthrough_state):
+        self.path = path
+        self.state = {"version": 1, "phases": []}
+        self.revision = 0
+        self.written = 0
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Returns True if an unfinished walkthrough was found"""
+        if not self.path:
+            return False
+
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable {self.path}: {e}")
+            return False
+
+        if state.get("version") != 1 or state.get("complete"):
+            return False
+
+        self.state = state
+        return True
+
+    def phase_done(self, phase):
+        return phase in self.state["phases"]
+
+    def completed_apps(self):
+        return {
+            name
+            for name, app in self.state.get("apps", {}).items()
+            if app["status"] == "success"
+        }
+
+    async def start(self, role, apps, installed):
+        self.state["role"] = role
+        self.state["apps"] = {
+            app: {"status": "success", "statustext": "Installed"}
+            if app in installed
+            else {"status": "pending", "statustext": "Pending"}
+            for app in apps
+        }
+        await self.save()
+
+    async def record(self, app, status, statustext):
+        self.state.setdefault("apps", {})[app] = {
+            "status": status,
+            "statustext": statustext,
+        }
+        await self.save()
+
+    async def complete_phase(self, phase):
+        if not self.phase_done(phase):
+            self.state["phases"].append(phase)
+            await self.save()
+
+    async def finish(self):
+        # Failed apps keep the journal open, so the next run retries them
+        remaining = set(self.state.get("apps", {})) - self.completed_apps()
+        if remaining:
+            logger.info(f"Leaving {self.path} open to retry: {sorted(remaining)}")
+            return
+        self.state["complete"] = True
+        await self.save()
+
+    async def save(self):
+        if not self.path:
+            return
+        self.revision += 1
+        await asyncio.to_thread(self.write, self.revision, copy.deepcopy(self.state))
+
+    def write(self, revision, state):
+        # Writes finish in any order, never let an older state replace a newer one
+        with self.lock:
+            if revision < self.written:
+                return
+            try:
+                write_json_atomic(self.path, state)
+                self.written = revision
+            except OSError as e:
+                logger.warning(f"Unable to write {self.path}: {e}")
+
+
+@contextmanager
+def inventory_lock():
+    """Serialises inventory_state changes between the enrolment scripts and the walkthrough"""
+    try:
+        lock_file = open(f"{inventory_state}.lock", "a")
+    except OSError as e:
+        logger.debug(f"Unable to lock {inventory_state}: {e}")
+        yield
+        return
+
+    with lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def load_inventory_state():
+    try:
+        with open(inventory_state) as f:
+            result = json.load(f)
+    except (OSError, ValueError):
+        result = {}
+
+    result.setdefault("last_recon", 0)
+    result.setdefault("running_since", None)
+    result.setdefault("pending", [])
+    return result
+
+
+def update_inventory_state(change):
+    """Applies change to inventory_state under the lock and returns the new state"""
+    with inventory_lock():
+        state = load_inventory_state()
+        change(state)
+        try:
+            write_json_atomic(inventory_state, state)
+        except OSError as e:
+            logger.warning(f"Unable to write {inventory_state}: {e}")
+    return state
+
+
+def note_inventory_change(reason, recon_started=None):
+    """Records something recon should pick up, or that a policy's own recon already has"""
+
+    def change(state):
+        if recon_started is not None:
+            # The policy's recon covered everything recorded before the policy started
+            state["last_recon"] = max(state["last_recon"], recon_started)
+            state["pending"] = [p for p in state["pending"] if p["time"] > recon_started]
+        else:
+            state["pending"].append({"reason": reason, "time": time.time()})
+
+    update_inventory_state(change)
+
+
+def policy_recon_started(policy):
+    """When a policy's own recon started, None if its output doesn't show one"""
+    result = (
+        time.time() - policy.duration
+        if any(jamf_recon_output.search(line) for line in policy.output)
+        else None
+    )
+    return result
+
+
+async def submit_recon(reasons):
+    started = time.time()
+    logger.info(f"Submitting inventory for: {', '.join(reasons)}")
+
+    with tracer.span("trigger", "recon", reasons=reasons) as span:
+        result = await run_jamf_command(["recon"], "recon")
+        span["exit_code"] = result.returncode
+
+    def change(state):
+        state["running_since"] = None
+        if result.success:
+            state["last_recon"] = started
+            # Anything recorded while recon was running might not be in it
+            state["pending"] = [p for p in state["pending"] if p["time"] > started]
+
+    await asyncio.to_thread(update_inventory_state, change)
+    return result.success
+
+
+async def request_recon(reason, window=None):
+    """Runs recon for reason unless one ran within window, in which case it waits for flush_recon"""
+    window = recon_window if window is None else window
+    decision = {}
+
+    def change(state):
+        now = time.time()
+        if recon_running(state, now) or now - state["last_recon"] < window:
+            state["pending"].append({"reason": reason, "time": now})
+            decision["skip"] = True
+        else:
+            state["running_since"] = now
+            decision["reasons"] = [p["reason"] for p in state["pending"]] + [reason]
+
+    state = await asyncio.to_thread(update_inventory_state, change)
+    if decision.get("skip"):
+        logger.info(
+            f"Skipping recon for {reason}, last submitted {time.time() - state['last_recon']:.0f}s ago"
+        )
+        return True
+
+    result = await submit_recon(decision["reasons"])
+    return result
+
+
+def recon_running(state, now):
+    # A recon that's been running for longer than any policy may has died without saying so
+    result = bool(state["running_since"]) and now - state["running_since"] < jamf_policy_timeout
+    return result
+
+
+async def flush_recon():
+    """Submits one recon for every change recorded since the last one, if there are any"""
+    decision = {}
+
+    def change(state):
+        now = time.time()
+        decision.clear()
+        if not state["pending"]:
+            return
+        if recon_running(state, now):
+            decision["wait"] = True
+        else:
+            state["running_since"] = now
+            decision["reasons"] = sorted({p["reason"] for p in state["pending"]})
+
+    # Another script's recon may not include changes made after it started, so wait for
+    # it to finish and see what it left pending rather than dropping them
+    await asyncio.to_thread(update_inventory_state, change)
+    while decision.get("wait"):
+        logger.debug("Waiting for the running recon to finish")
+        await asyncio.sleep(recon_poll_interval)
+        # Only read while it's still running, the file is rewritten once it's our turn
+        state = await asyncio.to_thread(load_inventory_state)
+        if not recon_running(state, time.time()):
+            await asyncio.to_thread(update_inventory_state, change)
+
+    if not decision:
+        logger.debug("No inventory changes to submit")
+        return True
+
+    result = await submit_recon(decision["reasons"])
+    return result
+
+
+def version_key(version):
+    """Comparable key for versions like 13.4.1 or "4.20.1 (123)", replaces pkg_resources.parse_version"""
+    result = []
+
+    for part in str(version).strip().split(" ")[0].split("."):
+        digits = re.match(r"\d*", part).group()
+        result.append(int(digits) if digits else 0)
+
+    # 13.4 and 13.4.0 are the same version
+    while len(result) > 1 and result[-1] == 0:
+        result.pop()
+
+    return tuple(result)
+
+
+def macos_major_version(version):
+    # 10.15.7 -> 10.15, 13.4.1 -> 13
+    parts = version.split(".")
+    return ".".join(parts[:2]) if parts[0] == "10" else parts[0]
+
+
+def build_patch_feed_index(data):
+    """Maps each macOS major version in the patch feed to its latest version"""
+    result = {}
+
+    for item in data:
+        if not item.get("name", "").startswith("Apple macOS"):
+            continue
+
+        version = item.get("currentVersion", "").split(" ")[0]
+        if not version:
+            continue
+
+        major = macos_major_version(version)
+        current = result.get(major)
+        if current is None or version_key(version) > version_key(current["version"]):
+            result[major] = {"name": item["name"], "version": version}
+
+    return result
+
+
+def load_patch_feed_cache():
+    try:
+        with open(patch_feed_cache) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def fetch_patch_feed_index():
+    """Returns the macOS patch feed index, from the on-disk cache while it's fresh"""
+    import requests
+
+    cache = load_patch_feed_cache()
+
+    if cache and time.time() - cache.get("fetched", 0) < patch_feed_max_age:
+        logger.debug("Patch feed cache is fresh")
+        return cache["index"]
+
+    headers = {}
+    if cache:
+        if cache.get("etag"):
+            headers["If-None-Match"] = cache["etag"]
+        if cache.get("last_modified"):
+            headers["If-Modified-Since"] = cache["last_modified"]
+
+    try:
+        request = mirrored_get(patch_feed_url, headers=headers, timeout=http_timeout)
+        logger.debug(f"Requests status_code: {request.status_code}")
+
+        if request.status_code == 304 and cache:
+            cache["fetched"] = time.time()
+        else:
+            request.raise_for_status()
+            cache = {
+                "etag": request.headers.get("ETag"),
+                "last_modified": request.headers.get("Last-Modified"),
+                "fetched": time.time(),
+                "index": build_patch_feed_index(request.json()),
+            }
+
+        write_json_atomic(patch_feed_cache, cache)
+    except (requests.RequestException, OSError, ValueError) as e:
+        if cache:
+            logger.warning(f"Patch feed unavailable, using cached copy: {e}")
+        else:
+            logger.warning(f"Patch feed unavailable: {e}")
+            return {}
+
+    return cache["index"]
+
+
+def resolve_patch_feed_index():
+    with patch_feed_lock:
+        if patch_feed_memo["index"] is None:
+            patch_feed_memo["index"] = fetch_patch_feed_index()
+        return patch_feed_memo["index"]
+
+
+async def get_patch_feed_index():
+    # Fetched once per process in a worker thread, main() starts this early so
+    # it overlaps with the welcome dialog
+    if patch_feed_memo["index"] is not None:
+        return patch_feed_memo["index"]
+
+    result = await asyncio.to_thread(resolve_patch_feed_index)
+    return result
+
+
 async def macos_update_required(demo_mode):
     # Get the current version of macOS
     local_version = platform.mac_ver()[0]
@@ -285,21 +2433,14 @@ async def macos_update_required(demo_mode):
         update_required = True
         latest_version = "19.1"
     else:
-        # Get the JSON data from the URL
-        url = "https://jamf-patch.jamfcloud.com/v1/software/"
-        request = requests.get(url)
-        data = request.json()
-
-        logger.debug(f"Requests status_code: {request.status_code}")
-
-        # Use list comprehension to filter the JSON data and retrieve the item with the name "Apple macOS Ventura"
-        item = next((i for i in data if i["name"] == "Apple macOS Ventura"), None)
+        patch_feed_index = await get_patch_feed_index()
+        item = patch_feed_index.get(macos_major_version(local_version))
 
         if item:
-            latest_version = item["currentVersion"].split(" ")[0]
+            latest_version = item["version"]
 
-            parsed_local_version = parse_version(local_version)
-            parsed_latest_version = parse_version(latest_version)
+            parsed_local_version = version_key(local_version)
+            parsed_latest_version = version_key(latest_version)
 
             logger.info(f"Current version: {local_version}")
             logger.info(f"Latest version: {latest_version}")
@@ -312,7 +2453,7 @@ async def macos_update_required(demo_mode):
                 update_required = False
         else:
             logger.warning(
-                "The item 'Apple macOS Ventura' could not be found in the JSON data."
+                f"macOS {local_version} could not be found in the patch feed."
             )
             update_required = False
             latest_version = None
@@ -329,7 +2470,8 @@ async def dialog_prompt(commandfile=dialog_commandfile, **kwargs):
     logger.debug(f"dialog_prompt kwargs: {kwargs}")
 
     blocking = kwargs.get("blocking", True)
-    dialog_icon = await get_self_service_branding_icon()
+    # main() fetches the branding icon in the background, dialogs never wait on it
+    dialog_icon = current_self_service_branding_icon()
 
     dialog_dict = {
         "button1text": kwargs.get("button1text"),
@@ -360,50 +2502,134 @@ async def dialog_prompt(commandfile=dialog_commandfile, **kwargs):
             "height": kwargs.get("height"),
         }
 
+    if kwargs.get("progress"):
+        dialog_dict |= {
+            "progress": kwargs.get("progress"),
+            "progresstext": kwargs.get("progresstext"),
+        }
+
     if kwargs.get("timer"):
         dialog_dict |= {
             "timer": kwargs.get("timer"),
             "hidetimerbar": True,
         }
 
-    json_string = shlex.quote(json.dumps(dialog_dict))
+    json_string = json.dumps(dialog_dict)
     logger.debug(f"json_string: {json_string}")
 
-    cmd = f"{dialog_binary} \
-        --jsonstring {json_string}"
-    logger.debug(f"cmd: {cmd}")
-    cmd_split = shlex.split(cmd)
-    # cmd_quote = shlex.quote(cmd)
+    json_file = None
+    if len(json_string) > dialog_json_max_arg:
+        # Big catalogs overflow the argument list (E2BIG), so hand swiftDialog a file instead
+        fd, json_file = tempfile.mkstemp(prefix="dialog.", suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            f.write(json_string)
+        cmd_split = [dialog_binary, "--jsonfile", json_file]
+    else:
+        cmd_split = [dialog_binary, "--jsonstring", json_string]
+    logger.debug(f"cmd: {shlex.join(cmd_split)}")
 
     # TODO: Need to figure out a better way to implement this
     if blocking:
-        # Default action for .run() is to block before moving on
-        # TODO: Should this use asyncio.create_subprocess_shell - https://docs.python.org/3/library/asyncio-subprocess.html
-        blocking_prompt = subprocess.run(cmd_split, capture_output=True)
+        # Wait for the dialog to close without holding up the event loop, so installs keep running
+        with tracer.span("dialog", kwargs.get("title")) as span:
+            blocking_prompt = await asyncio.create_subprocess_exec(
+                *cmd_split,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            try:
+                stdout, stderr = await blocking_prompt.communicate()
+            finally:
+                if json_file:
+                    os.remove(json_file)
+            span["exit_code"] = blocking_prompt.returncode
         logger.debug(f"blocking_prompt: {blocking_prompt}")
 
         if blocking_prompt.returncode == 0:
-            result = json.loads(blocking_prompt.stdout)
+            result = json.loads(stdout)
         elif blocking_prompt.returncode == 4:
             logger.debug(f"Return code was {blocking_prompt.returncode}, timer ran out")
             result = True
         else:
-            logger.warning(f"blocking_prompt: {blocking_prompt}")
+            logger.warning(f"blocking_prompt: {blocking_prompt} {stderr}")
             result = False
     elif not blocking:
-        # Default action for .Popen() is to spawn the dialog window, then move on
-        # TODO: Should this use asyncio.create_subprocess_shell - https://docs.python.org/3/library/asyncio-subprocess.html
-        result = subprocess.Popen(
-            cmd_split, stdin=None, stdout=None, stderr=None, close_fds=True
+        # Spawn the dialog window, then move on. main() waits for it before exiting.
+        result = await asyncio.create_subprocess_exec(
+            *cmd_split,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
         )
-        # result = asyncio.create_subprocess_shell(
-        #     cmd_quote, stdin=None, stdout=None, stderr=None, close_fds=True
-        # )
+        background_dialogs.append(result)
+        if json_file:
+            dialog_json_files.append(json_file)
 
     logger.debug(f"result: {result}")
     return result
 
 
+def app_installed(detect):
+    """Checks an app_list detection rule: the path exists and meets any minimum version"""
+    path = detect.get("path")
+    if not path or not os.path.exists(path):
+        return False
+
+    min_version = detect.get("min_version")
+    if not min_version:
+        return True
+
+    info_plist = (
+        os.path.join(path, "Contents", "Info.plist") if path.endswith(".app") else path
+    )
+    try:
+        with open(info_plist, "rb") as f:
+            version = plistlib.load(f).get("CFBundleShortVersionString")
+        return bool(version) and version_key(version) >= version_key(min_version)
+    except Exception as e:
+        logger.debug(f"Unable to read version from {info_plist}: {e}")
+        return False
+
+
+async def detect_installed_apps(apps=None):
+    """Evaluates each app's detection rule off the event loop, returns those already installed"""
+    apps = app_catalog().apps if apps is None else apps
+
+    # One thread for the whole catalog, a stat is far cheaper than a thread hand-off per app
+    results = await asyncio.to_thread(
+        lambda: [app_installed(app.get("detect", {})) for app in apps]
+    )
+    result = {app["name"] for app, installed in zip(apps, results) if installed}
+    logger.debug(f"installed_apps: {result}")
+
+    return result
+
+
+async def wait_background_dialogs():
+    """Waits for non-blocking dialogs to close, they should already have been sent quit:"""
+    for process in background_dialogs:
+        try:
+            await asyncio.wait_for(process.wait(), dialog_exit_grace)
+        except asyncio.TimeoutError:
+            logger.warning(f"Dialog {process.pid} is still open, leaving it behind")
+    background_dialogs.clear()
+
+    for json_file in dialog_json_files:
+        try:
+            os.remove(json_file)
+        except OSError:
+            pass
+    dialog_json_files.clear()
+
+
+async def open_url(url):
+    # open returns as soon as the URL is handed off, so this never holds up the walkthrough
+    process = await asyncio.create_subprocess_exec("open", url)
+    result = await process.wait()
+    logger.debug(f"open {url}: {result}")
+    return result
+
+
 async def return_selected_role(**kwargs):
     """Displays a message to the user via Dialog to select their role"""
     result = None
@@ -432,24 +2658,29 @@ async def return_selected_apps(**kwargs):
     title = kwargs.get("title")
     message = kwargs.get("message")
     role = kwargs.get("role")
-    desired_keys = ["name", "checked"]
+    installed = kwargs.get("installed", set())
 
+    # The role's checkboxes are built once, each call only swaps in icons and installed apps
     app_checkboxes = [
         {
-            **{
-                "label"
-                if key == "name"  # Changes key name to "label" if it was "name" prior
-                else key: value
-                if key != "checked"
-                else role in value
-                for key, value in item.items()
-                if key in desired_keys  # filter key-value pairs based on desired_keys
-            },
-            # Add new boolean key-value pair to each item based on the name of the item
-            "disabled": item["name"] == "Microsoft Office",
+            **checkbox,
+            **({"icon": local_icon(checkbox["icon"])} if "icon" in checkbox else {}),
+            # Already installed apps are shown ticked but can't be changed
+            **(
+                {
+                    "label": f"{checkbox['label']} (Installed)",
+                    "checked": True,
+                    "disabled": True,
+                }
+                if checkbox["label"] in installed
+                else {}
+            ),
         }
-        for item in app_list  # Iterate over each item in the app_list
+        for checkbox in app_catalog().checkboxes(role)
     ]
+    checkbox_names = {
+        f"{name} (Installed)": name for name in installed
+    }
 
     logger.debug(app_checkboxes)
 
@@ -465,7 +2696,11 @@ async def return_selected_apps(**kwargs):
 
     if type(selected_apps) is dict:
         # Filter dict to selected applications only
-        result = list(dict(filter(lambda e: e[1], selected_apps.items())).keys())
+        result = [
+            checkbox_names.get(label, label)
+            for label, selected in selected_apps.items()
+            if selected
+        ]
         logger.debug(f"selected_apps: {result}")
 
     return result
@@ -475,21 +2710,28 @@ async def create_selected_app_lists(**kwargs):
     # Makes new lists from the selected apps
 
     apps = kwargs.get("apps")
+    installed = kwargs.get("installed", set())
 
     if type(apps) is not list:
         raise TypeError("apps must be a list")
-    else:
-        selected_apps = sorted(apps)
+
+    catalog = app_catalog()
+    unknown_apps = [app for app in apps if app not in catalog.by_name]
+    if unknown_apps:
+        logger.warning(f"Ignoring apps that aren't in the catalog: {unknown_apps}")
+    selected_apps = sorted(app for app in apps if app in catalog.by_name)
 
     # Create listitem for for use in swiftDialog
     dialog_listitem = [
         {
-            "title": app,
-            "icon": next(a["icon"] for a in app_list if a["name"] == app),
-            "status": "pending",
-            "statustext": "Pending",
+            **listitem,
+            **({"icon": local_icon(listitem["icon"])} if "icon" in listitem else {}),
+            "status": "success" if app in installed else "pending",
+            "statustext": "Installed" if app in installed else "Pending",
         }
-        for app in selected_apps
+        for app, listitem in zip(
+            selected_apps, map(catalog.listitem, selected_apps)
+        )
     ]
     logger.debug(f"dialog_listitem: {dialog_listitem}")
 
@@ -498,9 +2740,16 @@ async def create_selected_app_lists(**kwargs):
         {
             "index": index,
             "name": app,
-            "trigger": next(a["trigger"] for a in app_list if a["name"] == app),
+            "trigger": catalog.by_name[app]["trigger"],
+            "depends_on": catalog.by_name[app].get("depends_on", []),
+            "locks": catalog.by_name[app].get("locks", []),
+            "timeout": catalog.by_name[app].get("timeout", jamf_policy_timeout),
+            "expected_duration": catalog.by_name[app].get("expected_duration"),
+            "size": catalog.by_name[app].get("size"),
         }
         for index, app in enumerate(selected_apps)
+        # Already installed apps keep their listitem index but never run a policy
+        if app not in installed
     ]
     logger.debug(f"jamf_app_list: {jamf_app_list}")
 
@@ -534,57 +2783,113 @@ async def walkthrough_welcome(demo_mode):
     )
 
 
-async def walkthrough_role_app_selection():
+async def walkthrough_install_list(dialog_listitem):
+    # Start the install list from an empty command file
+    dialog_channel(dialog_custom_commandfile).reset()
+
+    await dialog_prompt(
+        title=f"{dialog_title_prefix}: Installing Applications",
+        message="""\
+            These applications are now being installed. \n\n
+            This will continue in the background.
+        """,
+        icon=download_icon,
+        button1text="Ok",
+        small=False,
+        blocking=False,
+        ontop=False,
+        listitem=dialog_listitem,
+        position="bottomright",
+        progress=100,
+        progresstext="Starting installs",
+        commandfile=dialog_custom_commandfile,
+    )
+
+
+async def walkthrough_role_app_selection(
+    installed_apps=None, journal=None, speculative=None
+):
     logger.debug("########################################################")
     logger.debug("role_app_selection")
     logger.debug("########################################################")
     await asyncio.sleep(0)
 
+    # Detected by main() while earlier dialogs are on screen
+    installed = (
+        installed_apps if installed_apps is not None else await detect_installed_apps()
+    )
+
     # Promt user which role they're in and return
     selected_role = await return_selected_role(
         title=f"{dialog_title_prefix}: Select Role",
         message="""\
             Please select the role that most closely aligns to your function.
             """,
-        roles=role_dict,
+        roles=app_catalog().roles,
     )
 
+    # Turn the time spent on the app selection dialog into install time
+    if speculative and selected_role:
+        speculative.start(role_default_apps(selected_role, installed))
+
     # Ask the user what additional applications they would like to install
     selected_apps = await return_selected_apps(
         title=f"{dialog_title_prefix}: Select Applications",
         message="Please select any additional applications you'd like us to install now:",
         role=selected_role,
+        installed=installed,
     )
 
     # Install the selected applications
     if selected_apps:
         dialog_listitem, jamf_app_list = await create_selected_app_lists(
-            apps=selected_apps
+            apps=selected_apps, installed=installed
         )
 
-        await dialog_prompt(
-            title=f"{dialog_title_prefix}: Installing Applications",
-            message="""\
-                These applications are now being installed. \n\n
-                This will continue in the background.
-            """,
-            icon=download_icon,
-            button1text="Ok",
-            small=False,
-            blocking=False,
-            ontop=False,
-            listitem=dialog_listitem,
-            position="bottomright",
-            commandfile=dialog_custom_commandfile,
-        )
+        if journal:
+            await journal.start(selected_role, selected_apps, installed)
+
+        # After the journal is started, so unticked installs are recorded in it
+        if speculative:
+            speculative.adopt({app["name"] for app in jamf_app_list})
+
+        await walkthrough_install_list(dialog_listitem)
 
         return jamf_app_list
 
     else:
         logger.debug("app_selection was empty, moving on")
+        if speculative:
+            speculative.adopt(set())
         return None
 
 
+async def walkthrough_resume_installs(journal, installed_apps=None):
+    logger.debug("########################################################")
+    logger.debug("walkthrough_resume_installs")
+    logger.debug("########################################################")
+
+    # Apps dropped from the catalog since the journal was written can't be installed any more
+    known_apps = app_catalog().by_name
+    apps = [app for app in journal.state.get("apps", {}) if app in known_apps]
+    if not apps:
+        logger.debug("No apps to resume, moving on")
+        return None
+
+    installed = journal.completed_apps()
+    if installed_apps:
+        installed |= installed_apps
+
+    dialog_listitem, jamf_app_list = await create_selected_app_lists(
+        apps=apps, installed=installed
+    )
+    logger.info(f"Resuming installs: {[app['name'] for app in jamf_app_list]}")
+
+    await walkthrough_install_list(dialog_listitem)
+
+    return jamf_app_list
+
+
 async def walkthrough_device_update(demo_mode):
     logger.debug("########################################################")
     logger.debug("walkthrough_device_update")
@@ -601,13 +2906,9 @@ async def walkthrough_device_update(demo_mode):
         major_version = int(local_version.split(".")[0])
 
         if major_version >= 13:
-            cmd = "open 'x-apple.systempreferences:com.apple.Software-Update-Settings.extension'"
+            url = "x-apple.systempreferences:com.apple.Software-Update-Settings.extension"
         else:
-            cmd = (
-                "open 'x-apple.systempreferences:com.apple.preferences.softwareupdate'"
-            )
-
-        await asyncio.sleep(1.5)
+            url = "x-apple.systempreferences:com.apple.preferences.softwareupdate"
 
         await dialog_prompt(
             title=f"{dialog_title_prefix}: Update Required",
@@ -630,11 +2931,8 @@ async def walkthrough_device_update(demo_mode):
             logger.info("demo_mode enabled, bypassing Software Update launch")
         else:
             # Launch Software Update - Can't use a button action for the deep linking to Software Update
-            result = await asyncio.create_subprocess_shell(cmd)
-            logger.debug(f"result: {result}")
+            await open_url(url)
     else:
-        await asyncio.sleep(1.5)
-
         await dialog_prompt(
             title=f"{dialog_title_prefix}: macOS Update",
             message="""\
@@ -659,8 +2957,6 @@ async def walkthrough_device_registration(demo_mode):
     logger.debug("########################################################")
     await asyncio.sleep(0)
 
-    await asyncio.sleep(1.5)
-
     # if demo_mode:
     #     logger.info("demo_mode enabled, disabling button action")
     #     button1action = None
@@ -686,27 +2982,75 @@ async def walkthrough_device_registration(demo_mode):
     if demo_mode:
         logger.info("demo_mode enabled, bypassing Self Service launch")
     else:
-        cmd = f"open '{mem_registration_policy_url}'"
-        result = await asyncio.create_subprocess_shell(cmd)
-        logger.debug(f"result: {result}")
+        await open_url(mem_registration_policy_url)
+
+
+@dataclass
+class WalkthroughStep:
+    """A step in the walkthrough graph. run is given the results of the steps in needs."""
+
+    name: str
+    run: Callable
+    # Steps whose results this one takes
+    needs: List[str] = field(default_factory=list)
+    # Steps that must have finished first, e.g. the dialog shown before this one
+    after: List[str] = field(default_factory=list)
+    # Phases are traced and journaled, background steps aren't
+    phase: bool = True
+    # Run instead of run when the journal says the phase already finished
+    resume: Optional[Callable] = None
+
+
+async def run_walkthrough_steps(steps, journal):
+    """Runs every step as soon as its needs and after steps are done, returns their results"""
+    tasks = {}
+
+    async def run(step):
+        results = {name: await tasks[name] for name in step.needs}
+        for name in step.after:
+            await tasks[name]
+
+        if not step.phase:
+            # Background steps are optional, their dependants cope with None as when skipped
+            try:
+                return await step.run(results)
+            except Exception:
+                logger.exception(f"Background step {step.name} failed, carrying on without it")
+                return None
+
+        if journal.phase_done(step.name):
+            logger.info(f"Skipping {step.name}, already completed")
+            return await step.resume(results) if step.resume else None
+
+        with tracer.span("phase", step.name):
+            result = await step.run(results)
+        await journal.complete_phase(step.name)
+        return result
+
+    # Steps can only depend on steps declared before them, so the graph can't have a cycle
+    for step in steps:
+        for name in step.needs + step.after:
+            if name not in tasks:
+                raise ValueError(
+                    f"{step.name} depends on {name}, which isn't declared before it"
+                )
+        tasks[step.name] = asyncio.create_task(run(step))
+
+    await asyncio.gather(*tasks.values())
+
+    result = {name: task.result() for name, task in tasks.items()}
+    return result
 
 
 async def main():
     """Manage arguments and run workflow"""
-
-    # Ensure there aren't any old dialog log files lying around...
-    if os.path.exists(dialog_commandfile):
-        logger.info(f"Removing prior dialog_commandfile: {dialog_commandfile}")
-        result = os.remove(dialog_commandfile)
-        logger.info(f"Result: {result}")
-    if os.path.exists(dialog_custom_commandfile):
-        logger.info(f"Removing prior dialog_custom_commandfile: {dialog_commandfile}")
-        result = os.remove(dialog_custom_commandfile)
-        logger.info(f"Result: {result}")
+    global jamf_binary, dialog_binary
 
     args = parse_args()
     log_level = args.log
     demo_mode = args.demo
+    jamf_binary = args.jamf_binary
+    dialog_binary = args.dialog_binary
 
     if log_level:
         logger.setLevel(getattr(logging, log_level.upper()))
@@ -715,21 +3059,124 @@ async def main():
 
     logger.info(f"argparse: {args}")
 
-    loop = asyncio.get_running_loop()
+    if args.dialog_channel:
+        await run_dialog_channel(args.dialog_channel)
+        return
 
-    asyncio.create_task(walkthrough_welcome(demo_mode))
-    jamf_app_list = asyncio.create_task(walkthrough_role_app_selection())
-    asyncio.create_task(walkthrough_device_update(demo_mode))
-    asyncio.create_task(walkthrough_device_registration(demo_mode))
-
-    # https://docs.python.org/3/library/asyncio-eventloop.html#asyncio.loop.run_in_executor
-    with concurrent.futures.ProcessPoolExecutor() as pool:
-        await loop.run_in_executor(
-            pool,
-            process_jamf_app_list,
-            await jamf_app_list,
-            args.demo,
-        )
+    if args.wait_exit:
+        sys.exit(0 if await wait_for_process_exit(args.wait_exit, args.wait_timeout) else 1)
+
+    if args.wait_for:
+        pid = await wait_for_process_start(args.wait_for, args.wait_timeout)
+        sys.exit(0 if pid else 1)
+
+    if args.recon:
+        sys.exit(0 if await request_recon(args.recon, args.recon_window) else 1)
+
+    if args.catalog:
+        catalog_memo["catalog"] = AppCatalog.from_file(args.catalog)
+
+    if args.prefetch_icons:
+        icons = await prefetch_app_icons(cache_dir=args.prefetch_icons)
+        logger.info(f"{len(icons)} icons cached in {args.prefetch_icons}")
+        return
+
+    tracer.path = args.trace
+
+    if args.run_steps:
+        tracer.source = "enrolment"
+        await run_policy_array(args.run_steps, args.testing, args.steps_done)
+        return
+
+    # Ensure there aren't any old dialog log files lying around...
+    for commandfile in (dialog_commandfile, dialog_custom_commandfile):
+        logger.info(f"Rotating prior commandfile: {commandfile}")
+        dialog_channel(commandfile).reset(rotate=True)
+
+    # Demo runs never resume or leave a journal behind
+    journal = WalkthroughJournal(None if demo_mode else walkthrough_state)
+    if not args.reset_state and journal.load():
+        logger.info(f"Resuming walkthrough from {walkthrough_state}")
+
+    # Demo runs don't call jamf, so there's nothing to start early
+    speculative = None
+    if args.speculative and not demo_mode:
+        speculative = SpeculativeInstalls(InstallScheduler(args.concurrency), journal)
+
+    async def patch_feed(results):
+        # Demo runs use dummy update info
+        return None if demo_mode else await get_patch_feed_index()
+
+    # Background steps start straight away and run while the welcome dialog is on screen.
+    # Dialogs are ordered by after, so only one is ever waiting on the user.
+    steps = [
+        WalkthroughStep(
+            "branding_icon",
+            lambda results: get_self_service_branding_icon(),
+            phase=False,
+        ),
+        WalkthroughStep("patch_feed", patch_feed, phase=False),
+        WalkthroughStep(
+            "app_icons",
+            lambda results: prefetch_app_icons(),
+            phase=False,
+        ),
+        WalkthroughStep(
+            "installed_apps",
+            lambda results: detect_installed_apps(),
+            phase=False,
+        ),
+        WalkthroughStep(
+            "install_capacity",
+            lambda results: probe_install_capacity(demo_mode),
+            phase=False,
+        ),
+        WalkthroughStep("welcome", lambda results: walkthrough_welcome(demo_mode)),
+        WalkthroughStep(
+            "role_app_selection",
+            lambda results: walkthrough_role_app_selection(
+                results["installed_apps"], journal, speculative
+            ),
+            needs=["installed_apps"],
+            after=["welcome"],
+            resume=lambda results: walkthrough_resume_installs(
+                journal, results["installed_apps"]
+            ),
+        ),
+        WalkthroughStep(
+            "installs",
+            lambda results: process_jamf_app_list(
+                results["role_app_selection"],
+                demo_mode,
+                args.concurrency,
+                journal,
+                speculative,
+                results["install_capacity"],
+            ),
+            needs=["role_app_selection", "install_capacity"],
+            phase=False,
+        ),
+        WalkthroughStep(
+            "device_update",
+            lambda results: walkthrough_device_update(demo_mode),
+            needs=["patch_feed"],
+            after=["role_app_selection"],
+        ),
+        WalkthroughStep(
+            "device_registration",
+            lambda results: walkthrough_device_registration(demo_mode),
+            after=["device_update"],
+        ),
+    ]
+    await run_walkthrough_steps(steps, journal)
+    await wait_background_dialogs()
+    if speculative:
+        # Unticked apps that had already started
+        await speculative.wait()
+    await journal.finish()
+    if not demo_mode:
+        # One recon for every app installed, and any recon skipped earlier in enrolment
+        await flush_recon()
 
 
 if __name__ == "__main__":
@@ -738,3 +3185,6 @@ if __name__ == "__main__":
     end_time = time.time()
 
     print(f"Total time elapsed: {end_time - start_time} seconds")
+
+    if tracer.path:
+        print(tracer.summary())
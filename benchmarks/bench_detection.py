@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# Benchmarks pre-flight app detection over a synthetic tree of app bundles
+# Usage: python3 benchmarks/bench_detection.py -apps 500
+
+import argparse
+import asyncio
+import json
+import os
+import plistlib
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import _user_walkthrough as walkthrough  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-apps",
+        default=200,
+        type=int,
+        help="Number of catalog entries to generate, default=200",
+    )
+    parser.add_argument(
+        "-installed",
+        default=0.5,
+        type=float,
+        help="Fraction of catalog entries with a bundle on disk, default=0.5",
+    )
+    parser.add_argument(
+        "-rounds",
+        default=5,
+        type=int,
+        help="Timed rounds per approach, default=5",
+    )
+    return parser.parse_args()
+
+
+def build_tree(root, apps, installed):
+    """Creates app bundles for the first apps * installed entries, returns the catalog"""
+    catalog = []
+
+    for i in range(apps):
+        bundle = os.path.join(root, f"App {i}.app")
+        catalog.append(
+            {
+                "name": f"App {i}",
+                "trigger": f"install-App_{i}",
+                # Every other entry also checks the bundle version
+                "detect": {"path": bundle, "min_version": "2.0"}
+                if i % 2
+                else {"path": bundle},
+            }
+        )
+
+        if i < apps * installed:
+            os.makedirs(os.path.join(bundle, "Contents"))
+            with open(os.path.join(bundle, "Contents", "Info.plist"), "wb") as f:
+                plistlib.dump({"CFBundleShortVersionString": f"{i % 4}.{i}.0"}, f)
+
+    return catalog
+
+
+def time_rounds(rounds, func):
+    timings = []
+    for _ in range(rounds):
+        start_time = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings), result
+
+
+def main():
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        catalog = build_tree(root, args.apps, args.installed)
+
+        serial, serial_result = time_rounds(
+            args.rounds,
+            lambda: {
+                app["name"]
+                for app in catalog
+                if walkthrough.app_installed(app.get("detect", {}))
+            },
+        )
+        detect, detect_result = time_rounds(
+            args.rounds,
+            lambda: asyncio.run(walkthrough.detect_installed_apps(catalog)),
+        )
+
+    if serial_result != detect_result:
+        raise SystemExit("Serial detection and detect_installed_apps disagree")
+
+    print(
+        json.dumps(
+            {
+                "benchmark": "detection",
+                "apps": args.apps,
+                "installed": len(detect_result),
+                "serial_seconds": serial,
+                "detect_installed_apps_seconds": detect,
+            },
+            indent=4,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
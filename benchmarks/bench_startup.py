@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# Measures how long _user_walkthrough.py takes to import, using -X importtime, and checks
+# that the HTTP stack and pkg_resources are no longer imported at startup.
+# Usage: python3 benchmarks/bench_startup.py -max-ms 150
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+deferred_modules = ["requests", "urllib3", "pkg_resources", "http.client"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-rounds",
+        default=5,
+        type=int,
+        help="Number of fresh interpreters to time, default=5",
+    )
+    parser.add_argument(
+        "-max-ms",
+        default=None,
+        type=float,
+        help="Exit with an error if the import takes longer than this",
+    )
+    parser.add_argument(
+        "-top",
+        default=10,
+        type=int,
+        help="Number of slowest modules to report, default=10",
+    )
+    return parser.parse_args()
+
+
+def import_times():
+    """Returns {module: (self_us, cumulative_us)} for a fresh import of the walkthrough"""
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            "import sys; sys.path.insert(0, sys.argv[1]); import _user_walkthrough",
+            repo_dir,
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    times = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)", line)
+        if match:
+            times[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+
+    return times
+
+
+def main():
+    args = parse_args()
+
+    rounds = [import_times() for _ in range(args.rounds)]
+    totals = sorted(times["_user_walkthrough"][1] / 1000 for times in rounds)
+    fastest = min(rounds, key=lambda times: times["_user_walkthrough"][1])
+
+    result = {
+        "benchmark": "startup",
+        "import_ms_min": totals[0],
+        "import_ms_median": totals[len(totals) // 2],
+        "slowest_modules": [
+            {"module": module, "self_ms": self_us / 1000}
+            for module, (self_us, _) in sorted(
+                fastest.items(), key=lambda item: item[1][0], reverse=True
+            )[: args.top]
+        ],
+        "deferred_modules_imported": [m for m in deferred_modules if m in fastest],
+    }
+    print(json.dumps(result, indent=4))
+
+    if result["deferred_modules_imported"]:
+        sys.exit(f"Imported at startup: {', '.join(result['deferred_modules_imported'])}")
+    if args.max_ms is not None and result["import_ms_min"] > args.max_ms:
+        sys.exit(f"Import took {result['import_ms_min']:.1f}ms, over {args.max_ms}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# Compares setup time for 000_enrolment.sh's policy_array: one osascript launch per
+# field (get_json_value) against a single launch of the Python step engine.
+# Usage: python3 benchmarks/bench_step_engine.py
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.join(benchmarks_dir, "..")
+stub_osascript = os.path.join(benchmarks_dir, "stubs", "osascript")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-rounds",
+        default=3,
+        type=int,
+        help="Timed rounds per approach, default=3",
+    )
+    return parser.parse_args()
+
+
+def load_policy_array():
+    with open(os.path.join(repo_dir, "000_enrolment.sh")) as f:
+        script = f.read()
+    return re.search(r"policy_array=\('\n(.*?)\n'\)", script, re.S).group(1)
+
+
+def get_json_value(policy_json, path):
+    # Mirrors get_json_value in 000_enrolment.sh
+    result = subprocess.run(
+        [
+            stub_osascript,
+            "-l",
+            "JavaScript",
+            "-e",
+            'const env = $.NSProcessInfo.processInfo.environment.objectForKey("JSON").js',
+            "-e",
+            f"JSON.parse(env).{path}",
+        ],
+        env={**os.environ, "JSON": policy_json},
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout.strip()
+
+
+def osascript_setup(policy_json):
+    """Every lookup 000_enrolment.sh makes before and between its jamf triggers"""
+    calls = 1
+    steps = int(get_json_value(policy_json, "steps.length"))
+
+    for i in range(steps):
+        get_json_value(policy_json, f"steps[{i}].listitem")
+        calls += 1
+
+    for i in range(steps):
+        for field in ("listitem", "icon", "progresstext"):
+            get_json_value(policy_json, f"steps[{i}].{field}")
+        triggers = int(get_json_value(policy_json, f"steps[{i}].trigger_list.length"))
+        calls += 4
+
+        for j in range(triggers):
+            get_json_value(policy_json, f"steps[{i}].trigger_list[{j}].trigger")
+            get_json_value(policy_json, f"steps[{i}].trigger_list[{j}].path")
+            calls += 2
+
+    return calls
+
+
+def engine_setup(policy_json):
+    """One interpreter launch that imports the walkthrough and parses every step"""
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys; sys.path.insert(0, sys.argv[1]); import _user_walkthrough; "
+            "_user_walkthrough.parse_policy_array(sys.stdin.read())",
+            repo_dir,
+        ],
+        input=policy_json,
+        text=True,
+        check=True,
+    )
+    return 1
+
+
+def time_rounds(rounds, func, *args):
+    timings = []
+    for _ in range(rounds):
+        start_time = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - start_time)
+    return min(timings), result
+
+
+def main():
+    args = parse_args()
+    policy_json = load_policy_array()
+
+    osascript_seconds, osascript_calls = time_rounds(
+        args.rounds, osascript_setup, policy_json
+    )
+    engine_seconds, engine_calls = time_rounds(args.rounds, engine_setup, policy_json)
+
+    print(
+        json.dumps(
+            {
+                "benchmark": "step_engine_setup",
+                "osascript_launches": osascript_calls,
+                "osascript_seconds": osascript_seconds,
+                "engine_launches": engine_calls,
+                "engine_seconds": engine_seconds,
+            },
+            indent=4,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# Rehearses an onboarding day: hundreds of virtual Macs enrol at once against
+# mock_jamf_server.py. Each one is a forked process that fetches the branding icon and
+# runs 000_enrolment.sh's policy_array through the step engine, then runs the walkthrough
+# with the stub dialog answering every prompt. Server side request counts and latencies
+# are reported alongside each device's phase and trigger times, so mitigations such as
+# -jitter can be compared before a real onboarding day.
+# Usage: python3 benchmarks/fleet_sim.py -devices 300 -jitter 60 -output fleet.json
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.join(benchmarks_dir, "..")
+stubs_dir = os.path.join(benchmarks_dir, "stubs")
+
+sys.path.insert(0, repo_dir)
+
+import _user_walkthrough as walkthrough  # noqa: E402
+from bench_step_engine import load_policy_array  # noqa: E402
+from mock_jamf_server import MockJamfServer, summarise  # noqa: E402
+from run_benchmarks import walkthrough_version  # noqa: E402
+
+# Imported once here so forked devices share it rather than each importing their own
+import requests  # noqa: E402,F401
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-devices",
+        default=300,
+        type=int,
+        help="Number of Macs enrolling at once, default=300",
+    )
+    parser.add_argument(
+        "-jitter",
+        default=0.0,
+        type=float,
+        help="Each device starts after a random delay of up to this many seconds, default=0",
+    )
+    parser.add_argument(
+        "-capacity",
+        default=20,
+        type=int,
+        help="Policies the mock server runs at once, default=20",
+    )
+    parser.add_argument(
+        "-policy-seconds",
+        default=0.5,
+        type=float,
+        help="Seconds each policy holds a server slot, default=0.5",
+    )
+    parser.add_argument(
+        "-latency",
+        default=0.0,
+        type=float,
+        help="Extra seconds added to every request, default=0",
+    )
+    parser.add_argument(
+        "-think",
+        default=0.0,
+        type=float,
+        help="Seconds each scripted dialog waits before answering, default=0",
+    )
+    parser.add_argument(
+        "-concurrency",
+        default=walkthrough.install_concurrency,
+        type=int,
+        help=f"Walkthrough installs run at once per device, default={walkthrough.install_concurrency}",
+    )
+    parser.add_argument(
+        "-timeout",
+        default=1800,
+        type=float,
+        help="Seconds to wait for the whole fleet before stopping it, default=1800",
+    )
+    parser.add_argument(
+        "-output",
+        default=None,
+        help="File to write results to, default prints to stdout",
+    )
+    return parser.parse_args()
+
+
+def configure_device(device_dir, base_url):
+    """Points one forked copy of the walkthrough at its own files and the mock server"""
+    walkthrough.logger.setLevel(logging.ERROR)
+    walkthrough.jamf_binary = os.path.join(stubs_dir, "jamf")
+    walkthrough.dialog_binary = os.path.join(stubs_dir, "dialog")
+    walkthrough.dialog_commandfile = os.path.join(device_dir, "dialog.log")
+    walkthrough.dialog_custom_commandfile = os.path.join(device_dir, "dialog_user.log")
+    walkthrough.enrolment_log = os.path.join(device_dir, "management.log")
+    walkthrough.branding_icon = os.path.join(device_dir, "brandingimage.png")
+    walkthrough.branding_icon_url = f"{base_url}/api/v1/branding-images/download/9"
+    walkthrough.branding_icon_memo.update(icon=None, expires=0.0)
+    walkthrough.patch_feed_url = f"{base_url}/v1/software/"
+    walkthrough.bandwidth_probe_url = f"{base_url}/bandwidth_probe.bin"
+    walkthrough.patch_feed_cache = os.path.join(device_dir, "patch_feed.json")
+    walkthrough.patch_feed_memo["index"] = None
+    walkthrough.walkthrough_state = os.path.join(device_dir, "walkthrough_state.json")
+    walkthrough.inventory_state = os.path.join(device_dir, "inventory_state.json")
+    walkthrough.icon_cache = os.path.join(device_dir, "AppIcons")
+    walkthrough.icon_cache_memo["icons"] = None
+    walkthrough.app_list = [
+        {**app, "icon": f"{base_url}/icons/{i}.png"}
+        for i, app in enumerate(walkthrough.app_list)
+    ]
+    walkthrough.catalog_memo["catalog"] = None
+
+
+async def enrol(policy_json):
+    """What 000_enrolment.sh does over the network: the branding icon, then policy_array"""
+    walkthrough.tracer.source = "enrolment"
+    with walkthrough.tracer.span("phase", "branding_icon"):
+        await asyncio.to_thread(walkthrough.fetch_self_service_branding_icon)
+
+    steps = walkthrough.parse_policy_array(policy_json)
+    with walkthrough.tracer.span("phase", "policy_array"):
+        await walkthrough.run_enrolment_steps(
+            steps, False, commandfile=walkthrough.dialog_commandfile
+        )
+    walkthrough.tracer.source = "walkthrough"
+
+
+def run_device(device, args, base_url, policy_json, device_dir, listen_fd):
+    # The mock server's socket belongs to the parent
+    os.close(listen_fd)
+    # Keeps hundreds of devices' logging and echo_logger lines out of the results
+    with open(os.path.join(device_dir, "output.log"), "w") as f:
+        os.dup2(f.fileno(), sys.stdout.fileno())
+        os.dup2(f.fileno(), sys.stderr.fileno())
+    random.seed(device)
+    result = {"device": device, "start_delay": random.uniform(0, args.jitter)}
+    time.sleep(result["start_delay"])
+
+    trace = os.path.join(device_dir, "trace.jsonl")
+    configure_device(device_dir, base_url)
+    walkthrough.tracer.path = trace
+
+    try:
+        start_time = time.perf_counter()
+        asyncio.run(enrol(policy_json))
+        result["enrolment_seconds"] = time.perf_counter() - start_time
+
+        sys.argv = [
+            "_user_walkthrough.py",
+            "-log",
+            "error",
+            "-jamf-binary",
+            walkthrough.jamf_binary,
+            "-dialog-binary",
+            walkthrough.dialog_binary,
+            "-concurrency",
+            str(args.concurrency),
+            "-trace",
+            trace,
+        ]
+        start_time = time.perf_counter()
+        asyncio.run(walkthrough.main())
+        result["walkthrough_seconds"] = time.perf_counter() - start_time
+    except Exception as e:
+        result["error"] = repr(e)
+
+    with open(os.path.join(device_dir, "result.json"), "w") as f:
+        json.dump(result, f)
+
+
+def device_results(device_dir):
+    """Returns (result, spans) written by one device, spans are empty if it never got going"""
+    result = {"error": "No result, the device was stopped or crashed"}
+    spans = []
+
+    try:
+        with open(os.path.join(device_dir, "result.json")) as f:
+            result = json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    try:
+        with open(os.path.join(device_dir, "trace.jsonl")) as f:
+            spans = [json.loads(line) for line in f if line.strip()]
+    except (OSError, ValueError):
+        pass
+
+    return result, spans
+
+
+def summarise_fleet(devices, spans):
+    finished = [device for device in devices if "error" not in device]
+    result = {
+        "devices": len(devices),
+        "finished": len(finished),
+        "errors": sorted({device["error"] for device in devices if "error" in device}),
+    }
+
+    for key in ("enrolment_seconds", "walkthrough_seconds"):
+        values = [device[key] for device in finished]
+        if values:
+            result[key] = summarise(values)
+
+    durations = {}
+    failed = {}
+    for span in spans:
+        if span.get("kind") in ("phase", "trigger"):
+            name = f"{span['kind']}/{span['source']}/{span['name']}"
+            durations.setdefault(name, []).append(span["duration"])
+            if span.get("exit_code") not in (None, 0):
+                failed[name] = failed.get(name, 0) + 1
+    result["client_spans"] = {
+        name: {**summarise(values), "failed": failed.get(name, 0)}
+        for name, values in sorted(durations.items())
+    }
+
+    return result
+
+
+def main():
+    args = parse_args()
+    policy_json = load_policy_array()
+
+    server = MockJamfServer(
+        ("127.0.0.1", 0), args.capacity, args.policy_seconds, args.latency
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    os.environ["PATH"] = f"{stubs_dir}:{os.environ['PATH']}"
+    os.environ["STUB_JAMF_SERVER"] = base_url
+    os.environ["STUB_DIALOG_DELAY"] = str(args.think)
+
+    context = multiprocessing.get_context("fork")
+    processes = []
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        start_time = time.perf_counter()
+        for device in range(args.devices):
+            device_dir = os.path.join(work_dir, f"device_{device:04}")
+            os.makedirs(device_dir)
+            process = context.Process(
+                target=run_device,
+                args=(device, args, base_url, policy_json, device_dir, server.fileno()),
+            )
+            process.start()
+            processes.append((process, device_dir))
+        print(f"Started {args.devices} devices against {base_url}", file=sys.stderr)
+
+        deadline = time.monotonic() + args.timeout
+        for process, _ in processes:
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        wall_seconds = time.perf_counter() - start_time
+
+        devices = []
+        spans = []
+        for _, device_dir in processes:
+            device, device_spans = device_results(device_dir)
+            devices.append(device)
+            spans += device_spans
+
+    server.shutdown()
+
+    results = {
+        "version": walkthrough_version(),
+        "parameters": {
+            key: getattr(args, key)
+            for key in (
+                "devices",
+                "jitter",
+                "capacity",
+                "policy_seconds",
+                "latency",
+                "think",
+                "concurrency",
+            )
+        },
+        "wall_seconds": wall_seconds,
+        "fleet": summarise_fleet(devices, spans),
+        "server": server.stats(),
+    }
+
+    output = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(f"{output}\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
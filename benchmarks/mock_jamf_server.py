@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# Local stand-in for Jamf Pro, the Jamf patch feed and the app icon host, for rehearsing
+# enrolment load. Policies hold one of -capacity slots for -policy-seconds, like a busy
+# Jamf Pro, and every request is counted and timed from arrival to its last byte.
+# GET /_stats returns the counts and latency percentiles as JSON.
+# Usage: python3 benchmarks/mock_jamf_server.py -port 8080 -capacity 20
+#        STUB_JAMF_SERVER=http://127.0.0.1:8080 benchmarks/stubs/jamf policy -event install-Docker
+
+import argparse
+import hashlib
+import http.server
+import json
+import os
+import threading
+import time
+from email.utils import formatdate
+
+# Path prefix and the name requests to it are counted under
+routes = [
+    ("/api/v1/branding-images/download/", "branding_image"),
+    ("/v1/software/", "patch_feed"),
+    ("/icons/", "app_icon"),
+    ("/bandwidth_probe.bin", "bandwidth_probe"),
+    ("/policy/recon", "recon"),
+    ("/policy/", "policy"),
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-port",
+        default=8080,
+        type=int,
+        help="Port to listen on, default=8080",
+    )
+    parser.add_argument(
+        "-capacity",
+        default=20,
+        type=int,
+        help="Policies the server runs at once, the rest queue, default=20",
+    )
+    parser.add_argument(
+        "-policy-seconds",
+        default=0.5,
+        type=float,
+        help="Seconds each policy or recon holds a slot, default=0.5",
+    )
+    parser.add_argument(
+        "-latency",
+        default=0.0,
+        type=float,
+        help="Extra seconds added to every request, e.g. for a WAN link, default=0",
+    )
+    return parser.parse_args()
+
+
+def percentile(values, pct):
+    """Linear interpolation between closest ranks, values must be sorted"""
+    position = (len(values) - 1) * pct / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarise(values):
+    values = sorted(values)
+    result = {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": values[-1],
+    }
+    return result
+
+
+class MockJamfHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def route(self):
+        path = self.path.split("?", 1)[0]
+        for prefix, name in routes:
+            if path.startswith(prefix):
+                return name
+        return "stats" if path == "/_stats" else None
+
+    def do_GET(self):
+        route = self.route()
+        if route == "stats":
+            self.send_body(200, json.dumps(self.server.stats()).encode(), "application/json")
+            return
+
+        start_time = time.monotonic()
+        status = 500
+        self.server.begin()
+        try:
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            if route in ("policy", "recon"):
+                status = self.send_policy(route)
+            elif route in self.server.assets:
+                status = self.send_asset(route)
+            else:
+                status = self.send_body(404, b"", "text/plain")
+        finally:
+            self.server.end(route or "unknown", status, time.monotonic() - start_time)
+
+    def send_body(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        return status
+
+    def send_asset(self, route):
+        body, content_type, etag = self.server.assets[route]
+        headers = {
+            "ETag": etag,
+            "Last-Modified": self.server.last_modified,
+            "Cache-Control": "max-age=0, must-revalidate",
+        }
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            return 304
+
+        return self.send_body(200, body, content_type, headers)
+
+    def send_policy(self, route):
+        trigger = self.path.split("?", 1)[0].rsplit("/", 1)[-1]
+
+        # Queueing for a slot is part of the latency, as it would be against a busy server
+        with self.server.capacity:
+            self.server.begin_policy()
+            try:
+                time.sleep(self.server.policy_seconds)
+            finally:
+                self.server.end_policy()
+
+        if route == "recon":
+            output = "Retrieving inventory preferences from https://mock.jamfcloud.com/...\n"
+            output += "Submitting data to https://mock.jamfcloud.com/...\n"
+        else:
+            output = (
+                f"Downloading {trigger}.pkg...\n"
+                "Downloading... 100%\n"
+                "Verifying package integrity...\n"
+                f"Installing {trigger}.pkg...\n"
+            )
+        return self.send_body(200, output.encode(), "text/plain")
+
+
+class MockJamfServer(http.server.ThreadingHTTPServer):
+    """Serves the enrolment endpoints and keeps per-route request counts and latencies"""
+
+    daemon_threads = True
+    # A herd of Macs connecting at once shouldn't be refused by a short listen backlog
+    request_queue_size = 1024
+
+    def __init__(self, address, capacity=20, policy_seconds=0.5, latency=0.0):
+        super().__init__(address, MockJamfHandler)
+        self.capacity = threading.BoundedSemaphore(max(1, capacity))
+        self.policy_seconds = policy_seconds
+        self.latency = latency
+        self.last_modified = formatdate(time.time(), usegmt=True)
+
+        patch_feed = json.dumps(
+            [{"name": "Apple macOS Sonoma", "currentVersion": "14.1.1 (23B81)"}]
+        ).encode()
+        self.assets = {}
+        for route, body, content_type in (
+            ("branding_image", os.urandom(32 * 1024), "image/png"),
+            ("app_icon", os.urandom(16 * 1024), "image/png"),
+            ("bandwidth_probe", os.urandom(1024 * 1024), "application/octet-stream"),
+            ("patch_feed", patch_feed, "application/json"),
+        ):
+            etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+            self.assets[route] = (body, content_type, etag)
+
+        self.stats_lock = threading.Lock()
+        self.started = time.monotonic()
+        self.requests = {}
+        self.active = 0
+        self.peak_active = 0
+        self.policies_active = 0
+        self.peak_policies_active = 0
+
+    def begin(self):
+        with self.stats_lock:
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+
+    def end(self, route, status, latency):
+        with self.stats_lock:
+            self.active -= 1
+            entry = self.requests.setdefault(route, {"statuses": {}, "latencies": []})
+            entry["statuses"][status] = entry["statuses"].get(status, 0) + 1
+            entry["latencies"].append(latency)
+
+    def begin_policy(self):
+        with self.stats_lock:
+            self.policies_active += 1
+            self.peak_policies_active = max(self.peak_policies_active, self.policies_active)
+
+    def end_policy(self):
+        with self.stats_lock:
+            self.policies_active -= 1
+
+    def stats(self):
+        with self.stats_lock:
+            result = {
+                "uptime_seconds": time.monotonic() - self.started,
+                "peak_concurrent_requests": self.peak_active,
+                "peak_concurrent_policies": self.peak_policies_active,
+                "routes": {
+                    route: {
+                        "statuses": {str(k): v for k, v in entry["statuses"].items()},
+                        "latency_seconds": summarise(entry["latencies"]),
+                    }
+                    for route, entry in sorted(self.requests.items())
+                },
+            }
+        return result
+
+
+def main():
+    args = parse_args()
+    server = MockJamfServer(
+        ("127.0.0.1", args.port), args.capacity, args.policy_seconds, args.latency
+    )
+    print(f"Serving on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(server.stats(), indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# Component benchmarks for _user_walkthrough.py, run against the stub jamf and dialog
+# binaries in benchmarks/stubs so they work on plain Linux. Results are written as JSON
+# so they can be compared between releases.
+# Usage: python3 benchmarks/run_benchmarks.py -output results.json
+
+import argparse
+import asyncio
+import functools
+import http.server
+import json
+import os
+import platform
+import re
+import sys
+import tempfile
+import threading
+import time
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.join(benchmarks_dir, "..")
+stubs_dir = os.path.join(benchmarks_dir, "stubs")
+
+sys.path.insert(0, repo_dir)
+
+import _user_walkthrough as walkthrough  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-output",
+        default=None,
+        help="File to write results to, default prints to stdout",
+    )
+    parser.add_argument(
+        "-catalog-sizes",
+        default="10,100,1000,10000",
+        help="Comma separated catalog sizes, default=10,100,1000,10000",
+    )
+    parser.add_argument(
+        "-selected",
+        default=0.1,
+        type=float,
+        help="Fraction of each catalog that is selected, default=0.1",
+    )
+    parser.add_argument(
+        "-updates",
+        default=1000,
+        type=int,
+        help="Command file updates to send for the throughput test, default=1000",
+    )
+    parser.add_argument(
+        "-only",
+        default=None,
+        help="Comma separated benchmarks to run, default runs them all",
+    )
+    return parser.parse_args()
+
+
+def walkthrough_version():
+    with open(os.path.join(repo_dir, "_user_walkthrough.py")) as f:
+        match = re.search(r"^# Version: (\S+)", f.read(), re.M)
+    return match.group(1) if match else None
+
+
+def synthetic_catalog(size):
+    return [
+        {
+            "name": f"App {i:05}",
+            "icon": f"https://PATH.TO.ICON.com/{i}.png",
+            "checked": ["Engineering"] if i % 3 == 0 else [],
+            "trigger": f"install-App_{i}",
+        }
+        for i in range(size)
+    ]
+
+
+def bench_dialog_log(work_dir, updates):
+    """Latency of a single update and throughput of a burst, through dialog_log"""
+    commandfile = os.path.join(work_dir, "dialog_bench.log")
+
+    async def run():
+        channel = walkthrough.dialog_channel(commandfile)
+
+        latencies = []
+        for i in range(5):
+            # Let the write interval lapse, as it would between real status changes
+            await asyncio.sleep(walkthrough.dialog_write_interval)
+            start_time = time.perf_counter()
+            walkthrough.dialog_log(f"progresstext: {i}", commandfile=commandfile)
+            await channel.flush()
+            latencies.append(time.perf_counter() - start_time)
+
+        channel.reset()
+        start_time = time.perf_counter()
+        for i in range(updates):
+            walkthrough.dialog_log(
+                f"listitem: index: {i % 10}, status: wait, statustext: {i}",
+                commandfile=commandfile,
+            )
+        await channel.flush()
+        burst = time.perf_counter() - start_time
+
+        return latencies, burst
+
+    latencies, burst = asyncio.run(run())
+    with open(commandfile) as f:
+        lines_written = len([line for line in f if line.strip()])
+
+    return {
+        "idle_latency_seconds_max": max(latencies),
+        "burst_updates": updates,
+        "burst_seconds": burst,
+        "burst_updates_per_second": updates / burst,
+        "burst_lines_written": lines_written,
+    }
+
+
+def bench_app_lists(sizes, selected_fraction):
+    """create_selected_app_lists and return_selected_apps over growing catalogs"""
+    results = []
+
+    try:
+        for size in sizes:
+            catalog = synthetic_catalog(size)
+            start_time = time.perf_counter()
+            walkthrough.catalog_memo["catalog"] = walkthrough.AppCatalog(
+                catalog, walkthrough.role_dict
+            )
+            index_seconds = time.perf_counter() - start_time
+            selected = [app["name"] for app in catalog[:: max(1, int(1 / selected_fraction))]]
+            result = {
+                "catalog_size": size,
+                "selected": len(selected),
+                "catalog_index_seconds": index_seconds,
+            }
+
+            start_time = time.perf_counter()
+            asyncio.run(walkthrough.create_selected_app_lists(apps=selected))
+            result["create_selected_app_lists_seconds"] = time.perf_counter() - start_time
+
+            # Includes launching the stub dialog, as the real one would be
+            start_time = time.perf_counter()
+            try:
+                apps = asyncio.run(
+                    walkthrough.return_selected_apps(
+                        title="Benchmark", message="Benchmark", role="Engineering"
+                    )
+                )
+                result["return_selected_apps_seconds"] = time.perf_counter() - start_time
+                result["return_selected_apps_count"] = len(apps or [])
+            except OSError as e:
+                result["return_selected_apps_error"] = str(e)
+
+            results.append(result)
+    finally:
+        walkthrough.catalog_memo["catalog"] = None
+
+    return results
+
+
+def bench_policy_cpu(seconds=2.0):
+    """CPU used by this process while run_jamf_policy waits on a quiet policy"""
+    os.environ["STUB_JAMF_SLEEP"] = str(seconds)
+    try:
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        result = asyncio.run(walkthrough.run_jamf_policy("install-Benchmark"))
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+    finally:
+        del os.environ["STUB_JAMF_SLEEP"]
+
+    return {
+        "wall_seconds": wall,
+        "cpu_seconds": cpu,
+        "cpu_fraction": cpu / wall,
+        "returncode": result.returncode,
+    }
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve_fixtures(fixture_dir):
+    """Serves the branding icon, patch feed and bandwidth probe from fixture_dir on a free port"""
+    with open(os.path.join(fixture_dir, "brandingimage.png"), "wb") as f:
+        f.write(os.urandom(32 * 1024))
+    with open(os.path.join(fixture_dir, "app_icon.png"), "wb") as f:
+        f.write(os.urandom(16 * 1024))
+    with open(os.path.join(fixture_dir, "bandwidth_probe.bin"), "wb") as f:
+        f.write(os.urandom(1024 * 1024))
+    with open(os.path.join(fixture_dir, "patch_feed.json"), "w") as f:
+        json.dump(
+            [{"name": "Apple macOS Sonoma", "currentVersion": "14.1.1 (23B81)"}], f
+        )
+
+    server = http.server.ThreadingHTTPServer(
+        ("127.0.0.1", 0), functools.partial(QuietHandler, directory=fixture_dir)
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench_end_to_end(work_dir, concurrency_levels=(1, 3)):
+    """Whole walkthrough wall time with auto-answering dialogs and the stub jamf"""
+    results = []
+    fixture_dir = os.path.join(work_dir, "fixtures")
+    os.makedirs(fixture_dir)
+    server = serve_fixtures(fixture_dir)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    original_argv = sys.argv
+    original_path = os.environ["PATH"]
+    original_app_list = walkthrough.app_list
+    os.environ["PATH"] = f"{stubs_dir}:{original_path}"
+    walkthrough.app_list = [
+        {**app, "icon": f"{base_url}/app_icon.png?name={i}"}
+        for i, app in enumerate(original_app_list)
+    ]
+    walkthrough.catalog_memo["catalog"] = None
+
+    try:
+        for concurrency in concurrency_levels:
+            run_dir = os.path.join(work_dir, f"e2e_{concurrency}")
+            os.makedirs(run_dir)
+
+            walkthrough.dialog_commandfile = os.path.join(run_dir, "dialog.log")
+            walkthrough.dialog_custom_commandfile = os.path.join(run_dir, "dialog_user.log")
+            walkthrough.branding_icon = os.path.join(run_dir, "brandingimage.png")
+            walkthrough.branding_icon_url = f"{base_url}/brandingimage.png"
+            walkthrough.branding_icon_memo.update(icon=None, expires=0.0)
+            walkthrough.patch_feed_url = f"{base_url}/patch_feed.json"
+            walkthrough.bandwidth_probe_url = f"{base_url}/bandwidth_probe.bin"
+            walkthrough.patch_feed_cache = os.path.join(run_dir, "patch_feed.json")
+            walkthrough.patch_feed_memo["index"] = None
+            walkthrough.walkthrough_state = os.path.join(run_dir, "walkthrough_state.json")
+            walkthrough.inventory_state = os.path.join(run_dir, "inventory_state.json")
+            walkthrough.icon_cache = os.path.join(run_dir, "AppIcons")
+            walkthrough.icon_cache_memo["icons"] = None
+
+            sys.argv = [
+                "_user_walkthrough.py",
+                "-log",
+                "warning",
+                "-jamf-binary",
+                os.path.join(stubs_dir, "jamf"),
+                "-dialog-binary",
+                os.path.join(stubs_dir, "dialog"),
+                "-concurrency",
+                str(concurrency),
+            ]
+
+            start_time = time.perf_counter()
+            asyncio.run(walkthrough.main())
+            results.append(
+                {
+                    "concurrency": concurrency,
+                    "wall_seconds": time.perf_counter() - start_time,
+                }
+            )
+    finally:
+        sys.argv = original_argv
+        os.environ["PATH"] = original_path
+        walkthrough.app_list = original_app_list
+        walkthrough.catalog_memo["catalog"] = None
+        server.shutdown()
+
+    return results
+
+
+def main():
+    args = parse_args()
+    only = set(args.only.split(",")) if args.only else None
+    sizes = [int(size) for size in args.catalog_sizes.split(",")]
+
+    os.environ.setdefault("SWIFTENROLMENT_JAMF_BINARY", os.path.join(stubs_dir, "jamf"))
+    os.environ.setdefault(
+        "SWIFTENROLMENT_DIALOG_BINARY", os.path.join(stubs_dir, "dialog")
+    )
+    walkthrough.jamf_binary = os.environ["SWIFTENROLMENT_JAMF_BINARY"]
+    walkthrough.dialog_binary = os.environ["SWIFTENROLMENT_DIALOG_BINARY"]
+    # Keep dialog_prompt from reaching out for the branding icon
+    walkthrough.branding_icon_memo.update(
+        icon=walkthrough.dialog_icon, expires=float("inf")
+    )
+
+    results = {
+        "version": walkthrough_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "benchmarks": {},
+    }
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        benchmarks = {
+            "dialog_log": lambda: bench_dialog_log(work_dir, args.updates),
+            "app_lists": lambda: bench_app_lists(sizes, args.selected),
+            "policy_cpu": bench_policy_cpu,
+            "end_to_end": lambda: bench_end_to_end(work_dir),
+        }
+
+        for name, benchmark in benchmarks.items():
+            if only and name not in only:
+                continue
+            print(f"Running {name}...", file=sys.stderr)
+            results["benchmarks"][name] = benchmark()
+
+    output = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(f"{output}\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# _user_walkthrough.py isn't a package, import it from the repo root as the benchmarks do
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+import _user_walkthrough as walkthrough
+
+roles = {"title": "Select Role", "default": "Engineering", "values": ["Design", "Engineering"]}
+
+
+def app(name, **keys):
+    return {"name": name, "trigger": f"install-{name}", **keys}
+
+
+def test_builtin_catalog_is_valid():
+    catalog = walkthrough.AppCatalog(walkthrough.app_list, walkthrough.role_dict)
+
+    assert set(catalog.by_name) == {app["name"] for app in walkthrough.app_list}
+
+
+def test_role_defaults_and_checkboxes():
+    catalog = walkthrough.AppCatalog(
+        [app("Figma", checked=["Design"]), app("Docker", checked=["Engineering"], disabled=True)],
+        roles,
+    )
+
+    assert catalog.role_defaults["Design"] == {"Figma"}
+    assert catalog.checkboxes("Engineering") == [
+        {"label": "Figma", "checked": False, "disabled": False},
+        {"label": "Docker", "checked": True, "disabled": True},
+    ]
+
+
+@pytest.mark.parametrize(
+    "apps, catalog_roles, message",
+    [
+        ([app("Figma")], {**roles, "default": "Sales"}, "Default role"),
+        ([{"name": "Figma"}], roles, "missing a trigger"),
+        ([app("Figma"), app("Figma")], roles, "Duplicate app name"),
+        ([app("Figma"), {"name": "Sketch", "trigger": "install-Figma"}], roles, "Duplicate trigger"),
+        ([app("Figma", checked=["Sales"])], roles, "unknown roles"),
+        ([app("Figma", expected_duration=0)], roles, "invalid expected_duration"),
+        ([app("Figma", size="2GB")], roles, "invalid size"),
+        ([app("Figma", depends_on=["Sketch"])], roles, "depends on unknown apps"),
+        (
+            [app("Figma", depends_on=["Sketch"]), app("Sketch", depends_on=["Figma"])],
+            roles,
+            "Dependency cycle",
+        ),
+    ],
+)
+def test_invalid_catalogs_are_rejected(apps, catalog_roles, message):
+    with pytest.raises(ValueError, match=message):
+        walkthrough.AppCatalog(apps, catalog_roles)
+
+
+def test_from_file(tmp_path):
+    path = tmp_path / "catalog.json"
+    path.write_text(json.dumps({"apps": [app("Figma", checked=["Design"])]}))
+
+    catalog = walkthrough.AppCatalog.from_file(path)
+
+    # Roles fall back to role_dict when the file doesn't have any
+    assert catalog.roles == walkthrough.role_dict
+    assert catalog.role_defaults["Design"] == {"Figma"}
+
+
+def test_check_app_dependencies_drops_unselected_apps():
+    depends_on = walkthrough.check_app_dependencies(
+        [app("Figma", depends_on=["Sketch", "Docker"]), app("Docker")]
+    )
+
+    assert depends_on == {"Figma": ["Docker"], "Docker": []}
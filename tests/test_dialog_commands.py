@@ -0,0 +1,60 @@
+import _user_walkthrough as walkthrough
+
+
+def test_parse_listitem_command_keeps_commas_in_values():
+    fields = walkthrough.parse_listitem_command(
+        "listitem: index: 2, status: fail, statustext: Failed, retrying"
+    )
+
+    assert fields == {"index": "2", "status": "fail", "statustext": "Failed, retrying"}
+
+
+def test_parse_listitem_command_ignores_other_commands():
+    assert walkthrough.parse_listitem_command("progresstext: 1 of 3 apps finished") is None
+
+
+def test_coalesce_merges_updates_for_the_same_index():
+    result = walkthrough.coalesce_dialog_commands(
+        [
+            "listitem: index: 0, status: wait, statustext: Installing",
+            "listitem: index: 1, status: wait, statustext: Installing",
+            "listitem: index: 0, statustext: Downloading",
+        ]
+    )
+
+    assert result == [
+        "listitem: index: 1, status: wait, statustext: Installing",
+        "listitem: index: 0, status: wait, statustext: Downloading",
+    ]
+
+
+def test_coalesce_drops_progress_when_a_status_follows():
+    result = walkthrough.coalesce_dialog_commands(
+        [
+            "listitem: index: 0, statustext: Installing, progress: 70",
+            "listitem: index: 0, status: success, statustext: Installed",
+        ]
+    )
+
+    assert result == ["listitem: index: 0, statustext: Installed, status: success"]
+
+
+def test_coalesce_keeps_progress_sent_with_a_status():
+    result = walkthrough.coalesce_dialog_commands(
+        [
+            "listitem: index: 0, statustext: Downloading, progress: 30",
+            "listitem: index: 0, status: wait, statustext: Installing, progress: 70",
+        ]
+    )
+
+    assert result == ["listitem: index: 0, statustext: Installing, progress: 70, status: wait"]
+
+
+def test_coalesce_doesnt_merge_across_other_commands():
+    commands = [
+        "listitem: index: 0, statustext: Downloading",
+        "progress: 50",
+        "listitem: index: 0, statustext: Installing",
+    ]
+
+    assert walkthrough.coalesce_dialog_commands(commands) == commands
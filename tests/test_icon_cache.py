@@ -0,0 +1,69 @@
+import asyncio
+import functools
+import http.server
+import threading
+
+import pytest
+
+import _user_walkthrough as walkthrough
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def icon_url(tmp_path):
+    served = tmp_path / "served"
+    served.mkdir()
+    (served / "figma.png").write_bytes(b"\x89PNG figma")
+    server = http.server.ThreadingHTTPServer(
+        ("127.0.0.1", 0), functools.partial(QuietHandler, directory=str(served))
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/figma.png"
+    server.shutdown()
+
+
+@pytest.fixture
+def unwritable_cache(tmp_path):
+    # Can't be created even as root, unlike a directory without write permission
+    blocker = tmp_path / "Images"
+    blocker.write_text("")
+    return str(blocker / "AppIcons")
+
+
+def test_icons_are_cached_by_content(tmp_path, icon_url):
+    cache_dir = tmp_path / "AppIcons"
+
+    icons = asyncio.run(
+        walkthrough.prefetch_app_icons([{"icon": icon_url}], cache_dir=str(cache_dir))
+    )
+
+    assert list(icons) == [icon_url]
+    assert (cache_dir / icons[icon_url]).read_bytes() == b"\x89PNG figma"
+    assert walkthrough.load_icon_cache(str(cache_dir)) == icons
+
+
+def test_an_unwritable_cache_falls_back_to_remote_icons(unwritable_cache, icon_url):
+    assert walkthrough.fetch_app_icon(icon_url, unwritable_cache) is None
+
+    icons = asyncio.run(
+        walkthrough.prefetch_app_icons([{"icon": icon_url}], cache_dir=unwritable_cache)
+    )
+
+    assert icons == {}
+
+
+def test_an_unwritable_index_keeps_this_runs_icons(tmp_path, icon_url, monkeypatch):
+    def full_disk(path, data):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(walkthrough, "write_json_atomic", full_disk)
+
+    icons = asyncio.run(
+        walkthrough.prefetch_app_icons([{"icon": icon_url}], cache_dir=str(tmp_path / "AppIcons"))
+    )
+
+    assert list(icons) == [icon_url]
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+import _user_walkthrough as walkthrough
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+stub_jamf = os.path.join(tests_dir, "..", "benchmarks", "stubs", "jamf")
+
+
+@pytest.fixture(autouse=True)
+def inventory(tmp_path, monkeypatch):
+    monkeypatch.setattr(walkthrough, "inventory_state", str(tmp_path / "inventory.json"))
+    monkeypatch.setattr(walkthrough, "jamf_binary", stub_jamf)
+    monkeypatch.setenv("STUB_JAMF_SLEEP", "0")
+
+
+def recons(monkeypatch):
+    """Records each recon's reasons instead of only running the stub"""
+    submitted = []
+    submit_recon = walkthrough.submit_recon
+
+    async def record(reasons):
+        submitted.append(reasons)
+        return await submit_recon(reasons)
+
+    monkeypatch.setattr(walkthrough, "submit_recon", record)
+    return submitted
+
+
+def test_recons_within_the_window_are_coalesced(monkeypatch):
+    submitted = recons(monkeypatch)
+
+    assert asyncio.run(walkthrough.request_recon("enrolment", window=900))
+    assert asyncio.run(walkthrough.request_recon("post_enrolment", window=900))
+    walkthrough.note_inventory_change("installed Figma")
+    assert asyncio.run(walkthrough.flush_recon())
+    # Nothing left for a second flush
+    assert asyncio.run(walkthrough.flush_recon())
+
+    assert submitted == [["enrolment"], ["installed Figma", "post_enrolment"]]
+    assert walkthrough.load_inventory_state()["pending"] == []
+
+
+def test_recons_outside_the_window_run(monkeypatch):
+    submitted = recons(monkeypatch)
+
+    asyncio.run(walkthrough.request_recon("enrolment", window=0))
+    asyncio.run(walkthrough.request_recon("post_enrolment", window=0))
+
+    assert submitted == [["enrolment"], ["post_enrolment"]]
+
+
+def test_a_policys_own_recon_clears_earlier_changes():
+    walkthrough.note_inventory_change("installed Figma")
+    started = walkthrough.load_inventory_state()["pending"][0]["time"] + 1
+    walkthrough.note_inventory_change("installed Xcode", recon_started=started)
+
+    state = walkthrough.load_inventory_state()
+    assert state["pending"] == []
+    assert state["last_recon"] == started
+
+
+def test_policy_recon_started():
+    policy = walkthrough.PolicyResult("install-Figma", 0, 30.0, ["Running Recon..."])
+    assert walkthrough.policy_recon_started(policy) == pytest.approx(
+        time.time() - 30.0, abs=5
+    )
+
+    policy.output = ["Successfully installed Figma.pkg."]
+    assert walkthrough.policy_recon_started(policy) is None
+
+
+def test_flush_waits_for_a_running_recon(monkeypatch):
+    submitted = recons(monkeypatch)
+    monkeypatch.setattr(walkthrough, "recon_poll_interval", 0.05)
+
+    def other_recon_started(state):
+        state["running_since"] = time.time()
+        state["pending"].append({"reason": "installed Figma", "time": time.time() + 1})
+
+    def other_recon_finished(state):
+        state["running_since"] = None
+
+    walkthrough.update_inventory_state(other_recon_started)
+
+    async def run():
+        flush = asyncio.create_task(walkthrough.flush_recon())
+        await asyncio.sleep(0.2)
+        assert not flush.done()
+        walkthrough.update_inventory_state(other_recon_finished)
+        return await flush
+
+    assert asyncio.run(run())
+    assert submitted == [["installed Figma"]]
+
+
+def test_flush_ignores_a_recon_that_never_finished(monkeypatch):
+    submitted = recons(monkeypatch)
+
+    def stale_recon(state):
+        state["running_since"] = time.time() - walkthrough.jamf_policy_timeout - 1
+        state["pending"].append({"reason": "installed Figma", "time": time.time()})
+
+    walkthrough.update_inventory_state(stale_recon)
+
+    assert asyncio.run(walkthrough.flush_recon())
+    assert submitted == [["installed Figma"]]
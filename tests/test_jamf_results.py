@@ -0,0 +1,45 @@
+import pytest
+
+import _user_walkthrough as walkthrough
+
+
+def result(returncode, *output, timed_out=False):
+    return walkthrough.PolicyResult(
+        "install-Figma", returncode, 1.0, list(output), timed_out=timed_out
+    )
+
+
+@pytest.mark.parametrize(
+    "policy, expected",
+    [
+        (result(0, "Successfully installed Figma.pkg."), (None, None)),
+        # A successful run can mention checksums without anything having gone wrong
+        (result(0, "Verifying package checksum..."), (None, None)),
+        (result(0, "No policies were found for the trigger."), ("permanent", "No policy found")),
+        (result(1, "Device Signature Error"), ("permanent", "Not enrolled")),
+        (result(1, "This computer is not enrolled."), ("permanent", "Not enrolled")),
+        (result(1, "Error: Download failed."), ("transient", "Download failed")),
+        (result(1, "Could not connect to the JSS."), ("transient", "Network error")),
+        (result(1, "HTTP error 503"), ("transient", "Network error")),
+        (result(1, "There is already another jamf process running"), ("locked", "Waiting for jamf")),
+        (result(1, "Another jamf process is already running."), ("locked", "Waiting for jamf")),
+        (result(1, "Something unexpected"), ("transient", "Failed")),
+        (result(None, "Downloading Figma.pkg...", timed_out=True), ("permanent", "Timed out")),
+    ],
+)
+def test_classify_jamf_result(policy, expected):
+    assert walkthrough.classify_jamf_result(policy) == expected
+
+
+def test_the_last_matching_line_decides():
+    policy = result(1, "Could not connect to the JSS.", "This computer is not enrolled.")
+
+    assert walkthrough.classify_jamf_result(policy) == ("permanent", "Not enrolled")
+
+
+def test_success_needs_no_failure():
+    policy = result(0)
+    assert policy.success
+
+    policy.failure, policy.reason = "permanent", "No policy found"
+    assert not policy.success
@@ -0,0 +1,67 @@
+import asyncio
+import json
+
+import _user_walkthrough as walkthrough
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_a_finished_walkthrough_isnt_resumed(tmp_path):
+    path = tmp_path / "walkthrough_state.json"
+    journal = walkthrough.WalkthroughJournal(path)
+    run(journal.start("Engineering", ["Figma", "Xcode"], {"Xcode"}))
+    run(journal.record("Figma", "success", "Installed"))
+    run(journal.finish())
+
+    assert json.loads(path.read_text())["complete"]
+    assert not walkthrough.WalkthroughJournal(path).load()
+
+
+def test_failed_apps_keep_the_journal_open(tmp_path):
+    path = tmp_path / "walkthrough_state.json"
+    journal = walkthrough.WalkthroughJournal(path)
+    run(journal.start("Engineering", ["Figma", "Xcode"], set()))
+    run(journal.complete_phase("role_app_selection"))
+    run(journal.record("Figma", "success", "Installed"))
+    run(journal.record("Xcode", "error", "Deferred, not enough disk space"))
+    run(journal.finish())
+
+    resumed = walkthrough.WalkthroughJournal(path)
+    assert resumed.load()
+    assert resumed.state["role"] == "Engineering"
+    assert resumed.phase_done("role_app_selection")
+    assert not resumed.phase_done("device_update")
+    assert resumed.completed_apps() == {"Figma"}
+
+
+def test_unreadable_or_unknown_journals_are_ignored(tmp_path):
+    path = tmp_path / "walkthrough_state.json"
+
+    path.write_text("{not json")
+    assert not walkthrough.WalkthroughJournal(path).load()
+
+    path.write_text(json.dumps({"version": 2, "phases": []}))
+    assert not walkthrough.WalkthroughJournal(path).load()
+
+    assert not walkthrough.WalkthroughJournal(tmp_path / "missing.json").load()
+
+
+def test_demo_journals_arent_written(tmp_path):
+    journal = walkthrough.WalkthroughJournal(None)
+    run(journal.start("Engineering", ["Figma"], set()))
+    run(journal.finish())
+
+    assert not journal.load()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_an_older_write_never_replaces_a_newer_one(tmp_path):
+    path = tmp_path / "walkthrough_state.json"
+    journal = walkthrough.WalkthroughJournal(path)
+
+    journal.write(2, {"version": 1, "phases": ["welcome"]})
+    journal.write(1, {"version": 1, "phases": []})
+
+    assert json.loads(path.read_text())["phases"] == ["welcome"]
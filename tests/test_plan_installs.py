@@ -0,0 +1,73 @@
+import pytest
+
+import _user_walkthrough as walkthrough
+
+
+@pytest.fixture(autouse=True)
+def thresholds(monkeypatch):
+    monkeypatch.setattr(walkthrough, "disk_reserve_mb", 10000)
+    monkeypatch.setattr(walkthrough, "disk_space_factor", 2)
+    monkeypatch.setattr(walkthrough, "slow_download_seconds", 600)
+    monkeypatch.setattr(walkthrough, "defer_download_seconds", 7200)
+
+
+apps = [
+    {"name": "Xcode", "index": 0, "size": 7500},
+    {"name": "Microsoft Office", "index": 1, "size": 2500},
+    {"name": "iTerm2", "index": 2, "size": None},
+    {"name": "Docker Desktop", "index": 3, "size": 600},
+]
+
+
+def names(apps):
+    return [app["name"] for app in apps]
+
+
+def test_nothing_changes_without_a_probe():
+    ordered, deferred, slow = walkthrough.plan_installs(apps, None)
+
+    assert ordered == apps
+    assert deferred == {}
+    assert slow == {}
+
+
+def test_apps_that_dont_fit_on_disk_are_deferred_smallest_first():
+    # Room for Docker and Office (6200 MB) but not Xcode as well
+    ordered, deferred, slow = walkthrough.plan_installs(
+        apps, {"free_mb": 10000 + 7000, "bandwidth": None}
+    )
+
+    assert deferred == {"Xcode": "Deferred, not enough disk space"}
+    assert names(ordered) == names(apps)
+
+
+def test_started_installs_use_disk_but_are_never_deferred():
+    ordered, deferred, slow = walkthrough.plan_installs(
+        apps, {"free_mb": 10000 + 15000, "bandwidth": None}, started={"Xcode"}
+    )
+
+    # Xcode's 15000 MB leaves nothing for the others
+    assert deferred == {
+        "Docker Desktop": "Deferred, not enough disk space",
+        "Microsoft Office": "Deferred, not enough disk space",
+    }
+
+
+def test_slow_downloads_start_last_and_very_slow_ones_are_deferred():
+    ordered, deferred, slow = walkthrough.plan_installs(
+        apps, {"free_mb": None, "bandwidth": 0.5}
+    )
+
+    assert deferred == {"Xcode": "Deferred, network too slow"}
+    assert slow == {"Docker Desktop": 1200, "Microsoft Office": 5000}
+    assert names(ordered) == ["Xcode", "iTerm2", "Docker Desktop", "Microsoft Office"]
+
+
+def test_apps_without_a_size_are_left_alone():
+    ordered, deferred, slow = walkthrough.plan_installs(
+        [apps[2]], {"free_mb": 0, "bandwidth": 0.001}
+    )
+
+    assert names(ordered) == ["iTerm2"]
+    assert deferred == {}
+    assert slow == {}
@@ -0,0 +1,30 @@
+import struct
+
+import _user_walkthrough as walkthrough
+
+
+def proc_event(what, pid, tgid):
+    """One netlink message carrying a proc connector event, as the kernel sends it"""
+    event = struct.pack("=IIQII", what, 0, 0, pid, tgid) + bytes(8)
+    cn_msg = struct.pack("=IIIIHH", 1, 1, 0, 0, len(event), 0)
+    body = cn_msg + event
+    return struct.pack("=IHHII", 16 + len(body), 3, 0, 0, 0) + body
+
+
+def test_proc_connector_pids_yields_the_tgid_of_exec_and_comm_events():
+    data = proc_event(0x2, 101, 100) + proc_event(0x200, 202, 200)
+
+    assert list(walkthrough.proc_connector_pids(data)) == [100, 200]
+
+
+def test_proc_connector_pids_skips_other_events():
+    # PROC_EVENT_FORK and PROC_EVENT_EXIT
+    data = proc_event(0x1, 301, 300) + proc_event(0x80000000, 401, 400)
+
+    assert list(walkthrough.proc_connector_pids(data)) == []
+
+
+def test_proc_connector_pids_stops_at_a_truncated_message():
+    data = proc_event(0x2, 101, 100)
+
+    assert list(walkthrough.proc_connector_pids(data[:-16])) == []
@@ -0,0 +1,72 @@
+import asyncio
+import json
+import logging
+import os
+
+import pytest
+
+import _user_walkthrough as walkthrough
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+stub_jamf = os.path.join(tests_dir, "..", "benchmarks", "stubs", "jamf")
+
+policy_json = json.dumps(
+    {
+        "steps": [
+            {"listitem": "Rosetta", "trigger_list": [{"trigger": "install-Rosetta"}]},
+            {"listitem": "Dialog", "trigger_list": [{"trigger": "install-Dialog"}]},
+            {"listitem": "Office", "trigger_list": [{"trigger": "install-Office"}]},
+        ]
+    }
+)
+
+
+@pytest.fixture(autouse=True)
+def enrolment(tmp_path, monkeypatch):
+    monkeypatch.setattr(walkthrough, "jamf_binary", stub_jamf)
+    monkeypatch.setattr(walkthrough, "enrolment_log", str(tmp_path / "management.log"))
+    monkeypatch.setattr(walkthrough.tracer, "path", None)
+    monkeypatch.setenv("STUB_JAMF_SLEEP", "0")
+
+
+def run_steps(tmp_path, steps_done):
+    steps = walkthrough.parse_policy_array(policy_json)
+    return asyncio.run(
+        walkthrough.run_enrolment_steps(
+            steps, False, commandfile=str(tmp_path / "dialog.log"), steps_done=steps_done
+        )
+    )
+
+
+def test_finished_steps_are_counted(tmp_path):
+    steps_done = tmp_path / "steps_done"
+
+    run_steps(tmp_path, str(steps_done))
+
+    assert steps_done.read_text() == "3\n"
+
+
+def test_the_count_stops_where_the_engine_died(tmp_path, monkeypatch):
+    steps_done = tmp_path / "steps_done"
+    run_enrolment_trigger = walkthrough.run_enrolment_trigger
+
+    async def crash_on_office(trigger, testing_mode, index=None):
+        if trigger == "install-Office":
+            raise RuntimeError("engine crashed")
+        return await run_enrolment_trigger(trigger, testing_mode, index)
+
+    monkeypatch.setattr(walkthrough, "run_enrolment_trigger", crash_on_office)
+
+    with pytest.raises(RuntimeError):
+        run_steps(tmp_path, str(steps_done))
+
+    assert steps_done.read_text() == "2\n"
+
+
+def test_sub_policy_output_is_logged_at_info(tmp_path, caplog):
+    with caplog.at_level(logging.INFO, logger=walkthrough.logger.name):
+        run_steps(tmp_path, None)
+
+    assert "install-Rosetta: Successfully installed install-Rosetta.pkg." in [
+        record.getMessage() for record in caplog.records if record.levelno == logging.INFO
+    ]
@@ -0,0 +1,76 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import _user_walkthrough as walkthrough
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.join(tests_dir, "..")
+stub_jamf = os.path.join(repo_dir, "benchmarks", "stubs", "jamf")
+
+pytestmark = pytest.mark.skipif(
+    sys.platform not in ("darwin", "linux"), reason="process_ids needs libproc or /proc"
+)
+
+
+def test_a_jamf_parent_isnt_waited_on(tmp_path):
+    # Stands in for the jamf policy that launches the walkthrough, which outlives it
+    parent = tmp_path / "jamf"
+    parent.write_text('#!/bin/bash\n"$@"\necho "parent exit $?"\n')
+    parent.chmod(0o755)
+    child = (
+        "import asyncio, sys, time\n"
+        f"sys.path.insert(0, {repo_dir!r})\n"
+        "import _user_walkthrough as walkthrough\n"
+        f"walkthrough.jamf_binary = {str(parent)!r}\n"
+        "start_time = time.monotonic()\n"
+        "result = asyncio.run(walkthrough.wait_for_jamf(5))\n"
+        "print(result, round(time.monotonic() - start_time, 1))\n"
+    )
+
+    output = subprocess.run(
+        [str(parent), sys.executable, "-c", child],
+        capture_output=True,
+        text=True,
+        timeout=30,
+    ).stdout.split()
+
+    assert output[:1] == ["True"]
+    assert float(output[1]) < 2
+
+
+def test_our_own_jamf_runs_arent_waited_on(monkeypatch):
+    monkeypatch.setattr(walkthrough, "jamf_binary", stub_jamf)
+    monkeypatch.setenv("STUB_JAMF_SLEEP", "3")
+
+    async def run():
+        install = asyncio.create_task(walkthrough.run_jamf_policy("install-Figma"))
+        while not walkthrough.jamf_pids:
+            await asyncio.sleep(0.05)
+        start_time = time.monotonic()
+        result = await walkthrough.wait_for_jamf(10)
+        waited = time.monotonic() - start_time
+        await install
+        return result, waited
+
+    result, waited = asyncio.run(run())
+
+    assert result
+    assert waited < 2
+    assert walkthrough.jamf_pids == set()
+
+
+def test_other_jamf_runs_are_waited_on(tmp_path, monkeypatch):
+    monkeypatch.setattr(walkthrough, "jamf_binary", stub_jamf)
+    other = subprocess.Popen([stub_jamf, "policy"], env={**os.environ, "STUB_JAMF_SLEEP": "1"})
+
+    try:
+        start_time = time.monotonic()
+        assert asyncio.run(walkthrough.wait_for_jamf(10))
+        assert time.monotonic() - start_time > 0.5
+    finally:
+        other.wait()
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+import _user_walkthrough as walkthrough
+
+Step = walkthrough.WalkthroughStep
+
+
+def run_steps(steps, journal=None):
+    return asyncio.run(
+        walkthrough.run_walkthrough_steps(steps, journal or walkthrough.WalkthroughJournal(None))
+    )
+
+
+async def value(result):
+    return result
+
+
+async def fail(results):
+    raise OSError("Read-only file system")
+
+
+def test_steps_get_the_results_they_need():
+    results = run_steps(
+        [
+            Step("patch_feed", lambda results: value("feed"), phase=False),
+            Step("welcome", lambda results: value("welcome")),
+            Step(
+                "device_update",
+                lambda results: value(results["patch_feed"] + " checked"),
+                needs=["patch_feed"],
+                after=["welcome"],
+            ),
+        ]
+    )
+
+    assert results == {"patch_feed": "feed", "welcome": "welcome", "device_update": "feed checked"}
+
+
+def test_a_failed_background_step_resolves_to_none():
+    results = run_steps(
+        [
+            Step("app_icons", fail, phase=False),
+            Step(
+                "role_app_selection",
+                lambda results: value(results["app_icons"]),
+                needs=["app_icons"],
+            ),
+        ]
+    )
+
+    assert results == {"app_icons": None, "role_app_selection": None}
+
+
+def test_a_failed_phase_still_stops_the_walkthrough():
+    with pytest.raises(OSError):
+        run_steps([Step("welcome", fail)])
+
+
+def test_completed_phases_are_resumed():
+    journal = walkthrough.WalkthroughJournal(None)
+    journal.state["phases"].append("role_app_selection")
+
+    results = run_steps(
+        [
+            Step(
+                "role_app_selection",
+                lambda results: value("asked again"),
+                resume=lambda results: value("resumed"),
+            )
+        ],
+        journal,
+    )
+
+    assert results == {"role_app_selection": "resumed"}
+
+
+def test_steps_can_only_need_earlier_steps():
+    with pytest.raises(ValueError, match="isn't declared before it"):
+        run_steps([Step("installs", lambda results: value(None), needs=["role_app_selection"])])
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# Caching mirror for enrolment downloads, so an office behind a thin uplink fetches each
+# artifact once rather than once per Mac. Clients ask for http://mirror:8080/<host>/<path>
+# and the mirror fetches https://<host>/<path> the first time, then serves it from disk.
+# After -max-age seconds it revalidates with the upstream ETag and Last-Modified, and it
+# serves the stale copy if upstream can't be reached. Only -allow hosts are fetched.
+# Usage: python3 tools/download_mirror.py -cache /var/cache/swiftEnrolment -allow COMPANY.jamfcloud.com
+
+import argparse
+import hashlib
+import http.server
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from email.utils import parsedate_to_datetime
+
+default_hosts = ["jamf-patch.jamfcloud.com", "api.github.com", "github.com"]
+upstream_timeout = 30
+# Response headers kept from upstream and replayed to clients
+kept_headers = ("Content-Type", "ETag", "Last-Modified")
+
+logger = logging.getLogger("download_mirror")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-cache",
+        required=True,
+        help="Directory to keep downloaded artifacts in",
+    )
+    parser.add_argument(
+        "-port",
+        default=8080,
+        type=int,
+        help="Port to listen on, default=8080",
+    )
+    parser.add_argument(
+        "-bind",
+        default="0.0.0.0",
+        help="Address to listen on, default=0.0.0.0",
+    )
+    parser.add_argument(
+        "-allow",
+        action="append",
+        default=[],
+        help=f"Upstream host to mirror, can be repeated. Always allowed: {', '.join(default_hosts)}",
+    )
+    parser.add_argument(
+        "-max-age",
+        default=300,
+        type=int,
+        help="Seconds a copy is served before it's revalidated upstream, default=300",
+    )
+    parser.add_argument(
+        "-upstream-scheme",
+        default="https",
+        help="Scheme used to reach upstream hosts, e.g. http for a test server, default=https",
+    )
+    parser.add_argument(
+        "-log",
+        default="info",
+        help="Log level, default=info",
+    )
+    return parser.parse_args()
+
+
+class MirrorCache:
+    """Artifacts on disk, each a body file and a JSON file of its upstream headers"""
+
+    def __init__(self, cache_dir, max_age, upstream_scheme="https"):
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.upstream_scheme = upstream_scheme
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def lock(self, key):
+        with self.locks_lock:
+            if key not in self.locks:
+                self.locks[key] = threading.Lock()
+            return self.locks[key]
+
+    def paths(self, key):
+        base = os.path.join(self.cache_dir, key)
+        return f"{base}.body", f"{base}.json"
+
+    def load(self, key):
+        body_path, meta_path = self.paths(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if os.path.exists(body_path) else None
+
+    def get(self, upstream):
+        """Returns (metadata, body path, how it was served), fetching upstream when needed"""
+        key = hashlib.sha256(upstream.encode()).hexdigest()
+        body_path, meta_path = self.paths(key)
+
+        # One upstream fetch per artifact, however many Macs ask for it at once
+        with self.lock(key):
+            meta = self.load(key)
+            if meta and time.time() - meta["fetched"] < self.max_age:
+                return meta, body_path, "hit"
+
+            request = urllib.request.Request(upstream, headers={"User-Agent": "swiftEnrolment-mirror"})
+            if meta:
+                if meta["headers"].get("ETag"):
+                    request.add_header("If-None-Match", meta["headers"]["ETag"])
+                if meta["headers"].get("Last-Modified"):
+                    request.add_header("If-Modified-Since", meta["headers"]["Last-Modified"])
+
+            try:
+                with urllib.request.urlopen(request, timeout=upstream_timeout) as response:
+                    fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".download.")
+                    try:
+                        with os.fdopen(fd, "wb") as f:
+                            shutil.copyfileobj(response, f, 65536)
+                        os.replace(temp_path, body_path)
+                    except BaseException:
+                        os.remove(temp_path)
+                        raise
+                    meta = {
+                        "url": upstream,
+                        "fetched": time.time(),
+                        "headers": {
+                            name: response.headers[name]
+                            for name in kept_headers
+                            if response.headers.get(name)
+                        },
+                    }
+                    served = "miss"
+            except urllib.error.HTTPError as e:
+                if e.code != 304 or not meta:
+                    raise
+                meta["fetched"] = time.time()
+                served = "revalidated"
+            except (urllib.error.URLError, OSError) as e:
+                if not meta:
+                    raise
+                # A stale artifact beats no artifact while the uplink is down
+                logger.warning(f"Serving stale {upstream}: {e}")
+                return meta, body_path, "stale"
+
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".meta.")
+            with os.fdopen(fd, "w") as f:
+                json.dump(meta, f)
+            os.replace(temp_path, meta_path)
+
+        return meta, body_path, served
+
+
+class MirrorHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def do_HEAD(self):
+        self.serve(body=False)
+
+    def do_GET(self):
+        self.serve(body=True)
+
+    def serve(self, body):
+        host, _, path = self.path.lstrip("/").partition("/")
+        if host not in self.server.allowed_hosts:
+            self.send_error(404, f"{host} isn't mirrored")
+            return
+
+        upstream = f"{self.server.cache.upstream_scheme}://{host}/{path}"
+        try:
+            meta, body_path, served = self.server.cache.get(upstream)
+        except urllib.error.HTTPError as e:
+            # Clients fall back to the next mirror or upstream itself on any error
+            self.send_error(e.code if e.code >= 400 else 502)
+            return
+        except (urllib.error.URLError, OSError) as e:
+            logger.warning(f"Unable to fetch {upstream}: {e}")
+            self.send_error(502)
+            return
+        logger.info(f"{served} {upstream}")
+
+        headers = dict(meta["headers"])
+        age = max(0, int(time.time() - meta["fetched"]))
+        headers["Age"] = str(age)
+        headers["Cache-Control"] = f"max-age={max(0, self.server.cache.max_age - age)}"
+
+        if self.not_modified(headers):
+            self.send_response(304)
+            for name, value in headers.items():
+                if name != "Content-Type":
+                    self.send_header(name, value)
+            self.end_headers()
+            return
+
+        with open(body_path, "rb") as f:
+            self.send_response(200)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+            self.end_headers()
+            if body:
+                shutil.copyfileobj(f, self.wfile, 65536)
+
+    def not_modified(self, headers):
+        # If-None-Match wins over If-Modified-Since, as in RFC 9110
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match:
+            etags = [etag.strip() for etag in if_none_match.split(",")]
+            return headers.get("ETag") in etags or "*" in etags
+
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since and headers.get("Last-Modified"):
+            try:
+                return parsedate_to_datetime(headers["Last-Modified"]) <= parsedate_to_datetime(
+                    if_modified_since
+                )
+            except (TypeError, ValueError):
+                return False
+
+        return False
+
+
+class MirrorServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, cache, allowed_hosts):
+        super().__init__(address, MirrorHandler)
+        self.cache = cache
+        self.allowed_hosts = set(allowed_hosts)
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(
+        level=getattr(logging, args.log.upper()),
+        format="%(asctime)s %(levelname)-8s %(message)s",
+    )
+
+    cache = MirrorCache(args.cache, args.max_age, args.upstream_scheme)
+    server = MirrorServer((args.bind, args.port), cache, default_hosts + args.allow)
+    logger.info(f"Mirroring {', '.join(sorted(server.allowed_hosts))} on port {args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# Turns management_info.plist files and enrolment logs collected from a fleet into phase
+# and per-trigger durations, with p50/p95/p99 tables. Every directory holding any of the
+# files below is treated as one device, e.g. collected/<serial>/management.log
+# Usage: python3 tools/enrolment_analytics.py /path/to/collected -top 20
+
+import argparse
+import json
+import mmap
+import os
+import plistlib
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+management_info = "management_info.plist"
+log_names = ("management.log", "swiftEnrolment.log")
+trace_name = "swiftEnrolment_trace.jsonl"
+
+# Phase name, start key and end key in management_info.plist
+plist_phases = [
+    ("prestage", "enrol_prestage_start", "enrol_prestage_end"),
+    ("initial_policy", "enrol_initial_policy_start", "enrol_initial_policy_end"),
+    ("login_policy", "enrol_login_policy_start", "enrol_login_policy_end"),
+    ("total", "enrol_prestage_start", "enrol_login_policy_end"),
+]
+
+# 000_enrolment.sh and _user_walkthrough.py: 2023-11-20 10:15:02+1100 - message
+iso_line = re.compile(rb"^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d[+-]\d{4}) - (.*)$")
+# PreStage and post enrolment scripts use date's default: Mon Nov 20 10:15:02 AEDT 2023 - message
+date_line = re.compile(
+    rb"^\w{3} (\w{3}) +(\d{1,2}) (\d\d:\d\d:\d\d) (?:\S+ )?(\d{4}) - (.*)$"
+)
+running = re.compile(
+    rb'^(?:\S+ )?(?:RUNNING: \S+ (?:policy -event )?|SCRIPT: Running "jamf )([^"\s]+)'
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "root",
+        help="Directory tree of collected plists and logs",
+    )
+    parser.add_argument(
+        "-workers",
+        default=None,
+        type=int,
+        help="Number of worker processes, default=number of CPUs",
+    )
+    parser.add_argument(
+        "-top",
+        default=None,
+        type=int,
+        help="Only show the triggers with the most total time",
+    )
+    parser.add_argument(
+        "-json",
+        action="store_true",
+        help="Print results as JSON instead of tables",
+    )
+    return parser.parse_args()
+
+
+def find_devices(root):
+    """Yields {kind: [paths]} for every directory under root with enrolment files"""
+    for dirpath, _, filenames in os.walk(root):
+        device = {}
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if filename == management_info:
+                device.setdefault("plist", []).append(path)
+            elif filename.startswith(trace_name):
+                device.setdefault("trace", []).append(path)
+            elif filename.startswith(log_names):
+                device.setdefault("log", []).append(path)
+        if device:
+            yield device
+
+
+def parse_timestamp(line):
+    """Returns (seconds since the epoch, message) for an echo_logger line, or None"""
+    result = None
+
+    match = iso_line.match(line)
+    if match:
+        timestamp = datetime.strptime(match.group(1).decode(), "%Y-%m-%d %H:%M:%S%z")
+        result = (timestamp.timestamp(), match.group(2))
+        return result
+
+    match = date_line.match(line)
+    if match:
+        month, day, clock, year, message = (group.decode() for group in match.groups())
+        try:
+            # The zone is an abbreviation, durations within one log are still accurate
+            timestamp = datetime.strptime(f"{year} {month} {day} {clock}", "%Y %b %d %H:%M:%S")
+        except ValueError:
+            return result
+        result = (timestamp.timestamp(), message.encode())
+
+    return result
+
+
+def log_lines(path):
+    """Yields each line of path from a read-only memory map"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as log:
+            for line in iter(log.readline, b""):
+                yield line.rstrip(b"\r\n")
+
+
+def log_trigger_durations(path):
+    """Times each RUNNING: trigger until the next timestamped line in the same log"""
+    result = []
+    current = None
+
+    for line in log_lines(path):
+        parsed = parse_timestamp(line)
+        if not parsed:
+            continue
+        timestamp, message = parsed
+
+        if current:
+            result.append((current[0], timestamp - current[1]))
+            current = None
+
+        match = running.match(message)
+        if match:
+            current = (match.group(1).decode(errors="replace"), timestamp)
+
+    return result
+
+
+def plist_phase_durations(path):
+    result = []
+
+    try:
+        with open(path, "rb") as f:
+            info = plistlib.load(f)
+    except (OSError, plistlib.InvalidFileException, ValueError):
+        return result
+
+    for phase, start_key, end_key in plist_phases:
+        try:
+            # defaults write stores these as strings
+            duration = int(info[end_key]) - int(info[start_key])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if duration >= 0:
+            result.append((phase, duration))
+
+    return result
+
+
+def trace_durations(path):
+    """Returns (phases, triggers) from a JSON Lines trace written by Tracer or trace_span"""
+    phases = []
+    triggers = []
+
+    with open(path, errors="replace") as f:
+        for line in f:
+            try:
+                span = json.loads(line)
+                entry = (f"{span['source']}/{span['name']}", float(span["duration"]))
+            except (ValueError, KeyError, TypeError):
+                continue
+            if span.get("kind") == "trigger":
+                triggers.append((span["name"], entry[1]))
+            elif span.get("kind") == "phase":
+                phases.append(entry)
+
+    return phases, triggers
+
+
+def analyse_device(device):
+    """Runs in a worker process, returns the durations found for one device"""
+    result = {"phases": [], "triggers": []}
+
+    for path in device.get("plist", []):
+        result["phases"] += plist_phase_durations(path)
+
+    for path in device.get("trace", []):
+        phases, triggers = trace_durations(path)
+        result["phases"] += phases
+        result["triggers"] += triggers
+
+    # Trace spans are exact, only fall back to log timestamps without them
+    if not result["triggers"]:
+        for path in device.get("log", []):
+            result["triggers"] += log_trigger_durations(path)
+
+    return result
+
+
+def percentile(values, pct):
+    """Linear interpolation between closest ranks, values must be sorted"""
+    position = (len(values) - 1) * pct / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarise(durations, top=None):
+    result = []
+
+    for name, values in durations.items():
+        values.sort()
+        result.append(
+            {
+                "name": name,
+                "count": len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "max": values[-1],
+                "total": sum(values),
+            }
+        )
+
+    result.sort(key=lambda row: row["total"], reverse=True)
+    return result[:top] if top else result
+
+
+def table(title, rows):
+    header = ("NAME", "COUNT", "P50", "P95", "P99", "MAX", "TOTAL")
+    lines = [header] + [
+        (
+            row["name"],
+            str(row["count"]),
+            *(f"{row[key]:.1f}" for key in ("p50", "p95", "p99", "max", "total")),
+        )
+        for row in rows
+    ]
+    widths = [max(len(line[i]) for line in lines) for i in range(len(header))]
+
+    result = "\n".join(
+        "  ".join(value.ljust(width) for value, width in zip(line, widths)).rstrip()
+        for line in lines
+    )
+    return f"{title} (seconds)\n{result}"
+
+
+def main():
+    args = parse_args()
+    if not os.path.isdir(args.root):
+        sys.exit(f"{args.root} is not a directory")
+
+    devices = 0
+    phases = {}
+    triggers = {}
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for device in executor.map(analyse_device, find_devices(args.root), chunksize=64):
+            devices += 1
+            for name, duration in device["phases"]:
+                phases.setdefault(name, []).append(duration)
+            for name, duration in device["triggers"]:
+                triggers.setdefault(name, []).append(duration)
+
+    result = {
+        "devices": devices,
+        "phases": summarise(phases),
+        "triggers": summarise(triggers, args.top),
+    }
+
+    if args.json:
+        print(json.dumps(result, indent=4))
+    else:
+        print(f"Devices: {devices}\n")
+        print(table("Phases", result["phases"]))
+        print()
+        print(table("Triggers", result["triggers"]))
+
+
+if __name__ == "__main__":
+    main()